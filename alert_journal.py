@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""Journal write-ahead de alertas: /webhook responde cuando la alerta ya está en disco.
+
+Las alertas aceptadas se añaden a un archivo append-only. Un hilo agrupa lo que
+llega mientras se hace el fsync anterior (más una ventana opcional de unos
+milisegundos) en un solo write + fdatasync: group commit, el coste del fsync se
+reparte entre todas las alertas del lote. Al terminar cada alerta se añade su
+registro DONE.
+
+Las etapas con efectos en CoinEx también se anotan (STAGE): "order" antes de
+enviar la orden (y esperando al disco), "filled" con el SL/TP calculados y
+"protected". Una alerta recuperada que ya anotó "order" nunca vuelve a enviar
+la orden: solo se completa su protección.
+
+Tras una caída, las alertas sin DONE cuyo dueño ya no vive se recuperan al
+arrancar. El dueño es un token por proceso con un flock en
+<journal>.owners/<token>.lock: el kernel lo suelta al morir el proceso, sin
+depender de que no se reutilice el pid (en un contenedor el pid se repite).
+
+    registro: [a5 5a | crc32 | tipo | longitud] [cuerpo]
+      ACCEPT: token(8) id(16) recibida(d) alerta(JSON)
+      CLAIM:  token(8) id(16)
+      STAGE:  id(16) etapa(JSON {"stage": ..., datos})
+      DONE:   id(16)
+"""
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+from logging_setup import kv
+from shared_state import ProcessLock
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso, sin comprobación de dueños vivos
+    fcntl = None
+
+_SYNC = b"\xa5\x5a"
+_RECORD = struct.Struct("<2sIBI")  # marca, crc32 (tipo + cuerpo), tipo, longitud del cuerpo
+_ACCEPT = struct.Struct("<8s16sd")
+_CLAIM = struct.Struct("<8s16s")
+ACCEPT, CLAIM, DONE, STAGE = 1, 2, 3, 4
+
+_fsync = getattr(os, "fdatasync", os.fsync)
+
+log = logging.getLogger("alert.journal")
+
+
+def _record(kind, body):
+    return _RECORD.pack(_SYNC, zlib.crc32(bytes((kind,)) + body), kind, len(body)) + body
+
+
+def scan(data):
+    """Registros válidos [(tipo, cuerpo)] y bytes descartados
+
+    Un registro cortado o corrupto se salta hasta la siguiente marca: lo que otros
+    procesos escribieron detrás sigue siendo legible.
+    """
+    records = []
+    offset = 0
+    discarded = 0
+    while offset < len(data):
+        if offset + _RECORD.size <= len(data):
+            sync, crc, kind, length = _RECORD.unpack_from(data, offset)
+            start = offset + _RECORD.size
+            body = data[start:start + length]
+            if sync == _SYNC and len(body) == length and zlib.crc32(bytes((kind,)) + body) == crc:
+                records.append((kind, body))
+                offset = start + length
+                continue
+        following = data.find(_SYNC, offset + 1)
+        following = len(data) if following < 0 else following
+        discarded += following - offset
+        offset = following
+    return records, discarded
+
+
+def pending_alerts(records):
+    """{id: [token del dueño, recibida, alerta JSON, {etapa: datos}]} de las alertas aceptadas sin DONE"""
+    pending = {}
+    for kind, body in records:
+        if kind == ACCEPT:
+            token, alert_id, received_at = _ACCEPT.unpack_from(body)
+            pending[alert_id] = [token, received_at, body[_ACCEPT.size:], {}]
+        elif kind == CLAIM:
+            token, alert_id = _CLAIM.unpack(body)
+            if alert_id in pending:
+                pending[alert_id][0] = token
+        elif kind == STAGE:
+            entry = pending.get(body[:16])
+            if entry is not None:
+                data = json.loads(body[16:])
+                entry[3][data.pop("stage")] = data
+        elif kind == DONE:
+            pending.pop(body, None)
+    return pending
+
+
+def _stage_record(alert_id, name, data):
+    return _record(STAGE, alert_id + json.dumps(dict(data, stage=name)).encode("utf-8"))
+
+
+class _Batch(object):
+    """Registros de una ventana de group commit; quien escribe espera a `done`"""
+    __slots__ = ("records", "done", "error")
+
+    def __init__(self):
+        self.records = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class AlertJournal(object):
+    """Archivo append-only compartido por todos los workers, con group commit por proceso"""
+
+    def __init__(self, path, commit_interval=0.0, compact_bytes=1 << 20, fsync=True, commit_timeout=5.0):
+        self.path = path
+        self.owners_dir = path + ".owners"
+        self.commit_interval = commit_interval
+        self.commit_timeout = commit_timeout  # Espera máxima al disco antes de fallar con TimeoutError
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self.commits = 0
+        self.records = 0
+        self.compactions = 0
+        self.discarded_bytes = 0
+        self._compact_at = compact_bytes
+        os.close(os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600))
+        self.lock = ProcessLock(path + ".lock")  # Aparte: la compactación reemplaza el journal
+        self._pid = None
+        self._fd = None
+
+    def _process(self):
+        """Estado propio de cada proceso (token, descriptor, hilo de commit); se rehace tras un fork"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._fd = None
+        self.batch = _Batch()
+        self.batch_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closing = False
+        os.makedirs(self.owners_dir, exist_ok=True)
+        self.token = os.urandom(8)
+        self._owner_fd = os.open(self._owner_path(self.token), os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            fcntl.flock(self._owner_fd, fcntl.LOCK_EX)
+        self._flusher = threading.Thread(target=self._flush_loop, name="alert-journal", daemon=True)
+        self._flusher.start()
+
+    def _owner_path(self, token):
+        return os.path.join(self.owners_dir, token.hex() + ".lock")
+
+    def _owner_alive(self, token):
+        if token == self.token:
+            return True
+        if fcntl is None:
+            return False  # Sin flock (Windows) solo hay un proceso: los demás dueños son de antes
+        try:
+            fd = os.open(self._owner_path(token), os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        return False
+
+    # --- escritura ---
+
+    def _descriptor(self):
+        """Descriptor del journal actual (otro proceso puede haberlo reemplazado al compactar)"""
+        if self._fd is not None:
+            try:
+                if os.fstat(self._fd).st_ino == os.stat(self.path).st_ino:
+                    return self._fd
+            except FileNotFoundError:
+                pass
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        return self._fd
+
+    def _write(self, data):
+        with self.lock:
+            fd = self._descriptor()
+            os.write(fd, data)
+            if self.fsync:
+                _fsync(fd)
+            self.commits += 1
+            if os.fstat(fd).st_size >= self._compact_at:
+                self._compact()
+
+    def _append(self, record):
+        self._process()
+        with self.batch_lock:
+            batch = self.batch
+            batch.records.append(record)
+            self.wakeup.set()
+        return batch
+
+    def _flush_loop(self):
+        while True:
+            self.wakeup.wait()
+            if self.commit_interval:
+                time.sleep(self.commit_interval)  # Ventana de agrupación
+            with self.batch_lock:
+                batch, self.batch = self.batch, _Batch()
+                self.wakeup.clear()
+            try:
+                if batch.records:
+                    self._write(b"".join(batch.records))
+                    self.records += len(batch.records)
+            except Exception as e:
+                # Cualquier fallo llega a quien espera como OSError y el hilo sigue con el próximo lote
+                batch.error = e if isinstance(e, OSError) else OSError(str(e))
+                log.error("❌ No se pudo escribir el journal de alertas", extra=kv(error=str(e)))
+            finally:
+                batch.done.set()
+            if self.closing:
+                with self.batch_lock:
+                    if not self.batch.records:  # Lo añadido mientras escribía también se escribe
+                        return
+
+    def _commit(self, record):
+        batch = self._append(record)
+        if not batch.done.wait(self.commit_timeout):
+            log.error("⌛ El journal de alertas no confirmó la escritura a tiempo",
+                      extra=kv(timeout_s=self.commit_timeout))
+            raise TimeoutError(f"journal sin confirmar tras {self.commit_timeout} s")
+        if batch.error is not None:
+            raise batch.error
+
+    def accept(self, payload, received_at):
+        """Guarda la alerta (bytes JSON) y vuelve cuando está en disco; devuelve su id"""
+        alert_id = uuid.uuid4().bytes
+        self._process()
+        try:
+            self._commit(_record(ACCEPT, _ACCEPT.pack(self.token, alert_id, received_at) + payload))
+        except TimeoutError:
+            self._append(_record(DONE, alert_id))  # Rechazada: si el ACCEPT llega a escribirse, queda anulado
+            raise
+        return alert_id
+
+    def stage(self, alert_id, name, data=None, durable=False):
+        """Anota una etapa de la alerta; con `durable` vuelve cuando está en disco"""
+        record = _stage_record(alert_id, name, data or {})
+        if durable:
+            self._commit(record)
+        else:
+            self._append(record)
+
+    def done(self, alert_id):
+        self._commit(_record(DONE, alert_id))
+
+    # --- recuperación y compactación ---
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+        records, discarded = scan(data)
+        if discarded:
+            self.discarded_bytes += discarded
+            log.warning("⚠️ Bytes corruptos en el journal de alertas", extra=kv(discarded_bytes=discarded))
+        return pending_alerts(records)
+
+    def recover(self):
+        """♻️ Reclama las alertas pendientes de procesos muertos: [(id, recibida, alerta, etapas)]"""
+        self._process()
+        recovered = []
+        with self.lock:
+            alive = {}
+            for alert_id, (token, received_at, payload, stages) in self._read().items():
+                if token not in alive:
+                    alive[token] = self._owner_alive(token)
+                if not alive[token]:
+                    recovered.append((alert_id, received_at, json.loads(payload), stages))
+            if recovered:
+                claims = b"".join(_record(CLAIM, _CLAIM.pack(self.token, alert_id)) for alert_id, _, _, _ in recovered)
+                self._write(claims)
+            # Tokens de procesos terminados (con o sin alertas pendientes)
+            for name in os.listdir(self.owners_dir):
+                token = bytes.fromhex(name.split(".")[0])
+                if not alive.get(token, self._owner_alive(token)):
+                    try:
+                        os.remove(os.path.join(self.owners_dir, name))
+                    except FileNotFoundError:
+                        pass
+        recovered.sort(key=lambda item: item[1])
+        return recovered
+
+    def _compact(self):
+        """Reescribe el journal con solo las alertas pendientes (con el lock tomado)"""
+        pending = self._read()
+        temporary = self.path + ".tmp"
+        with open(temporary, "wb") as f:
+            for alert_id, (token, received_at, payload, stages) in pending.items():
+                f.write(_record(ACCEPT, _ACCEPT.pack(token, alert_id, received_at) + payload))
+                for name, data in stages.items():
+                    f.write(_stage_record(alert_id, name, data))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.compactions += 1
+        # Si lo pendiente ya ocupa mucho, no recompactar en cada escritura
+        self._compact_at = max(self.compact_bytes, 2 * os.path.getsize(self.path))
+
+    def close(self):
+        """Escribe lo pendiente, para el hilo de commit y libera el token (antes de un fork)"""
+        if self._pid != os.getpid():
+            return
+        self.closing = True
+        self.wakeup.set()
+        self._flusher.join()
+        if self._fd is not None:
+            os.close(self._fd)
+        os.close(self._owner_fd)  # Suelta el flock: otro proceso puede reclamar lo que quede
+        self._pid = None
+
+    def stats(self):
+        return {"commits": self.commits, "records": self.records, "compactions": self.compactions,
+                "discarded_bytes": self.discarded_bytes}
+
+
+class AlertStages(object):
+    """Etapas de una alerta del journal: las ya anotadas (si se recuperó) y las que va marcando"""
+
+    __slots__ = ("journal", "alert_id", "recorded")
+
+    def __init__(self, journal, alert_id, recorded=None):
+        self.journal = journal
+        self.alert_id = alert_id
+        self.recorded = recorded or {}
+
+    def mark(self, name, durable=False, data=None):
+        self.recorded[name] = data or {}
+        self.journal.stage(self.alert_id, name, data, durable)
+
+    def get(self, name):
+        return self.recorded.get(name)
+
+    def __contains__(self, name):
+        return name in self.recorded
+
+
+class AlertQueue(object):
+    """Ejecuta en segundo plano las alertas ya guardadas en el journal
+
+    `handler(alert, received_at, context, stages)` recibe el dict original de
+    TradingView y sus `AlertStages`; las alertas que llevan en cola (o en el
+    journal) más de `max_age` segundos se descartan sin ejecutar, salvo las que ya
+    enviaron su orden (etapa "order"): a esas aún les falta la protección.
+    """
+
+    def __init__(self, journal, handler, workers=4, max_age=60.0):
+        self.journal = journal
+        self.handler = handler
+        self.workers = workers
+        self.max_age = max_age
+        self.queue = queue.Queue()
+        self.accepted = 0
+        self.recovered = 0
+        self.executed = 0
+        self.stale = 0
+        self.failed = 0
+        self._threads = []
+        self._pid = None
+
+    def start(self):
+        """Arranca los hilos de ejecución y reencola lo que quedó pendiente de procesos muertos"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.queue = queue.Queue()
+        self._threads = [threading.Thread(target=self._run, name=f"alert-exec-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        for alert_id, received_at, alert, stages in self.journal.recover():
+            self.recovered += 1
+            log.warning("♻️ Alerta recuperada del journal",
+                        extra=kv(age_s=round(time.time() - received_at, 3), alert=alert, stages=sorted(stages)))
+            self.queue.put((alert_id, alert, received_at, None, stages))
+
+    def submit(self, alert, context=None):
+        """Guarda la alerta (espera al group commit) y la encola; OSError si no llega a disco"""
+        self.start()
+        received_at = time.time()
+        alert_id = self.journal.accept(json.dumps(alert).encode("utf-8"), received_at)
+        self.accepted += 1
+        self.queue.put((alert_id, alert, received_at, context, {}))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            alert_id, alert, received_at, context, recorded = item
+            age = time.time() - received_at
+            try:
+                if age > self.max_age and "order" not in recorded:
+                    self.stale += 1
+                    log.warning("⌛ Alerta demasiado vieja, se descarta", extra=kv(age_s=round(age, 3), alert=alert))
+                else:
+                    self.handler(alert, received_at, context, AlertStages(self.journal, alert_id, recorded))
+                    self.executed += 1
+            except Exception as e:
+                self.failed += 1
+                log.error("🔥 Error ejecutando alerta del journal", extra=kv(error=str(e)))
+            finally:
+                try:
+                    self.journal.done(alert_id)
+                except OSError as e:
+                    log.error("❌ No se pudo marcar la alerta como hecha", extra=kv(error=str(e)))
+
+    def stop(self):
+        """Termina lo encolado y cierra el journal de este proceso (antes del fork de gunicorn)"""
+        if self._pid != os.getpid():
+            return
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.journal.close()
+        self._pid = None
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return dict(self.journal.stats(), accepted=self.accepted, recovered=self.recovered,
+                    executed=self.executed, stale=self.stale, failed=self.failed, queued=self.depth())
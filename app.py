@@ -1,24 +1,44 @@
 # -*- coding: utf-8 -*-
-import asyncio
-import json
 import time
+_import_started = time.perf_counter()  # ⏱️ Inicio del arranque (imports incluidos)
+import json
 import hashlib
-import gzip
 import hmac
+import threading
 import requests
+from contextlib import asynccontextmanager
 from flask import Flask, request, jsonify
-from functools import wraps
 from urllib.parse import urlparse, urlencode
 import os
 from dotenv import load_dotenv
 import logging
 from datetime import datetime, timedelta
-
-logging.basicConfig(level=logging.INFO)
+from logging_setup import setup_logging, restart_logging, stop_logging, kv
+from protective import ProtectiveStage
+from telemetry import TelemetrySink
+from trade_context import TradeContext
+from tracing import Tracer
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from market_cache import MarketMetadataCache, LeverageStateCache, PositionCache, flip_fill
+from risk_journal import RiskJournal
+from alert_journal import AlertJournal, AlertQueue
+from preemption import MarketPreemption, Preempted
+from staleness import ServerClock, StalenessPolicy, alert_time, parse_max_ages
+from shared_state import SharedRiskState, default_path, default_rate_limiter
+from resilience import (
+    CoinExHTTPError, CircuitOpenError, RetryPolicy, HedgedCaller, SingleFlight, BreakerRegistry,
+    is_retryable_error, is_retryable_response,
+)
+
+# ⏱️ Tiempos de arranque expuestos en /ready y /metrics (milisegundos)
+startup_timings = {"imports_ms": round((time.perf_counter() - _import_started) * 1000, 1)}
 
 # Cargar variables del archivo .env
 load_dotenv()
 
+# 📝 Logging asíncrono: el camino de ejecución solo encola registros
+setup_logging()
+
 # Configuración API CoinEx
 # Ahora puedes acceder a ellas con os.getenv()
 
@@ -35,8 +55,98 @@ if not AZURE_FUNCTION_URL:
 API_URL = "https://api.coinex.com/v2/futures/order"  # URL para órdenes en futuros
 FINISHED_ORDERS_URL = "https://api.coinex.com/v2/futures/order/list-finished-order"  # URL para órdenes finalizadas
 
+# Base de la API REST (se puede apuntar a mock_coinex.py para benchmarks locales)
+COINEX_API_URL = os.getenv("COINEX_API_URL", "https://api.coinex.com/v2")
+
+# Resiliencia de lecturas idempotentes (GET) contra CoinEx
+REQUEST_TIMEOUT = float(os.getenv("COINEX_TIMEOUT", "10"))  # Segundos por petición HTTP
+GET_MAX_ATTEMPTS = int(os.getenv("COINEX_GET_ATTEMPTS", "3"))  # Intentos totales por GET
+HEDGE_GETS = os.getenv("COINEX_HEDGE_GETS", "0") == "1"  # Segunda petición tras el p95
+GET_CACHE_TTL = float(os.getenv("COINEX_GET_CACHE_TTL", "0"))  # Segundos; 0 desactiva la caché
+POOL_SIZE = int(os.getenv("COINEX_POOL_SIZE", "10"))  # Conexiones keep-alive hacia CoinEx
+
+# Mercados de futuros operados (separados por coma) y refresco de sus metadatos
+FUTURES_MARKETS = [m.strip() for m in os.getenv("FUTURES_MARKETS", "BTCUSDT").split(",") if m.strip()]
+MARKET_REFRESH_SECONDS = float(os.getenv("MARKET_REFRESH_SECONDS", "3600"))
+
+# Spool local de eventos cuando Azure no está disponible
+TELEMETRY_SPOOL = os.getenv("TELEMETRY_SPOOL", "telemetry_spool.ndjson")
+TELEMETRY_SPOOL_MAX_MB = int(os.getenv("TELEMETRY_SPOOL_MAX_MB", "64"))  # Tope del spool (y del .dead)
+
+# Trazas guardadas en memoria para /traces
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "256"))
+
+# Estado de riesgo compartido entre workers (archivo mmap, en /dev/shm si existe)
+RISK_STATE_PATH = os.getenv("RISK_STATE_PATH") or default_path("webhook_risk_state")
+
+# Journal en disco del estado de riesgo (log + snapshot) para sobrevivir reinicios; vacío lo desactiva
+RISK_JOURNAL_PATH = os.getenv("RISK_JOURNAL_PATH", "risk_journal.bin")
+# Con 1 además se hace fsync (en un hilo aparte, agrupado) para sobrevivir a un corte de la máquina
+RISK_JOURNAL_FSYNC = os.getenv("RISK_JOURNAL_FSYNC", "0") == "1"
+
+# Journal write-ahead de alertas: con ruta, /webhook responde en cuanto la alerta está en
+# disco y se ejecuta en segundo plano; vacío mantiene la ejecución dentro de la petición
+ALERT_JOURNAL_PATH = os.getenv("ALERT_JOURNAL_PATH", "")
+# Ventana de group commit: con 0 cada fsync ya agrupa lo llegado durante el anterior; una
+# ventana mayor ahorra fsyncs a cambio de sumar su duración a cada respuesta (bench_journal.py)
+ALERT_COMMIT_MS = float(os.getenv("ALERT_COMMIT_MS", "0"))
+# Espera máxima (s) a que el disco confirme una alerta: pasado ese tiempo /webhook responde 503
+ALERT_COMMIT_TIMEOUT = float(os.getenv("ALERT_COMMIT_TIMEOUT", "2"))
+ALERT_WORKERS = int(os.getenv("ALERT_WORKERS", "4"))  # Alertas ejecutándose a la vez por proceso
+ALERT_MAX_AGE_SECONDS = float(os.getenv("ALERT_MAX_AGE_SECONDS", "60"))  # Más viejas no se ejecutan
+
+# ⌛ Antigüedad máxima (s) de una alerta según su hora ({{timenow}} de TradingView) antes de
+# ejecutarla; 0 desactiva. STRATEGY_MAX_AGE la ajusta por estrategia ("scalp=3,swing=120")
+STALE_ALERT_MAX_AGE = float(os.getenv("STALE_ALERT_MAX_AGE", "10"))
+STRATEGY_MAX_AGE = parse_max_ages(os.getenv("STRATEGY_MAX_AGE", ""))
+STALE_ALERT_ACTION = os.getenv("STALE_ALERT_ACTION", "drop")  # drop | close_only (cierra sin reabrir)
+CLOCK_SYNC_SECONDS = float(os.getenv("CLOCK_SYNC_SECONDS", "300"))  # Refresco del desfase con CoinEx
+
+# 🔁 Modo flip: si no hay posición o es contraria a la alerta, una sola orden de cantidad neta
+# (nueva + posición actual) en lugar de cerrar y volver a abrir, sin hueco sin posición.
+# La posición se lee de CoinEx justo antes; FLIP_POSITION_MAX_AGE > 0 reutiliza la conocida
+# (propias órdenes y lecturas) si es más reciente, a riesgo de no ver un SL/TP recién disparado
+FLIP_MODE = os.getenv("FLIP_MODE", "0") == "1"
+FLIP_POSITION_MAX_AGE = float(os.getenv("FLIP_POSITION_MAX_AGE", "0"))
+
+# Calentamiento al arrancar (start()): "background" (por defecto) o "sync" (bloquea hasta terminar)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+
+# Token para los endpoints /admin (sin token quedan desactivados)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Configuración de la posición
+MARGIN_MODE = "isolated"
+LEVERAGE = 5
+
+# Grupos de endpoints con circuito independiente (prefijo del path → grupo)
+ENDPOINT_GROUPS = {
+    "/v2/assets/": "account",
+    "/v2/futures/market": "market",
+    "/v2/futures/order": "order",
+    "/v2/futures/cancel-all-order": "order",
+    "/v2/futures/": "position",
+}
+
 app = Flask(__name__)
 
+# 📈 Métricas expuestas en /metrics (formato Prometheus)
+COINEX_LATENCY = REGISTRY.histogram(
+    "coinex_request_duration_seconds", "Latencia de las peticiones REST a CoinEx", ("endpoint",))
+STAGE_LATENCY = REGISTRY.histogram(
+    "pipeline_stage_duration_seconds", "Duración de cada etapa del pipeline de una alerta", ("stage",))
+FILL_TO_PROTECTED = REGISTRY.histogram(
+    "fill_to_protected_seconds", "Tiempo desde el fill hasta tener SL y TP colocados")
+RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "rate_limiter_wait_seconds", "Espera impuesta por el limitador de tasa", ("group",))
+ALERTS = REGISTRY.counter("alerts_total", "Alertas recibidas por resultado", ("outcome",))
+ALERT_AGE = REGISTRY.histogram(
+    "alert_age_seconds", "Antigüedad de la alerta (según su hora) al empezar a ejecutarla")
+PREEMPTED = REGISTRY.counter("alerts_preempted_total", "Ejecuciones cortadas por una alerta más nueva del mismo mercado")
+STALE_ALERTS = REGISTRY.counter("stale_alerts_total", "Alertas vencidas por acción tomada", ("action",))
+JOURNAL_COMMIT = REGISTRY.histogram(
+    "alert_journal_commit_seconds", "Espera hasta que la alerta queda en disco (group commit)")
+
 class RequestsClient(object):
     HEADERS = {
         "Content-Type": "application/json; charset=utf-8",
@@ -49,8 +159,34 @@ class RequestsClient(object):
     def __init__(self):
         self.access_id = API_KEY
         self.secret_key = API_SECRET
-        self.url = "https://api.coinex.com/v2"
+        self.url = COINEX_API_URL
         self.headers = self.HEADERS.copy()
+        self.retry_policy = RetryPolicy(max_attempts=GET_MAX_ATTEMPTS)
+        self.hedger = HedgedCaller() if HEDGE_GETS else None
+        self.single_flight = SingleFlight(ttl=GET_CACHE_TTL)
+        self.breakers = BreakerRegistry(ENDPOINT_GROUPS)
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Sesión con pool keep-alive hacia CoinEx; se construye en el primer uso"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def reset_session(self):
+        """Descarta el pool (p. ej. antes de hacer fork: los sockets no se comparten entre workers)"""
+        with self._session_lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
 
     # Generate your signature string
     def gen_sign(self, method, request_path, body, timestamp):
@@ -70,106 +206,218 @@ class RequestsClient(object):
         headers["Content-Type"] = "application/json; charset=utf-8"
         return headers
 
-    def request(self, method, url, params={}, data=""):
+    def throttle(self, request_path):
+        """⏳ Espera el turno en el presupuesto global del grupo (compartido por todos los workers)"""
+        group = self.breakers.group_for(request_path)
+        wait_time = rate_limits.reserve(group)
+        if wait_time > 0:
+            RATE_LIMIT_WAIT.labels(group).observe(wait_time)
+            time.sleep(wait_time)  # Cooperativo bajo gevent (time.sleep parcheado)
+
+    def request(self, method, url, params={}, data="", throttle=True):
         req = urlparse(url)
         request_path = req.path
 
+        # Cada intento cuenta en el presupuesto (throttle=False: el llamante ya esperó su turno).
+        # Antes del circuito: si la reserva falla no queda tomada la llamada de prueba del semiabierto
+        if throttle:
+            self.throttle(request_path)
+
+        # ⛔ Si el circuito del grupo está abierto se falla sin tocar CoinEx; desde aquí
+        # toda salida pasa por breaker.record() o breaker.release()
+        breaker = self.breakers.for_path(request_path)
+        breaker.before_call()
+        start = time.perf_counter()
+
         timestamp = str(int(time.time() * 1000))
-        if method.upper() == "GET":
-            # If params exist, query string needs to be added to the request path
-            if params:
-                for item in params:
-                    if params[item] is None:
-                        del params[item]
-                        continue
-                request_path = request_path + "?" + urlencode(params)
-
-            signed_str = self.gen_sign(
-                method, request_path, body="", timestamp=timestamp
-            )
-            response = requests.get(
-                url,
-                params=params,
-                headers=self.get_common_headers(signed_str, timestamp),
-            )
+        try:
+            if method.upper() == "GET":
+                # If params exist, query string needs to be added to the request path
+                if params:
+                    for item in params:
+                        if params[item] is None:
+                            del params[item]
+                            continue
+                    request_path = request_path + "?" + urlencode(params)
+
+                signed_str = self.gen_sign(
+                    method, request_path, body="", timestamp=timestamp
+                )
+                response = self.session.get(
+                    url,
+                    params=params,
+                    headers=self.get_common_headers(signed_str, timestamp),
+                    timeout=REQUEST_TIMEOUT,
+                )
 
-        else:
-            signed_str = self.gen_sign(
-                method, request_path, body=data, timestamp=timestamp
-            )
-            response = requests.post(
-                url, data, headers=self.get_common_headers(signed_str, timestamp)
-            )
-
-        if response.status_code != 200:
-            raise ValueError(response.text)
+            else:
+                signed_str = self.gen_sign(
+                    method, request_path, body=data, timestamp=timestamp
+                )
+                response = self.session.post(
+                    url, data, headers=self.get_common_headers(signed_str, timestamp),
+                    timeout=REQUEST_TIMEOUT,
+                )
+
+            if response.status_code != 200:
+                raise CoinExHTTPError(response)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            breaker.record(not is_retryable_error(e), elapsed)
+            COINEX_LATENCY.labels(req.path).observe(elapsed)
+            raise
+        except BaseException:
+            breaker.release()  # Cancelada (tarea, greenlet, timeout de gevent): sin resultado
+            raise
+
+        elapsed = time.perf_counter() - start
+        breaker.record(not is_retryable_response(response), elapsed)
+        COINEX_LATENCY.labels(req.path).observe(elapsed)
         return response
 
+    def get(self, url, params=None, hedge=None):
+        """🔁 GET idempotente con reintentos, backoff con jitter y hedging opcional
+
+        Los GET idénticos concurrentes comparten una sola petición en vuelo.
+        """
+        hedge = self.hedger is not None if hedge is None else hedge
+        key = (url, tuple(sorted((params or {}).items())))
+
+        def attempt():
+            # Cada intento firma de nuevo con su propio timestamp. La espera del limitador va
+            # fuera de lo que mide el hedger: no es latencia de CoinEx ni debe disparar copias
+            path = urlparse(url).path
+            send = lambda: self.request("GET", url, params=dict(params or {}), throttle=False)
+            self.throttle(path)
+            if hedge and self.hedger is not None:
+                return self.hedger.call(path, send, before_hedge=lambda: self.throttle(path))
+            return send()
+
+        return self.single_flight.do(key, lambda: self.retry_policy.call(attempt))
+
+# Límites de tasa de CoinEx por grupo de endpoints, en un archivo mmap común a todos los procesos
+rate_limits = default_rate_limiter()
 request_client = RequestsClient()
 
-# Limitador de tasa (Máximo 20 llamadas por segundo)
-def rate_limiter(max_calls_per_second):
-    interval = 1.0 / max_calls_per_second
-    def decorator(func):
-        last_time_called = [0.0]
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            elapsed = time.perf_counter() - last_time_called[0]
-            wait_time = interval - elapsed
-            if wait_time > 0:
-                time.sleep(wait_time)
-            result = func(*args, **kwargs)
-            last_time_called[0] = time.perf_counter()
-            return result
-        return wrapper
-    return decorator
-
-@rate_limiter(10) # Límite de 10 llamadas por segundo
-def get_futures_market():
+# Loggers por etapa; su nivel se ajusta con LOG_LEVELS (p. ej. "coinex.order=DEBUG,pipeline=WARNING")
+pipeline_log = logging.getLogger("pipeline")
+webhook_log = logging.getLogger("webhook")
+risk_log = logging.getLogger("risk")
+balance_log = logging.getLogger("coinex.balance")
+close_log = logging.getLogger("coinex.close")
+cancel_log = logging.getLogger("coinex.cancel")
+leverage_log = logging.getLogger("coinex.leverage")
+stop_loss_log = logging.getLogger("coinex.stop_loss")
+take_profit_log = logging.getLogger("coinex.take_profit")
+order_log = logging.getLogger("coinex.order")
+
+def log_coinex_response(log, response):
+    """📌 Registra la respuesta de CoinEx; el volcado completo del JSON se muestrea"""
+    log.info("✅ Respuesta HTTP", extra=kv(status=response.status_code))
+    try:
+        response_data = response.json()
+    except ValueError:
+        log.error("❌ Error: CoinEx no devolvió JSON", extra=kv(raw=response.text))
+        return
+    log.info("📌 Respuesta JSON de CoinEx", extra=kv(sampled=True, payload=response_data))
+    if "code" in response_data and response_data["code"] != 0:
+        log.error("❌ Error de CoinEx", extra=kv(code=response_data["code"], message=response_data.get("message")))
+
+def get_futures_market(markets=("BTCUSDT",)):
     request_path = "/futures/market"
-    params = {"market": "BTCUSDT"}
-    response = request_client.request(
-        "GET",
+    params = {"market": ",".join(markets)}
+    response = request_client.get(
         "{url}{request_path}".format(url=request_client.url, request_path=request_path),
         params=params,
     )
     return response
 
-@rate_limiter(10) # Límite de 10 llamadas por segundo
+# 📐 Reglas de precisión, mínimo y tick de los mercados configurados
+market_cache = MarketMetadataCache(get_futures_market, FUTURES_MARKETS, refresh_interval=MARKET_REFRESH_SECONDS)
+
+def get_server_time():
+    # Sin reintentos ni single-flight: una respuesta compartida o repetida falsearía el RTT
+    return request_client.request("GET", "{url}/time".format(url=request_client.url))
+
+# 🕒 Hora de CoinEx para juzgar la antigüedad de las alertas con el reloj local corregido
+server_clock = ServerClock(get_server_time, refresh_interval=CLOCK_SYNC_SECONDS)
+staleness = StalenessPolicy(server_clock, STALE_ALERT_MAX_AGE, STRATEGY_MAX_AGE, STALE_ALERT_ACTION)
+
+# 🔀 Ejecución vigente por mercado: una alerta nueva corta a la anterior entre etapas
+preemption = MarketPreemption()
+
+def get_pending_positions():
+    request_path = "/futures/pending-position"
+    params = {"market_type": "FUTURES"}
+    response = request_client.get(
+        "{url}{request_path}".format(url=request_client.url, request_path=request_path),
+        params=params,
+    )
+    return response
+
+# ⚙️ Apalancamiento y modo de margen vigentes por mercado (evita ajustes redundantes)
+leverage_cache = LeverageStateCache()
+
+# 📍 Posición neta conocida por mercado (modo flip)
+position_cache = PositionCache(max_age=FLIP_POSITION_MAX_AGE)
+
+def seed_leverage_cache():
+    """🔄 Siembra la caché de apalancamiento (y la de posiciones) con las posiciones abiertas"""
+    try:
+        response_data = get_pending_positions().json()
+    except Exception as e:
+        logging.error("❌ No se pudieron leer las posiciones: %s", e)
+        return
+    if response_data.get("code") == 0 and isinstance(response_data.get("data"), list):
+        leverage_cache.update_from_positions(response_data["data"])
+        position_cache.update_from_positions(response_data["data"], FUTURES_MARKETS)
+
+async def current_position(market, io):
+    """Posición neta del mercado: la conocida si es reciente, si no se lee de CoinEx (None si falla)"""
+    position = position_cache.get(market)
+    if position is not None:
+        return position
+    response = await io.pending_positions()
+    response_data = response.json()
+    if response.status_code != 200 or response_data.get("code") != 0 or not isinstance(response_data.get("data"), list):
+        return None
+    leverage_cache.update_from_positions(response_data["data"])  # Cada lectura confirma también el apalancamiento
+    return position_cache.update_from_positions(response_data["data"], (market,))[market]
+
+def net_order_amount(alert, position, market_rules):
+    """🔁 Cantidad de la orden única que deja la posición en la de la alerta
+
+    None si hay que cerrar y abrir como siempre: posición desconocida o ya del
+    mismo lado (ahí el cierre también ajusta el tamaño).
+    """
+    if position is None or position * (1 if alert["side"] == "buy" else -1) > 0:
+        return None
+    return market_rules.quantize_amount(alert["amount"] + abs(position))
+
+async def flip_order_amount(alert, market_rules, io):
+    try:
+        position = await current_position(alert["market"], io)
+    except Exception as e:
+        pipeline_log.warning("⚠️ No se pudo leer la posición, se cierra y se abre: %s", e)
+        return None
+    return net_order_amount(alert, position, market_rules)
+
 def get_futures_balance():
     request_path = "/assets/futures/balance"
-    logging.info(f"📤 Obteniendo balance en CoinEx")
-    print(f"📤 Obteniendo balance en CoinEx")
+    balance_log.info("📤 Obteniendo balance en CoinEx")
 
     try:
-        response = request_client.request(
-            "GET",
+        response = request_client.get(
             "{url}{request_path}".format(url=request_client.url, request_path=request_path),
         )
 
-        logging.info(f"✅ Respuesta HTTP: {response.status_code}")
-        print(f"✅ Respuesta HTTP: {response.status_code}")
-
-        try:
-            response_data = response.json()
-            logging.info(f"📌 Respuesta JSON de CoinEx: {response_data}")
-            print(f"📌 Respuesta JSON de CoinEx: {response_data}")
-
-            if "code" in response_data and response_data["code"] != 0:
-                logging.error(f"❌ Error de CoinEx: {response_data['message']}")
-                print(f"❌ Error de CoinEx: {response_data['message']}")
-
-        except ValueError:
-            logging.error(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
-            print(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
+        log_coinex_response(balance_log, response)
 
     except requests.exceptions.RequestException as e:
-        logging.error(f"🚨 Error de conexión con CoinEx: {str(e)}")
-        print(f"🚨 Error de conexión con CoinEx: {str(e)}")
+        balance_log.error("🚨 Error de conexión con CoinEx", extra=kv(error=str(e)))
 
     return response
 
-@rate_limiter(20) # Límite de 20 llamadas por segundo
 def close_position():
     request_path = "/futures/close-position"
     data = {"market": "BTCUSDT",
@@ -181,8 +429,7 @@ def close_position():
               }
     data_json = json.dumps(data)
     
-    logging.info(f"📤 Cerrando posiciones en CoinEx: {data_json}")
-    print(f"📤 Cerrando posiciones en CoinEx: {data_json}")
+    close_log.info("📤 Cerrando posiciones en CoinEx", extra=kv(payload=data))
 
     try:
         response = request_client.request(
@@ -191,29 +438,13 @@ def close_position():
             data=data_json,
         )
 
-        logging.info(f"✅ Respuesta HTTP: {response.status_code}")
-        print(f"✅ Respuesta HTTP: {response.status_code}")
-
-        try:
-            response_data = response.json()
-            logging.info(f"📌 Respuesta JSON de CoinEx: {response_data}")
-            print(f"📌 Respuesta JSON de CoinEx: {response_data}")
-
-            if "code" in response_data and response_data["code"] != 0:
-                logging.error(f"❌ Error de CoinEx: {response_data['message']}")
-                print(f"❌ Error de CoinEx: {response_data['message']}")
-
-        except ValueError:
-            logging.error(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
-            print(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
+        log_coinex_response(close_log, response)
 
     except requests.exceptions.RequestException as e:
-        logging.error(f"🚨 Error de conexión con CoinEx: {str(e)}")
-        print(f"🚨 Error de conexión con CoinEx: {str(e)}")
+        close_log.error("🚨 Error de conexión con CoinEx", extra=kv(error=str(e)))
 
     return response
 
-@rate_limiter(20) # Límite de 20 llamadas por segundo
 def cancel_all_orders(side):
     request_path = "/futures/cancel-all-order"
     data = {"market": "BTCUSDT", 
@@ -222,8 +453,7 @@ def cancel_all_orders(side):
               }
     data_json = json.dumps(data)
     
-    logging.info(f"📤 Cancelando todas las órdenes en CoinEx: {data_json}")
-    print(f"📤 Cancelando todas las órdenes en CoinEx: {data_json}")
+    cancel_log.info("📤 Cancelando todas las órdenes en CoinEx", extra=kv(payload=data))
     
     try:
         response = request_client.request(
@@ -232,40 +462,23 @@ def cancel_all_orders(side):
             data=data_json,
         )
 
-        logging.info(f"✅ Respuesta HTTP: {response.status_code}")
-        print(f"✅ Respuesta HTTP: {response.status_code}")
-
-        try:
-            response_data = response.json()
-            logging.info(f"📌 Respuesta JSON de CoinEx: {response_data}")
-            print(f"📌 Respuesta JSON de CoinEx: {response_data}")
-
-            if "code" in response_data and response_data["code"] != 0:
-                logging.error(f"❌ Error de CoinEx: {response_data['message']}")
-                print(f"❌ Error de CoinEx: {response_data['message']}")
-
-        except ValueError:
-            logging.error(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
-            print(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
+        log_coinex_response(cancel_log, response)
 
     except requests.exceptions.RequestException as e:
-        logging.error(f"🚨 Error de conexión con CoinEx: {str(e)}")
-        print(f"🚨 Error de conexión con CoinEx: {str(e)}")
+        cancel_log.error("🚨 Error de conexión con CoinEx", extra=kv(error=str(e)))
 
     return response
 
-@rate_limiter(10) # Límite de 10 llamadas por segundo
-def adjust_position_leverage():
+def adjust_position_leverage(market="BTCUSDT", margin_mode=MARGIN_MODE, leverage=LEVERAGE):
     request_path = "/futures/adjust-position-leverage"
-    data = {"market": "BTCUSDT", 
+    data = {"market": market, 
               "market_type": "FUTURES",
-              "margin_mode": "isolated",
-              "leverage": 5
+              "margin_mode": margin_mode,
+              "leverage": leverage
               }
     data_json = json.dumps(data)
 
-    logging.info(f"📤 Ajustando apalancamiento en CoinEx: {data_json}")
-    print(f"📤 Ajustando apalancamiento en CoinEx: {data_json}")
+    leverage_log.info("📤 Ajustando apalancamiento en CoinEx", extra=kv(payload=data))
 
     try:
         response = request_client.request(
@@ -274,29 +487,13 @@ def adjust_position_leverage():
             data=data_json,
         )
 
-        logging.info(f"✅ Respuesta HTTP: {response.status_code}")
-        print(f"✅ Respuesta HTTP: {response.status_code}")
-
-        try:
-            response_data = response.json()
-            logging.info(f"📌 Respuesta JSON de CoinEx: {response_data}")
-            print(f"📌 Respuesta JSON de CoinEx: {response_data}")
-
-            if "code" in response_data and response_data["code"] != 0:
-                logging.error(f"❌ Error de CoinEx: {response_data['message']}")
-                print(f"❌ Error de CoinEx: {response_data['message']}")
-
-        except ValueError:
-            logging.error(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
-            print(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
+        log_coinex_response(leverage_log, response)
 
     except requests.exceptions.RequestException as e:
-        logging.error(f"🚨 Error de conexión con CoinEx: {str(e)}")
-        print(f"🚨 Error de conexión con CoinEx: {str(e)}")
+        leverage_log.error("🚨 Error de conexión con CoinEx", extra=kv(error=str(e)))
 
     return response
 
-@rate_limiter(20) # Límite de 20 llamadas por segundo
 def set_position_stop_loss(sl_price):
     request_path = "/futures/set-position-stop-loss"
     data = {"market": "BTCUSDT", 
@@ -306,8 +503,7 @@ def set_position_stop_loss(sl_price):
               }
     data_json = json.dumps(data)
 
-    logging.info(f"📤 Enviando stop loss: {data_json}")
-    print(f"📤 Enviando stop loss: {data_json}")  # 👈 Ver en logs de Render
+    stop_loss_log.info("📤 Enviando stop loss", extra=kv(payload=data))
 
     try:
         response = request_client.request(
@@ -316,29 +512,14 @@ def set_position_stop_loss(sl_price):
             data=data_json,
         )
 
-        logging.info(f"✅ Respuesta HTTP: {response.status_code}")
-        print(f"✅ Respuesta HTTP: {response.status_code}")  # 👈 Log en Render
-
-        try:
-            response_data = response.json()
-            logging.info(f"📌 Respuesta JSON de CoinEx: {response_data}")
-            print(f"📌 Respuesta JSON de CoinEx: {response_data}")
-
-            if "code" in response_data and response_data["code"] != 0:
-                logging.error(f"❌ Error de CoinEx: {response_data['message']}")
-                print(f"❌ Error de CoinEx: {response_data['message']}")  # 👈 Log en Render
-
-        except ValueError:
-            logging.error(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
-            print(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
+        log_coinex_response(stop_loss_log, response)
 
     except requests.exceptions.RequestException as e:
-        logging.error(f"🚨 Error de conexión con CoinEx: {str(e)}")
-        print(f"🚨 Error de conexión con CoinEx: {str(e)}")  # 👈 Log en Render
+        stop_loss_log.error("🚨 Error de conexión con CoinEx", extra=kv(error=str(e)))
+        raise  # La etapa de protección decide si reintenta
 
     return response
 
-@rate_limiter(20) # Límite de 20 llamadas por segundo
 def set_position_take_profit(tp_price):
     request_path = "/futures/set-position-take-profit"
     data = {"market": "BTCUSDT", 
@@ -348,8 +529,7 @@ def set_position_take_profit(tp_price):
               }
     data_json = json.dumps(data)
 
-    logging.info(f"📤 Enviando take profit: {data_json}")
-    print(f"📤 Enviando take profit: {data_json}")  # 👈 Ver en logs de Render
+    take_profit_log.info("📤 Enviando take profit", extra=kv(payload=data))
 
     try:
         response = request_client.request(
@@ -358,29 +538,14 @@ def set_position_take_profit(tp_price):
             data=data_json,
         )
 
-        logging.info(f"✅ Respuesta HTTP: {response.status_code}")
-        print(f"✅ Respuesta HTTP: {response.status_code}")  # 👈 Log en Render
-
-        try:
-            response_data = response.json()
-            logging.info(f"📌 Respuesta JSON de CoinEx: {response_data}")
-            print(f"📌 Respuesta JSON de CoinEx: {response_data}")
-
-            if "code" in response_data and response_data["code"] != 0:
-                logging.error(f"❌ Error de CoinEx: {response_data['message']}")
-                print(f"❌ Error de CoinEx: {response_data['message']}")  # 👈 Log en Render
-
-        except ValueError:
-            logging.error(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
-            print(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
+        log_coinex_response(take_profit_log, response)
 
     except requests.exceptions.RequestException as e:
-        logging.error(f"🚨 Error de conexión con CoinEx: {str(e)}")
-        print(f"🚨 Error de conexión con CoinEx: {str(e)}")  # 👈 Log en Render
+        take_profit_log.error("🚨 Error de conexión con CoinEx", extra=kv(error=str(e)))
+        raise  # La etapa de protección decide si reintenta
 
     return response
 
-@rate_limiter(20)  # Límite de 20 llamadas por segundo
 def send_order_to_coinex(market, side, amount):
     
     request_path = "/futures/order"
@@ -395,8 +560,7 @@ def send_order_to_coinex(market, side, amount):
     }
     data_json = json.dumps(data)
 
-    logging.info(f"📤 Enviando orden a CoinEx: {data_json}")
-    print(f"📤 Enviando orden a CoinEx: {data_json}")  # 👈 Se imprimirá en los logs de Render
+    order_log.info("📤 Enviando orden a CoinEx", extra=kv(payload=data))
 
     try:
         response = request_client.request(
@@ -405,40 +569,48 @@ def send_order_to_coinex(market, side, amount):
             data=data_json,
         )
 
-        logging.info(f"✅ Respuesta HTTP: {response.status_code}")
-        print(f"✅ Respuesta HTTP: {response.status_code}")  # 👈 Se imprimirá en los logs de Render
-
-        try:
-            response_data = response.json()
-            logging.info(f"📌 Respuesta JSON de CoinEx: {response_data}")
-            print(f"📌 Respuesta JSON de CoinEx: {response_data}")  # 👈 Se imprimirá en los logs de Render
-
-            if "code" in response_data and response_data["code"] != 0:
-                logging.error(f"❌ Error de CoinEx: {response_data['message']}")
-                print(f"❌ Error de CoinEx: {response_data['message']}")  # 👈 Se imprimirá en los logs de Render
-
-        except ValueError:
-            logging.error(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")
-            print(f"❌ Error: CoinEx no devolvió JSON. Respuesta cruda: {response.text}")  # 👈 Se imprimirá en los logs de Render
+        log_coinex_response(order_log, response)
 
     except requests.exceptions.RequestException as e:
-        logging.error(f"🚨 Error de conexión con CoinEx: {str(e)}")
-        print(f"🚨 Error de conexión con CoinEx: {str(e)}")  # 👈 Se imprimirá en los logs de Render
+        order_log.error("🚨 Error de conexión con CoinEx", extra=kv(error=str(e)))
 
     return response
 
-event_pipeline = []
-
-def log_event(step, data):
-    global event_pipeline
-
-    event = {
-        "step": step,
-        "timestamp": datetime.utcnow().isoformat(),
-        "data": data
-    }
-
-    event_pipeline.append(event)
+# 📡 Eventos hacia Azure: cola acotada + lotes gzip NDJSON + spool local
+telemetry = TelemetrySink(AZURE_FUNCTION_URL, TELEMETRY_SPOOL, max_spool_bytes=TELEMETRY_SPOOL_MAX_MB << 20)
+
+# 🛡️ Etapa de protección posterior al fill
+protective_stage = ProtectiveStage(set_position_stop_loss, set_position_take_profit,
+                                   latency_histogram=FILL_TO_PROTECTED, max_workers=2 * ALERT_WORKERS)
+
+# 🔎 Trazas de latencia por etapa (últimas TRACE_BUFFER alertas)
+tracer = Tracer(capacity=TRACE_BUFFER, stage_histogram=STAGE_LATENCY)
+
+# Métricas calculadas al hacer scrape a partir del estado de los componentes
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+REGISTRY.callback("coinex_circuit_state", "Estado del circuito (0 cerrado, 1 semiabierto, 2 abierto)",
+                  lambda: {(group, ): BREAKER_STATES[info["state"]]
+                           for group, info in request_client.breakers.status().items()}, ("group",))
+REGISTRY.callback("coinex_get_retries_total", "Reintentos de GET idempotentes",
+                  lambda: request_client.retry_policy.retries, kind="counter")
+REGISTRY.callback("coinex_single_flight_total", "GET servidos por single-flight",
+                  lambda: {(k, ): v for k, v in request_client.single_flight.stats().items()}, ("result",), kind="counter")
+REGISTRY.callback("leverage_adjust_total", "Ajustes de apalancamiento aceptados por CoinEx u omitidos",
+                  lambda: {("sent", ): leverage_cache.sent, ("skipped", ): leverage_cache.skipped}, ("result",), kind="counter")
+REGISTRY.callback("telemetry_queue_depth", "Eventos pendientes de enviar a Azure", telemetry.depth)
+REGISTRY.callback("telemetry_events_total", "Eventos hacia Azure por destino",
+                  lambda: {(k, ): v for k, v in telemetry.stats().items() if k in ("sent", "spooled", "replayed", "rejected", "dropped")},
+                  ("result",), kind="counter")
+REGISTRY.callback("startup_phase_seconds", "Duración de cada fase del arranque",
+                  lambda: {(k[:-3], ): v / 1000 for k, v in startup_timings.items()}, ("phase",))
+
+def emit_trade(ctx, payload):
+    """📦 Entrega al sink de telemetría los eventos de una operación terminada"""
+    payload["alert_id"] = ctx.alert_id
+    payload["events"] = ctx.events()
+    if ctx.dropped:
+        payload["dropped_events"] = ctx.dropped
+    telemetry.emit(payload)
 
 # Variable global para almacenar la última alerta recibida
 last_alert = None 
@@ -448,15 +620,13 @@ max_consecutive_losses = 3     # Stop de 2–3 pérdidas consecutivas
 max_daily_loss_pct = 0.07      # Stop diario 7%
 max_total_loss_pct = 0.25      # Stop general 25%
 
-risk_state = {
-    "consecutive_losses": 0,
-    "daily_loss": 0.0,
-    "start_balance": None,
-    "last_balance": None,
-    "paused": False,
-    "pause_reason": "",
-    "pause_time": None
-}
+# Compartido por todos los workers (archivo mmap); misma interfaz que el dict original:
+# consecutive_losses, daily_loss, start_balance, last_balance, paused, pause_reason, pause_time
+risk_journal = RiskJournal(RISK_JOURNAL_PATH, SharedRiskState.JOURNALED, fsync=RISK_JOURNAL_FSYNC) if RISK_JOURNAL_PATH else None
+risk_state = SharedRiskState(RISK_STATE_PATH, journal=risk_journal)
+
+# Actualizaciones compuestas de risk_state entre alertas concurrentes (hilos, greenlets y workers)
+risk_lock = risk_state.lock
 
 def reset_daily_if_needed(current_time, current_balance):
     """🔄 Reinicia las variables de riesgo cada 24 horas"""
@@ -467,7 +637,7 @@ def reset_daily_if_needed(current_time, current_balance):
 
     # Si han pasado más de 24 horas desde el último stop → reset
     if current_time - risk_state["pause_time"] >= timedelta(hours=24):
-        print("⏰ 24h cumplidas. Reset automático de reglas de riesgo.")
+        risk_log.info("⏰ 24h cumplidas. Reset automático de reglas de riesgo.")
         risk_state["consecutive_losses"] = 0
         risk_state["daily_loss"] = 0.0
         risk_state["start_balance"] = current_balance
@@ -479,21 +649,26 @@ def check_risk_limits(current_balance):
     """✅ Verifica si los límites de riesgo fueron alcanzados"""
     global risk_state
 
-    if risk_state["start_balance"] is None:
+    # Una sola lectura sin lock del estado compartido (seqlock)
+    start_balance, last_balance, consecutive_losses = risk_state.values(
+        "start_balance", "last_balance", "consecutive_losses")
+
+    if start_balance is None:
+        start_balance = last_balance = current_balance
         risk_state["start_balance"] = current_balance
         risk_state["last_balance"] = current_balance
 
     # Calcular pérdida diaria
-    daily_loss = (risk_state["start_balance"] - current_balance) / risk_state["start_balance"]
+    daily_loss = (start_balance - current_balance) / start_balance
 
     # Calcular pérdida total
-    total_loss = (risk_state["last_balance"] - current_balance) / risk_state["last_balance"]
+    total_loss = (last_balance - current_balance) / last_balance
 
     # Guardar en estado
     risk_state["daily_loss"] = daily_loss
 
     # Revisar consecutivas
-    if risk_state["consecutive_losses"] >= max_consecutive_losses:
+    if consecutive_losses >= max_consecutive_losses:
         risk_state["paused"] = True
         risk_state["pause_reason"] = f"❌ Stop por {max_consecutive_losses} pérdidas consecutivas"
         risk_state["pause_time"] = datetime.now()
@@ -515,15 +690,110 @@ def check_risk_limits(current_balance):
 
     return True
 
+def within_risk_limits(current_balance):
+    """Reset de 24 h y verificación de límites, atómicos entre workers"""
+    with risk_lock:
+        # 🔄 Reset automático si han pasado 24h
+        reset_daily_if_needed(datetime.now(), current_balance)
+
+        # ✅ Verificar límites de riesgo
+        return check_risk_limits(current_balance)
+
+def reset_paused_if_needed():
+    """Con las operaciones pausadas: reanuda si ya pasaron 24 h"""
+    with risk_lock:
+        reset_daily_if_needed(datetime.now(), risk_state["last_balance"])
+
+def record_trade_result(current_balance):
+    """📉📈 Cuenta la operación como pérdida o ganancia respecto del último balance"""
+    with risk_lock:
+        if risk_state["last_balance"] is not None:
+            if current_balance < risk_state["last_balance"]:
+                risk_state["consecutive_losses"] += 1
+                pipeline_log.info("📉 Pérdida detectada. Consecutivas: %s", risk_state['consecutive_losses'])
+            else:
+                risk_state["consecutive_losses"] = 0
+                pipeline_log.info("📈 Ganancia detectada. Reset de consecutivas.")
+        risk_state["last_balance"] = current_balance
+
+
+def judge_staleness(alert):
+    """⌛ Acción para la alerta según su antigüedad ("execute", "drop" o "close_only")"""
+    age, action = staleness.judge(alert)
+    if age is not None:
+        ALERT_AGE.observe(max(age, 0.0))
+    if action != "execute":
+        STALE_ALERTS.labels(action).inc()
+        pipeline_log.warning("⌛ Alerta vencida: %.2f s (máximo %s s), acción %s",
+                             age, staleness.max_age_for(alert), action)
+    return action
+
+
+def parse_alert(data):
+    """📩 Convierte el JSON de TradingView en la alerta interna (None si 'side' es inválido)"""
+    # Convertir amount a número y verificar que sea válido
+    amount = float(data.get("amount", 0))
+    price = float(data.get("price", 50000))
+    side = data.get("side", "buy").lower()
+
+    # Calcular SL y TP según el lado de la orden
+    if side == "buy":
+        sl_price = price * 0.9966  # -1%
+        tp_price = price * 1.0102  # +3%
+    elif side == "sell":
+        sl_price = price * 1.0034  # +1%
+        tp_price = price * 0.9898  # -3%
+    else:
+        return None
+
+    return {
+        "market": data.get("market", "BTCUSDT"),
+        "side": side,
+        "amount": amount,
+        "price": price,
+        "sl_price": sl_price,
+        "tp_price": tp_price,
+        "strategy": data.get("strategy"),
+        "sent_at": alert_time(data),  # Epoch de la alerta (None si no trae hora)
+    }
+
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
+    trace = tracer.start()
+    with trace.span("webhook_parse"):
+        data = request.json
+    body, status_code = run_sync(handle_webhook(data, trace, SYNC_IO))
+    return jsonify(body), status_code
+
+
+async def handle_webhook(data, trace, io):
+    """📩 Atiende una alerta de TradingView; devuelve (cuerpo JSON, código HTTP)
+
+    Común a Flask y a async_server.py: cada uno pasa su transporte `io`.
+    """
     global last_alert
-    data = request.json
-    print("📩 Alerta recibida:", data)
+    webhook_log.info("📩 Alerta recibida: %s", data)
+
+    if alert_queue is not None:
+        return await enqueue_alert(data, trace, io)
+
+    # ⌛ Alerta vieja: se descarta sin pedir el balance (el pipeline vuelve a juzgarla al ejecutar)
+    arrival = {"sent_at": alert_time(data), "strategy": data.get("strategy")}
+    if staleness.judge(arrival)[1] == "drop":
+        ALERTS.labels("stale").inc()
+        STALE_ALERTS.labels("drop").inc()
+        webhook_log.warning("⌛ Alerta vencida, se descarta: %s", data)
+        return {"status": "ignored", "message": "Alerta vencida"}, 200
 
     # Obtener balance de CoinEx
-    response = get_futures_balance()
+    try:
+        with trace.span("balance_fetch", source="webhook"):
+            response = await io.balance()
+    except CircuitOpenError as e:
+        webhook_log.warning("⛔ %s", e)
+        ALERTS.labels("circuit_open").inc()
+        return {"error": str(e)}, 503
 
     if response.status_code == 200:
         response_data = response.json()
@@ -538,71 +808,214 @@ def webhook():
                     balance = float(first_entry.get("available", 0))
                     margin = float(first_entry.get("margin", 0))  # ✅ Extrae margin correctamente
                     total_balance = balance + margin  # ✅ Balance total sumando margin
-                    print(f"✅ Balance disponible: {balance}, Margin: {margin}, Total: {total_balance}")
+                    webhook_log.info("✅ Balance disponible: %s, Margin: %s, Total: %s", balance, margin, total_balance)
                 else:
-                    print("⚠️ Error: El primer elemento de 'data' no es un diccionario válido.")
-                    return jsonify({"error": "Formato inválido en balance"}), 500
+                    webhook_log.warning("⚠️ Error: El primer elemento de 'data' no es un diccionario válido.")
+                    ALERTS.labels("balance_error").inc()
+                    return {"error": "Formato inválido en balance"}, 500
             else:
-                print(f"⚠️ La respuesta de CoinEx no tiene datos de balance.")
-                return jsonify({"error": "Sin datos de balance"}), 500
+                webhook_log.warning("⚠️ La respuesta de CoinEx no tiene datos de balance.")
+                ALERTS.labels("balance_error").inc()
+                return {"error": "Sin datos de balance"}, 500
         else:
-            print(f"❌ Error en respuesta de CoinEx: {response_data.get('message', 'Desconocido')}")
-            return jsonify({"error": "Error en respuesta de CoinEx"}), 500
+            webhook_log.error("❌ Error en respuesta de CoinEx: %s", response_data.get('message', 'Desconocido'))
+            ALERTS.labels("balance_error").inc()
+            return {"error": "Error en respuesta de CoinEx"}, 500
     else:
-        print(f"❌ Error HTTP al obtener balance: {response.status_code}")
-        return jsonify({"error": "Error HTTP al obtener balance"}), response.status_code
+        webhook_log.error("❌ Error HTTP al obtener balance: %s", response.status_code)
+        ALERTS.labels("balance_error").inc()
+        return {"error": "Error HTTP al obtener balance"}, response.status_code
 
-    # Convertir amount a número y verificar que sea válido
-    amount = float(data.get("amount", 0))
-    price = float(data.get("price", 50000))
-    side = data.get("side", "buy").lower()
+    last_alert = parse_alert(data)
+    if last_alert is None:
+        webhook_log.warning("⚠️ Error: 'side' inválido. Debe ser 'buy' o 'sell'.")
+        ALERTS.labels("invalid").inc()
+        return {"status": "error", "message": "Side inválido"}, 400
 
-    # Calcular SL y TP según el lado de la orden
-    if side == "buy":
-        sl_price = price * 0.9966  # -1%
-        tp_price = price * 1.0102  # +3%
-    elif side == "sell":
-        sl_price = price * 1.0034  # +1%
-        tp_price = price * 0.9898  # -3%
-    else:
-        print("⚠️ Error: 'side' inválido. Debe ser 'buy' o 'sell'.")
-        return jsonify({"status": "error", "message": "Side inválido"}), 400
+    webhook_log.info("🚀 Orden recibida: %s", last_alert)
+    ctx = TradeContext(last_alert["market"], alert_id=data.get("alert_id"), alert=last_alert)
+    trace.alert_id, trace.market = ctx.alert_id, ctx.market
+    ctx.trace = trace
+    await pipeline(ctx, io)
 
-    last_alert = {
-        "market": data.get("market", "BTCUSDT"),
-        "side": side,
-        "amount": amount,
-        "price": price,
-        "sl_price": sl_price,
-        "tp_price": tp_price,
+    return {"status": "success", "message": "Alerta recibida"}, 200
+
+
+async def enqueue_alert(data, trace, io):
+    """⚡ Respuesta rápida: la alerta se valida, se guarda en el journal y se ejecuta en segundo plano"""
+    if parse_alert(data) is None:
+        webhook_log.warning("⚠️ Error: 'side' inválido. Debe ser 'buy' o 'sell'.")
+        ALERTS.labels("invalid").inc()
+        return {"status": "error", "message": "Side inválido"}, 400
+
+    started = time.perf_counter()
+    try:
+        with trace.span("journal_commit"):
+            await io.blocking(alert_queue.submit, data, trace)
+    except OSError as e:
+        webhook_log.error("❌ No se pudo guardar la alerta en el journal", extra=kv(error=str(e)))
+        ALERTS.labels("journal_error").inc()
+        return {"error": "Journal de alertas no disponible"}, 503
+    JOURNAL_COMMIT.observe(time.perf_counter() - started)
+    return {"status": "success", "message": "Alerta recibida"}, 200
+
+
+def alert_context(data, trace=None, stages=None):
+    """Contexto de ejecución de una alerta del journal: recién aceptada (con su traza) o recuperada"""
+    alert = parse_alert(data)
+    webhook_log.info("🚀 Orden recibida: %s", alert)
+    ctx = TradeContext(alert["market"], alert_id=data.get("alert_id"), alert=alert)
+    if trace is None:
+        trace = tracer.start(ctx.alert_id, ctx.market)
+    trace.alert_id, trace.market = ctx.alert_id, ctx.market
+    ctx.trace = trace
+    ctx.stages = stages
+    return ctx
+
+
+def execute_alert(data, received_at, trace=None, stages=None):
+    """Ejecuta una alerta del journal en un hilo de AlertQueue"""
+    run_code(alert_context(data, trace, stages))
+
+
+@app.route('/traces', methods=['GET'])
+def traces():
+    """🔎 Últimas trazas de alertas (?market=BTCUSDT&alert_id=...&limit=20)"""
+    return jsonify(tracer.query(
+        market=request.args.get("market"),
+        alert_id=request.args.get("alert_id"),
+        limit=request.args.get("limit", 50, type=int),
+    )), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """📈 Métricas en formato de texto de Prometheus"""
+    return REGISTRY.render(), 200, {"Content-Type": METRICS_CONTENT_TYPE}
+
+
+def status_snapshot():
+    """Estado de los circuitos por grupo de endpoints y contadores del cliente"""
+    return {
+        "breakers": request_client.breakers.status(),
+        "single_flight": request_client.single_flight.stats(),
+        "retries": request_client.retry_policy.retries,
+        "leverage": leverage_cache.stats(),
+        "protective": protective_stage.stats(),
+        "telemetry": telemetry.stats(),
+        "risk": risk_state.snapshot(),
+        "risk_journal": risk_journal.stats() if risk_journal is not None else None,
+        "alert_journal": alert_queue.stats() if alert_queue is not None else None,
+        "clock": server_clock.stats(),
+        "positions": position_cache.stats(),
+        "preemption": preemption.stats(),
+        "rate_limits": rate_limits.status(),
     }
 
-    print(f"🚀 Orden recibida: {last_alert}")
-    run_code()
 
-    return jsonify({"status": "success", "message": "Alerta recibida"}), 200
+@app.route('/status', methods=['GET'])
+def status():
+    """📊 Estado de los circuitos por grupo de endpoints y contadores del cliente"""
+    return jsonify(status_snapshot()), 200
+
+
+@app.route('/ready', methods=['GET'])
+def ready_check():
+    """🚦 200 cuando el pool hacia CoinEx y las cachés están calientes; 503 mientras tanto"""
+    body = {"ready": ready.is_set(), "startup_ms": startup_timings}
+    return jsonify(body), 200 if ready.is_set() else 503
+
+
+profiler = None
+
+
+@app.route('/admin/profile', methods=['GET'])
+def admin_profile():
+    """🔥 Perfil del proceso vivo (?mode=cpu|alloc&seconds=5&interval_ms=5&top=25&format=collapsed)"""
+    global profiler
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        return jsonify({"error": "No autorizado"}), 403
 
+    # Import diferido: tracemalloc y el perfilador solo se cargan si alguien los usa
+    from live_profiler import Profiler, ProfilerBusy, render_collapsed
+    if profiler is None:
+        profiler = Profiler()
 
-def run_code():
+    mode = request.args.get("mode", "cpu")
+    seconds = request.args.get("seconds", 5.0, type=float)
+    try:
+        if mode == "alloc":
+            return jsonify(profiler.allocation_diff(seconds, top=request.args.get("top", 25, type=int))), 200
+        if mode != "cpu":
+            return jsonify({"error": "mode debe ser 'cpu' o 'alloc'"}), 400
+        stacks, samples = profiler.sample_stacks(
+            seconds,
+            interval_ms=request.args.get("interval_ms", 5.0, type=float),
+            include_idle=request.args.get("idle") == "1",
+        )
+    except ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+
+    if request.args.get("format") == "collapsed":
+        return render_collapsed(stacks), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    return jsonify({"samples": samples, "stacks": len(stacks), "collapsed": render_collapsed(stacks)}), 200
+
+
+async def pipeline(ctx, io):
+    """🏁 Ejecución de una alerta: balance → riesgo → cierre → cancelación → apalancamiento →
+    orden → SL/TP → telemetría
+
+    Toda la E/S pasa por el transporte `io` (SYNC_IO en Flask, el de async_server.py
+    en modo asyncio); lo que bloquea fuera de CoinEx (risk_lock, spool) va por `io.blocking`.
+    """
     global last_alert, risk_state
 
-    print("🏁 run_code() ha sido llamado")  # 👈 VERIFICA SI SE EJECUTA
+    pipeline_log.debug("🏁 run_code() ha sido llamado")  # 👈 VERIFICA SI SE EJECUTA
+
+    if ctx is None:
+        ctx = TradeContext(last_alert["market"] if last_alert else None, alert=last_alert)
+        ctx.trace = tracer.start(ctx.alert_id, ctx.market)
+    trace = ctx.trace
+    alert = ctx.alert  # Cada alerta con su propio dict: seguro con hilos y greenlets concurrentes
+    market = alert["market"] if alert else None
+    ticket = preemption.arrive(market) if alert else None  # Turno de llegada en su mercado
 
     try:
-        print("🔄 Ejecutando run_code()...")  # 👈 Verifica si entra aquí
+        pipeline_log.debug("🔄 Ejecutando run_code()...")  # 👈 Verifica si entra aquí
+
+        # ♻️ Alerta recuperada del journal que ya envió su orden: nunca se vuelve a enviar
+        if ctx.stages is not None and "order" in ctx.stages:
+            await resume_after_order(ctx, io, ticket)
+            return
 
         if risk_state["paused"]:
-            print(f"⏸️ Operaciones pausadas: {risk_state['pause_reason']}")
-            reset_daily_if_needed(datetime.now(), risk_state["last_balance"])
+            pipeline_log.warning("⏸️ Operaciones pausadas: %s", risk_state['pause_reason'])
+            await io.blocking(reset_paused_if_needed)
             return
         
-        if last_alert:
-            
-            print(f"🚀 Obteniendo balance...")  # 👈 Verifica los datos antes de enviar
+        if alert:
+
+            # ⌛ Antes de cualquier llamada a CoinEx: una señal vieja no se ejecuta a mercado
+            action = judge_staleness(alert)
+            if action == "drop":
+                ctx.finish("stale")
+                return
+            if action == "close_only":
+                async with io.stage(market, ticket, claim=True), trace.span("close"):
+                    position_cache.take(market)
+                    position_cache.record_close(market, await io.close_position())
+                async with io.stage(market, ticket), trace.span("cancel"):
+                    await io.cancel_all_orders(alert["side"])
+                await io.blocking(emit_trade, ctx.finish("stale_closed"), {"status": "stale_closed", "alert": alert})
+                return
+
+            pipeline_log.info("🚀 Obteniendo balance...")  # 👈 Verifica los datos antes de enviar
             
-            response_0 = get_futures_balance()
+            with trace.span("balance_fetch"):
+                response_0 = await io.balance()
             
-            print(f"🔍 Respuesta de close_position: {response_0}")  # 👈 Ver si se devuelve algo
+            pipeline_log.debug("🔍 Respuesta de close_position: %s", response_0)  # 👈 Ver si se devuelve algo
 
             if response_0.status_code == 200:
                 response_data = response_0.json()
@@ -617,78 +1030,125 @@ def run_code():
                             balance = float(first_entry.get("available", 0))
                             margin = float(first_entry.get("margin", 0))  # ✅ Extrae margin correctamente
                             total_balance = balance + margin  # ✅ Balance total sumando margin
-                            print(f"✅ Balance disponible: {balance}, Margin: {margin}, Total: {total_balance}")
+                            pipeline_log.info("✅ Balance disponible: %s, Margin: %s, Total: %s", balance, margin, total_balance)
 
-                            # 🔄 Reset automático si han pasado 24h
-                            reset_daily_if_needed(datetime.now(), total_balance)
+                            with trace.span("risk_check"):
+                                within_limits = await io.blocking(within_risk_limits, total_balance)
 
-                            # ✅ Verificar límites de riesgo
-                            if not check_risk_limits(total_balance):
-                                print("⚠️ Límite alcanzado. No se envía la orden.")
+                            if not within_limits:
+                                pipeline_log.warning("⚠️ Límite alcanzado. No se envía la orden.")
                                 return
                         else:
-                            print("⚠️ El primer elemento de 'data' no es un diccionario válido.")
+                            pipeline_log.warning("⚠️ El primer elemento de 'data' no es un diccionario válido.")
                             return
                     else:
-                        print(f"⚠️ La respuesta de CoinEx no tiene datos de balance.")
+                        pipeline_log.warning("⚠️ La respuesta de CoinEx no tiene datos de balance.")
                         return
                 else:
-                    print(f"❌ Error en la respuesta de CoinEx: {response_data.get('message', 'Desconocido')}")
+                    pipeline_log.error("❌ Error en la respuesta de CoinEx: %s", response_data.get('message', 'Desconocido'))
                     return
             else:
-                print(f"❌ Error HTTP al obtener balance: {response_0.status_code}")
+                pipeline_log.error("❌ Error HTTP al obtener balance: %s", response_0.status_code)
                 return
 
+            # ⛳ Si mientras tanto llegó una alerta más nueva del mercado, esta ya no sigue
+            preemption.checkpoint(market, ticket)
+
             # Ajustar amount según balance y lado de la orden
-            amount = last_alert["amount"]
+            amount = alert["amount"]
 
             # ✅ Ajustar cantidad según balance y tipo de operación
-            if last_alert["side"] == "buy":
-                amount = (total_balance / float(last_alert["price"])) * 5  # Compra: usar balance para obtener cantidad
-            elif last_alert["side"] == "sell":
-                amount = (total_balance / float(last_alert["price"])) * 5  # Venta: usar todo el balance disponible
+            if alert["side"] == "buy":
+                amount = (total_balance / float(alert["price"])) * 5  # Compra: usar balance para obtener cantidad
+            elif alert["side"] == "sell":
+                amount = (total_balance / float(alert["price"])) * 5  # Venta: usar todo el balance disponible
             else:
-                print("⚠️ Error: 'side' inválido. Debe ser 'buy' o 'sell'.")
+                pipeline_log.warning("⚠️ Error: 'side' inválido. Debe ser 'buy' o 'sell'.")
                 return
 
             # 🔥 Aplicar un offset del 2% para evitar "balance_not_enough"
             offset_percentage = 0.02  # 2% de margen de seguridad
             amount *= (1 - offset_percentage)  # Reduce un 2% la cantidad
 
-            # Actualizar la alerta con el nuevo amount
-            last_alert["amount"] = round(amount, 6)  # Redondear para evitar errores de precisión
+            # Actualizar la alerta con el nuevo amount, cuantizado según la precisión del mercado
+            if not ready.is_set():
+                # Alerta durante el arranque: esperar las reglas del mercado (se solapó con lo anterior)
+                await io.blocking(ready.wait, REQUEST_TIMEOUT)
+            market_rules = market_cache.get(alert["market"])
+            alert["amount"] = market_rules.quantize_amount(amount)
 
-            print(f"🚀 Monto ajustado para la orden: {last_alert['amount']} {last_alert['market']}")
+            pipeline_log.info("🚀 Monto ajustado para la orden: %s %s", alert['amount'], alert['market'])
 
-            print(f"🚀 Cancelando posición...")  # 👈 Verifica los datos antes de enviar
-            
-            response_1 = close_position()
-            
-            print(f"🔍 Respuesta de close_position: {response_1}")  # 👈 Ver si se devuelve algo
-            
-            print(f"🚀 Cancelando todas las órdenes...")  # 👈 Verifica los datos antes de enviar
-            
-            response_2 = cancel_all_orders(
-                last_alert["side"]
-            )
-            
-            print(f"🔍 Respuesta de cancel_all_orders: {response_2}")  # 👈 Ver si se devuelve algo
+            if not market_rules.meets_minimum(alert["amount"]):
+                pipeline_log.warning("⚠️ Monto %s por debajo del mínimo %s. No se envía la orden.", alert['amount'], market_rules.min_amount)
+                return
 
-            print(f"🚀 Ajustando apalancamiento...")  # 👈 Verifica los datos antes de enviar
-            
-            response_3 = adjust_position_leverage()
-            
-            print(f"🔍 Respuesta de adjust_position_leverage: {response_3}")  # 👈 Ver si se devuelve algo
+            # 🔀 Desde aquí esta alerta es la vigente del mercado: una anterior en curso se
+            # detiene en su siguiente etapa y este cierre/cancelación (o la lectura de la
+            # posición del flip, tras su orden en vuelo) recoge lo que ya envió
+            response_1 = response_2 = None
+            flip_amount = None
+            if FLIP_MODE:
+                async with io.stage(market, ticket, claim=True), trace.span("position"):
+                    flip_amount = await flip_order_amount(alert, market_rules, io)
+
+            if flip_amount is None:
+                pipeline_log.info("🚀 Cancelando posición...")  # 👈 Verifica los datos antes de enviar
+
+                async with io.stage(market, ticket, claim=True), trace.span("close"):
+                    position_cache.take(market)
+                    response_1 = await io.close_position()
+                    position_cache.record_close(market, response_1)
+
+                pipeline_log.debug("🔍 Respuesta de close_position: %s", response_1)  # 👈 Ver si se devuelve algo
+
+                pipeline_log.info("🚀 Cancelando todas las órdenes...")  # 👈 Verifica los datos antes de enviar
+
+                async with io.stage(market, ticket), trace.span("cancel"):
+                    response_2 = await io.cancel_all_orders(
+                        alert["side"]
+                    )
+
+                pipeline_log.debug("🔍 Respuesta de cancel_all_orders: %s", response_2)  # 👈 Ver si se devuelve algo
+            else:
+                pipeline_log.info("🔁 Flip: una sola orden de %s %s (posición anterior incluida)", flip_amount, alert['market'])
+
+            response_3 = None
+            if leverage_cache.needs_adjust(alert["market"], MARGIN_MODE, LEVERAGE):
+                pipeline_log.info("🚀 Ajustando apalancamiento...")  # 👈 Verifica los datos antes de enviar
+
+                adjusted = False
+                try:
+                    async with io.stage(market, ticket), trace.span("leverage"):
+                        response_3 = await io.adjust_position_leverage(alert["market"], MARGIN_MODE, LEVERAGE)
+
+                    pipeline_log.debug("🔍 Respuesta de adjust_position_leverage: %s", response_3)  # 👈 Ver si se devuelve algo
+
+                    adjusted = response_3.json().get("code") == 0
+                except ValueError:
+                    pass
+                finally:
+                    leverage_cache.adjusted(alert["market"], MARGIN_MODE, LEVERAGE, adjusted)
+            else:
+                pipeline_log.info("⏭️ Apalancamiento ya en %sx %s, no se ajusta.", LEVERAGE, MARGIN_MODE)
             
-            print(f"🚀 Enviando orden con alerta: {last_alert}")  # 👈 Verifica los datos antes de enviar
+            pipeline_log.info("🚀 Enviando orden con alerta: %s", alert)  # 👈 Verifica los datos antes de enviar
 
-            response_4 = send_order_to_coinex(
-                last_alert["market"],
-                last_alert["side"],
-                last_alert["amount"],
-            )
+            if ctx.stages is not None:
+                # Write-ahead: si el proceso muere desde aquí, la recuperación no reenvía la orden
+                await io.blocking(ctx.stages.mark, "order", True)
+            async with io.stage(market, ticket), trace.span("order", side=alert["side"]):
+                position_before = position_cache.take(market)
+                response_4 = await io.send_order_to_coinex(
+                    alert["market"],
+                    alert["side"],
+                    flip_amount or alert["amount"],
+                )
+                position_cache.record_fill(market, position_before, alert["side"], response_4)
+            fill_time = time.perf_counter()  # ⏱️ Inicio de la ventana sin protección
+            fill_start_ns = time.perf_counter_ns()
 
-            print(f"🔍 Respuesta de send_order_to_coinex: {response_4}")  # 👈 Ver si se devuelve algo
+            pipeline_log.debug("🔍 Respuesta de send_order_to_coinex: %s", response_4)  # 👈 Ver si se devuelve algo
 
 
             if response_4.status_code == 200:
@@ -699,26 +1159,30 @@ def run_code():
 
                     if isinstance(data, list) and len(data) > 0:  
                         first_entry = data[0]  # Para respuestas donde "data" es una lista
-                        print("📌 Data es una lista:", first_entry)
+                        pipeline_log.debug("📌 Data es una lista: %s", first_entry)
                         avg_entry_price = float(first_entry.get("last_filled_price", 0))
                         filled_value = float(first_entry.get("filled_value", 0))
-                        log_event("order", {"market": data.get("market"),"side": data.get("side"),"entry_price": avg_entry_price,"filled_value": filled_value,"order_id": data.get("order_id")})
+                        filled_amount = float(first_entry.get("filled_amount") or 0)
+                        ctx.log_event("order", {"market": first_entry.get("market"),"side": first_entry.get("side"),"entry_price": avg_entry_price,"filled_value": filled_value,"order_id": first_entry.get("order_id")})
                     elif isinstance(data, dict):
-                        print("📌 Data es un diccionario:", data)  # Para respuestas donde "data" es un diccionario
+                        pipeline_log.debug("📌 Data es un diccionario: %s", data)  # Para respuestas donde "data" es un diccionario
                         avg_entry_price = float(data.get("last_filled_price", 0))
                         filled_value = float(data.get("filled_value", 0))
-                        log_event("order", {"market": data.get("market"),"side": data.get("side"),"entry_price": avg_entry_price,"filled_value": filled_value,"order_id": data.get("order_id")})
+                        filled_amount = float(data.get("filled_amount") or 0)
+                        ctx.log_event("order", {"market": data.get("market"),"side": data.get("side"),"entry_price": avg_entry_price,"filled_value": filled_value,"order_id": data.get("order_id")})
                     else:
-                        print("⚠️ Formato inesperado de 'data':", data)
+                        pipeline_log.warning("⚠️ Formato inesperado de 'data': %s", data)
                 else:
-                    print(f"❌ Error en la respuesta de CoinEx: {response_data_1.get('message', 'Desconocido')}")
+                    pipeline_log.error("❌ Error en la respuesta de CoinEx: %s", response_data_1.get('message', 'Desconocido'))
                     return
             else:
-                print(f"❌ Error HTTP al obtener datos de la orden: {response_4.status_code}")
+                pipeline_log.error("❌ Error HTTP al obtener datos de la orden: %s", response_4.status_code)
                 return
             
-            print(f"🔍 Precio de entrada recibido: {avg_entry_price}")
-            print(f"📦 Monto operado: {filled_value}")
+            trace.add_span("fill", fill_start_ns, time.perf_counter_ns())
+
+            pipeline_log.debug("🔍 Precio de entrada recibido: %s", avg_entry_price)
+            pipeline_log.info("📦 Monto operado: %s", filled_value)
 
             # === PARÁMETROS DE RIESGO Y CÁLCULO DE ROI ===
             balance = total_balance  # Tu balance real sin apalancamiento
@@ -728,124 +1192,322 @@ def run_code():
             roi_gain = balance * risk_pct_gain  # Ej: 3 USDT + 1
             roi_loss = balance * risk_pct_loss  # Ej: 1 USDT
 
-            btc_size = filled_value / avg_entry_price  # Cantidad real de BTC operado
+            btc_size = filled_amount or filled_value / avg_entry_price  # Cantidad real de BTC operado
+            if flip_amount is not None:
+                # Sin la parte que cerró la posición anterior; con fill parcial la nueva es menor
+                closed, btc_size = flip_fill(btc_size, flip_amount, alert["amount"])
+                if btc_size <= 0:
+                    pipeline_log.error("🚨 Flip ejecutado en parte: la orden no llegó a abrir la nueva posición",
+                                       extra=kv(order_amount=flip_amount, closed=closed))
+                    await io.blocking(emit_trade, ctx.finish("partial_fill"), {"status": "partial_fill", "alert": alert})
+                    return
 
             # === CÁLCULO DE TP/SL ===
         
-            if last_alert["side"] == "buy":
+            if alert["side"] == "buy":
                 tp_price = avg_entry_price + (roi_gain / btc_size)
                 sl_price = avg_entry_price - (roi_loss / btc_size)
-            elif last_alert["side"] == "sell":
+            elif alert["side"] == "sell":
                 tp_price = avg_entry_price - (roi_gain / btc_size)
                 sl_price = avg_entry_price + (roi_loss / btc_size)
             else:
-                print("⚠️ Error: 'side' inválido. Debe ser 'buy' o 'sell'")
+                pipeline_log.warning("⚠️ Error: 'side' inválido. Debe ser 'buy' o 'sell'")
                 return
 
             # === GUARDAR EN LA ALERTA Y REDONDEAR ===
-            last_alert["tp_price"] = round(tp_price, 2)
-            last_alert["sl_price"] = round(sl_price, 2)
+            alert["tp_price"] = market_rules.quantize_price(tp_price)
+            alert["sl_price"] = market_rules.quantize_price(sl_price)
 
             # === MOSTRAR RESULTADO ===
-            print("📊 Cálculo de TP y SL:")
-            print(f"  🔸 Take Profit: {last_alert['tp_price']}  (+{roi_gain:.2f} USDT)")
-            print(f"  🔸 Stop Loss  : {last_alert['sl_price']}  (-{roi_loss:.2f} USDT)")
+            pipeline_log.info("📊 Cálculo de TP y SL:")
+            pipeline_log.info("  🔸 Take Profit: %s  (+%.2f USDT)", alert['tp_price'], roi_gain)
+            pipeline_log.info("  🔸 Stop Loss  : %s  (-%.2f USDT)", alert['sl_price'], roi_loss)
+            if ctx.stages is not None:
+                # En disco antes del SL/TP: si se cae ahora, la recuperación solo tiene que protegerla
+                await io.blocking(ctx.stages.mark, "filled", True,
+                                  {"sl_price": alert["sl_price"], "tp_price": alert["tp_price"]})
             
-            response_5 = set_position_stop_loss(
-                last_alert["sl_price"]
-            )
-
-            print(f"🔍 Respuesta de set_position_stop_loss: {response_5}")  # 👈 Ver si se devuelve algo
-            log_event("stop_loss", {"price": last_alert["sl_price"],"response": response_5.json() if response_5 else None})
-
-            response_6 = set_position_take_profit(
-                last_alert["tp_price"]
-            )
-
-            print(f"🔍 Respuesta de set_position_take_profit: {response_6}")  # 👈 Ver si se devuelve algo
-            log_event("take_profit", {"price": last_alert["tp_price"],"response": response_6.json() if response_6 else None})
-
-            if response_1:
-                try:
-                    print(f"✅ Respuesta JSON de CoinEx: {response_1.json()}")  # 👈 Imprime la respuesta JSON real
-                except Exception as e:
-                    print(f"❌ Error al leer JSON de CoinEx: {str(e)} - Respuesta cruda: {response_1.text}")  # 👈 Ver error real
-
-            if response_2:
-                try:
-                    print(f"✅ Respuesta JSON de CoinEx: {response_2.json()}")  # 👈 Imprime la respuesta JSON real
-                except Exception as e:
-                    print(f"❌ Error al leer JSON de CoinEx: {str(e)} - Respuesta cruda: {response_2.text}")  # 👈 Ver error real
-
-            if response_3:
-                try:
-                    print(f"✅ Respuesta JSON de CoinEx: {response_3.json()}")  # 👈 Imprime la respuesta JSON real
-                except Exception as e:
-                    print(f"❌ Error al leer JSON de CoinEx: {str(e)} - Respuesta cruda: {response_3.text}")  # 👈 Ver error real
-
-            if response_4:
-                try:
-                    print(f"✅ Respuesta JSON de CoinEx: {response_4.json()}")  # 👈 Imprime la respuesta JSON real
-                except Exception as e:
-                    print(f"❌ Error al leer JSON de CoinEx: {str(e)} - Respuesta cruda: {response_4.text}")  # 👈 Ver error real
-
-            if response_5:
-                try:
-                    print(f"✅ Respuesta JSON de CoinEx: {response_5.json()}")  # 👈 Imprime la respuesta JSON real
-                except Exception as e:
-                    print(f"❌ Error al leer JSON de CoinEx: {str(e)} - Respuesta cruda: {response_5.text}")  # 👈 Ver error real
-
-            if response_6:
-                try:
-                    print(f"✅ Respuesta JSON de CoinEx: {response_6.json()}")  # 👈 Imprime la respuesta JSON real
-                except Exception as e:
-                    print(f"❌ Error al leer JSON de CoinEx: {str(e)} - Respuesta cruda: {response_6.text}")  # 👈 Ver error real
+            # 🛡️ SL y TP en paralelo, cada uno con sus propios reintentos
+            async with io.stage(market, ticket):
+                response_5, response_6 = await io.protect(
+                    alert["sl_price"],
+                    alert["tp_price"],
+                    fill_time,
+                    trace,
+                )
+
+            pipeline_log.debug("🔍 Respuesta de set_position_stop_loss: %s", response_5)  # 👈 Ver si se devuelve algo
+            ctx.log_event("stop_loss", {"price": alert["sl_price"],"response": response_5.json() if response_5 else None})
+
+            pipeline_log.debug("🔍 Respuesta de set_position_take_profit: %s", response_6)  # 👈 Ver si se devuelve algo
+            ctx.log_event("take_profit", {"price": alert["tp_price"],"response": response_6.json() if response_6 else None})
+            if ctx.stages is not None and response_5 and response_6:
+                await io.blocking(ctx.stages.mark, "protected")
+
+            if flip_amount is not None:
+                # En flip la cancelación va con la posición ya protegida, fuera del camino crítico
+                # (el SL/TP de posición no son órdenes pendientes: no los cancela)
+                async with io.stage(market, ticket), trace.span("cancel"):
+                    response_2 = await io.cancel_all_orders(alert["side"])
+
+            # 📌 Volcado de las respuestas (solo con DEBUG y muestreado)
+            if pipeline_log.isEnabledFor(logging.DEBUG):
+                for step, step_response in (("close_position", response_1), ("cancel_all_orders", response_2),
+                                            ("adjust_position_leverage", response_3), ("send_order_to_coinex", response_4),
+                                            ("set_position_stop_loss", response_5), ("set_position_take_profit", response_6)):
+                    if step_response:
+                        pipeline_log.debug("✅ Respuesta JSON de CoinEx", extra=kv(sampled=True, step=step, raw=step_response.text))
 
             # === EVALUAR RESULTADO DE LA OPERACIÓN ===
-            if risk_state["last_balance"] is not None:
-                if total_balance < risk_state["last_balance"]:
-                    risk_state["consecutive_losses"] += 1
-                    print(f"📉 Pérdida detectada. Consecutivas: {risk_state['consecutive_losses']}")
-                else:
-                    risk_state["consecutive_losses"] = 0
-                    print("📈 Ganancia detectada. Reset de consecutivas.")
+            preemption.checkpoint(market, ticket)
+            await io.blocking(record_trade_result, total_balance)
 
             # ✅ EVENTO FINAL
             final_payload = {
                 "status": "completed",
-                "alert": last_alert,
-                "events": event_pipeline,
+                "alert": alert,
                 "summary": {
                     "balance": total_balance,
-                    "side": last_alert["side"],
-                    "amount": last_alert["amount"],
-                    "tp": last_alert.get("tp_price"),
-                    "sl": last_alert.get("sl_price")
+                    "side": alert["side"],
+                    "amount": alert["amount"],
+                    "tp": alert.get("tp_price"),
+                    "sl": alert.get("sl_price")
                 }
             }
 
-            print("📦 FINAL PAYLOAD:", final_payload)
+            # 🚀 Enviar a Azure (en segundo plano, sin bloquear la operación)
+            with trace.span("azure_report"):
+                await io.blocking(emit_trade, ctx.finish("completed"), final_payload)
 
-            # 🚀 Enviar a Azure
-            requests.post(AZURE_FUNCTION_URL,json=final_payload)
+            pipeline_log.info("📦 FINAL PAYLOAD", extra=kv(sampled=True, payload=final_payload))
 
-            risk_state["last_balance"] = total_balance
+            if last_alert is alert:
+                last_alert = None  # Limpia alerta después de usarla
 
-            event_pipeline.clear()
+        else:
+            pipeline_log.warning("⚠️ No hay alertas pendientes.")
 
-            last_alert = None  # Limpia alerta después de usarla
+    except CircuitOpenError as e:
+        pipeline_log.warning("⛔ CoinEx degradado, se aborta run_code(): %s", e)
 
-        else:
-            print("⚠️ No hay alertas pendientes.")
+    except Preempted as e:
+        # Lo ya enviado (orden, SL/TP) lo cierra y cancela la alerta nueva al empezar
+        pipeline_log.warning("🔀 %s; no se envía nada más", e)
+        PREEMPTED.inc()
+        await io.blocking(emit_trade, ctx.finish("preempted"),
+                          {"status": "preempted", "alert": alert, "superseded_by": e.current})
 
     except Exception as e:
-        print(f"🔥 Error en run_code(): {str(e)}")
+        pipeline_log.error("🔥 Error en run_code(): %s", e)
 
     except Exception as e:
-        print("Error:", str(e))
-        time.sleep(3)
-        run_code()
+        pipeline_log.error("Error: %s", e)
+        await io.blocking(time.sleep, 3)
+        await pipeline(None, io)
+
+    finally:
+        # Operación interrumpida con eventos registrados: también se reporta
+        if ctx.status == "pending" and len(ctx):
+            await io.blocking(emit_trade, ctx.finish("aborted"), {"status": "aborted", "alert": alert})
+        outcome = ctx.status if ctx.status != "pending" else "not_executed"
+        tracer.finish(trace, outcome)
+        ALERTS.labels(outcome).inc()
+
+
+async def resume_after_order(ctx, io, ticket):
+    """♻️ Alerta recuperada que ya envió su orden: solo se completa su SL/TP, la orden no se repite"""
+    alert, stages, market = ctx.alert, ctx.stages, ctx.market
+    if "protected" in stages:
+        pipeline_log.info("♻️ Alerta recuperada ya protegida, no se envía nada", extra=kv(alert=alert))
+        await io.blocking(emit_trade, ctx.finish("completed"), {"status": "completed", "alert": alert})
+        return
+    filled = stages.get("filled")
+    if filled is None:
+        # Se cayó con la orden quizá enviada y sin su fill anotado: no hay con qué calcular el SL/TP
+        pipeline_log.error("🚨 Alerta recuperada con la orden quizá ejecutada y sin SL/TP: revisar la posición a mano",
+                           extra=kv(alert=alert))
+        await io.blocking(emit_trade, ctx.finish("unprotected"), {"status": "unprotected", "alert": alert})
+        return
+    pipeline_log.warning("♻️ Alerta recuperada con la orden ya ejecutada: solo se envía su SL/TP",
+                         extra=kv(alert=alert, sl=filled["sl_price"], tp=filled["tp_price"]))
+    async with io.stage(market, ticket):
+        response_5, response_6 = await io.protect(filled["sl_price"], filled["tp_price"], time.perf_counter(), ctx.trace)
+    ctx.log_event("stop_loss", {"price": filled["sl_price"], "response": response_5.json() if response_5 else None})
+    ctx.log_event("take_profit", {"price": filled["tp_price"], "response": response_6.json() if response_6 else None})
+    if response_5 and response_6:
+        await io.blocking(stages.mark, "protected")
+    await io.blocking(emit_trade, ctx.finish("recovered"), {"status": "recovered", "alert": alert})
+
+
+def run_sync(coroutine):
+    """Ejecuta de una vez una corrutina que nunca se suspende (pipeline con SYNC_IO)"""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("El pipeline síncrono se suspendió: el transporte no es síncrono")
+
+
+class SyncTransport(object):
+    """E/S del pipeline para Flask y gunicorn: las funciones síncronas de este módulo
+
+    Sus corrutinas terminan sin suspenderse; con gevent las esperas de red ceden
+    el greenlet igual que antes.
+    """
+
+    async def balance(self):
+        return get_futures_balance()
+
+    async def pending_positions(self):
+        # Sin single-flight: una lectura ya en vuelo pudo empezar antes de la última orden
+        return request_client.request(
+            "GET",
+            "{url}/futures/pending-position".format(url=request_client.url),
+            params={"market_type": "FUTURES"},
+        )
+
+    async def close_position(self):
+        return close_position()
+
+    async def cancel_all_orders(self, side):
+        return cancel_all_orders(side)
+
+    async def adjust_position_leverage(self, market, margin_mode, leverage):
+        return adjust_position_leverage(market, margin_mode, leverage)
+
+    async def send_order_to_coinex(self, market, side, amount):
+        return send_order_to_coinex(market, side, amount)
+
+    async def protect(self, sl_price, tp_price, fill_time, trace):
+        return protective_stage.run(sl_price, tp_price, fill_time, trace)
+
+    async def blocking(self, func, *args):
+        return func(*args)
+
+    @asynccontextmanager
+    async def stage(self, market, ticket, claim=False):
+        with preemption.stage(market, ticket, claim=claim):
+            yield
+
+
+SYNC_IO = SyncTransport()
+
+
+def run_code(ctx=None):
+    """Pipeline de una alerta en el hilo (o greenlet) actual"""
+    run_sync(pipeline(ctx, SYNC_IO))
+
+# 📝 Alertas aceptadas por /webhook pendientes de ejecutar (solo con ALERT_JOURNAL_PATH; ver start())
+alert_queue = None
+
+
+def open_alert_queue(handler):
+    """Crea la cola del journal con el `handler(alerta, recibida, traza, etapas)` del servidor que la ejecuta"""
+    global alert_queue
+    if not ALERT_JOURNAL_PATH or alert_queue is not None:
+        return alert_queue
+    alert_queue = AlertQueue(
+        AlertJournal(ALERT_JOURNAL_PATH, commit_interval=ALERT_COMMIT_MS / 1000,
+                     commit_timeout=ALERT_COMMIT_TIMEOUT),
+        handler, workers=ALERT_WORKERS, max_age=ALERT_MAX_AGE_SECONDS)
+    REGISTRY.callback("alert_queue_depth", "Alertas guardadas en el journal esperando ejecución", alert_queue.depth)
+    REGISTRY.callback("alert_journal_total", "Alertas del journal por resultado",
+                      lambda: {(k, ): v for k, v in alert_queue.stats().items()
+                               if k in ("accepted", "recovered", "executed", "stale", "failed")},
+                      ("result",), kind="counter")
+    return alert_queue
+
+# 🔥 Calentamiento: conexiones keep-alive, reglas de mercado, apalancamiento y telemetría
+ready = threading.Event()
+
+
+def _timed(phase, func):
+    started = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        logging.error("❌ Falló el calentamiento '%s': %s", phase, e)
+    startup_timings[f"{phase}_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def warmup():
+    """Carga lo que la primera alerta necesita; /ready pasa a 200 al terminar"""
+    _timed("warmup_markets", market_cache.start)  # Abre además la primera conexión del pool
+    _timed("warmup_leverage", seed_leverage_cache)
+    _timed("warmup_telemetry", telemetry.start)
+    _timed("warmup_clock", server_clock.start)
+    if alert_queue is not None:
+        _timed("warmup_alerts", alert_queue.start)  # Recupera lo pendiente de procesos caídos
+    startup_timings["ready_ms"] = round((time.perf_counter() - _import_started) * 1000, 1)
+    ready.set()
+    logging.info("🚦 Listo en %s ms: %s", startup_timings["ready_ms"], startup_timings)
+
+
+def preload():
+    """📦 En el master de gunicorn (preload_app): llena las cachés que heredan los workers
+
+    El master queda pasivo: no arranca hilos de fondo (refresco de mercados, telemetría,
+    reloj) ni la cola del journal; cada worker los arranca en after_fork().
+    """
+    _timed("preload_markets", market_cache.load)
+    _timed("preload_leverage", seed_leverage_cache)
+    _timed("preload_clock", server_clock.sync)
+    logging.info("📦 Cachés precargadas en el master: %s", startup_timings)
+
+
+def before_fork():
+    """🍴 En el master de gunicorn antes de cada worker: nada de hilos ni sockets que heredar"""
+    if alert_queue is not None:
+        alert_queue.stop()  # Termina lo recuperado al arrancar; los workers abren su propio journal
+    request_client.reset_session()  # Los sockets no deben compartirse entre procesos
+    stop_logging()  # Escribe lo pendiente y para el listener: los hijos montan el suyo
+
+
+def after_fork():
+    """🍴 En cada worker de gunicorn: logging, hilos de fondo y pool propios del proceso
+
+    Los hilos arrancados antes del fork no existen en el hijo y los sockets del
+    padre no deben compartirse; las cachés ya cargadas sí se heredan.
+    """
+    restart_logging()
+    request_client.reset_session()
+    ready.clear()
+    start(warmup_mode="background")
+
+
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def start(handler=execute_alert, warmup_mode=None):
+    """🚀 Arranca lo de fondo de este proceso: cola del journal de alertas y calentamiento
+
+    Importar el módulo no arranca nada: async_server.py lo importa por sus componentes
+    y llama a start() con su propio handler. Con Flask lo llaman __main__, los hooks de
+    gunicorn o, si no, la primera petición. Una vez por proceso (de nuevo tras un fork).
+    """
+    global _started_pid
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+    open_alert_queue(handler)
+    if (warmup_mode or STARTUP_WARMUP) == "sync":
+        warmup()
+    else:
+        threading.Thread(target=warmup, name="warmup", daemon=True).start()
+
+
+@app.before_request
+def _start_on_first_request():
+    if _started_pid != os.getpid():
+        start()
+
+
+startup_timings["init_ms"] = round((time.perf_counter() - _import_started) * 1000 - startup_timings["imports_ms"], 1)
 
 if __name__ == "__main__":
+    start()
     app.run(host="0.0.0.0", port=5000)
     run_code()
\ No newline at end of file
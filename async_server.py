@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""Modo asyncio: webhook, cliente REST de CoinEx y streams websocket en un solo event loop.
+
+    python async_server.py --port 5000            # solo HTTP
+    python async_server.py --port 5000 --streams  # + streams de websocket_main.py
+
+Mismas rutas y el mismo pipeline que app.py (`app.handle_webhook()` y `app.pipeline()`),
+con un transporte que hace la E/S sobre aiohttp: cada alerta es una tarea del loop en
+lugar de un hilo del servidor. Comparte con app.py el estado de riesgo, las cachés de
+mercado y apalancamiento, los circuitos, las trazas y /metrics.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import urlencode, urlparse
+
+import aiohttp
+import requests
+import yarl
+from aiohttp import web
+
+import app as core
+from logging_setup import kv
+from resilience import CoinExHTTPError, is_retryable_error, is_retryable_response
+
+log = logging.getLogger("async")
+
+
+class AsyncResponse(object):
+    """Lo que el pipeline usa de requests.Response: status_code, text y json()"""
+
+    __slots__ = ("status_code", "text")
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncCoinExClient(object):
+    """Cliente REST de CoinEx sobre aiohttp; firma, circuitos y métricas de app.request_client"""
+
+    def __init__(self, signer=None, pool_size=None):
+        self.signer = signer or core.request_client
+        self.url = self.signer.url
+        self.pool_size = pool_size or core.POOL_SIZE
+        self.session = None
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=core.REQUEST_TIMEOUT),
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def throttle(self, signed_path):
+        """⏳ Mismo presupuesto global por grupo que los workers síncronos (archivo mmap con
+        flock: se reserva en un hilo para no bloquear el loop)"""
+        group = self.signer.breakers.group_for(signed_path)
+        wait_time = await asyncio.get_running_loop().run_in_executor(None, core.rate_limits.reserve, group)
+        if wait_time > 0:
+            core.RATE_LIMIT_WAIT.labels(group).observe(wait_time)
+            await asyncio.sleep(wait_time)
+
+    async def request(self, method, request_path, params=None, data="", throttle=True):
+        url = f"{self.url}{request_path}"
+        signed_path = urlparse(url).path
+        if throttle:  # Antes del circuito, como en RequestsClient.request()
+            await self.throttle(signed_path)
+
+        breaker = self.signer.breakers.for_path(signed_path)
+        breaker.before_call()
+        start = time.perf_counter()
+        try:
+            timestamp = str(int(time.time() * 1000))
+            params = {k: v for k, v in (params or {}).items() if v is not None}
+            if params:
+                # La URL se envía tal cual se firmó (sin re-codificar la query)
+                signed_path += "?" + urlencode(params)
+                url += "?" + urlencode(params)
+            body = data if method == "POST" else ""
+            headers = self.signer.get_common_headers(
+                self.signer.gen_sign(method, signed_path, body, timestamp), timestamp)
+            try:
+                async with self.session.request(method, yarl.URL(url, encoded=True),
+                                                data=body or None, headers=headers) as resp:
+                    response = AsyncResponse(resp.status, await resp.text())
+            except asyncio.TimeoutError as e:
+                raise requests.exceptions.Timeout(str(e))
+            except aiohttp.ClientError as e:
+                raise requests.exceptions.ConnectionError(str(e))
+            if response.status_code != 200:
+                raise CoinExHTTPError(response)
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            breaker.record(not is_retryable_error(e), elapsed)
+            core.COINEX_LATENCY.labels(urlparse(url).path).observe(elapsed)
+            raise
+        except BaseException:
+            breaker.release()  # Tarea cancelada: sin resultado
+            raise
+
+        elapsed = time.perf_counter() - start
+        breaker.record(not is_retryable_response(response), elapsed)
+        core.COINEX_LATENCY.labels(urlparse(url).path).observe(elapsed)
+        return response
+
+    async def get(self, request_path, params=None, hedge=None):
+        """🔁 `RequestsClient.get()` en el loop: mismo single-flight (y su caché), reintentos y hedging"""
+        hedger = self.signer.hedger
+        hedge = hedger is not None if hedge is None else hedge
+        key = (f"{self.url}{request_path}", tuple(sorted((params or {}).items())))
+
+        async def attempt():
+            # Turno del limitador fuera de lo que mide el hedger (ver RequestsClient.get())
+            path = urlparse(self.url).path + request_path
+            send = lambda: self.request("GET", request_path, params, throttle=False)
+            await self.throttle(path)
+            if hedge and hedger is not None:
+                return await hedger.call_async(path, send, before_hedge=lambda: self.throttle(path))
+            return await send()
+
+        return await self.signer.single_flight.do_async(
+            key, lambda: self.signer.retry_policy.call_async(attempt))
+
+
+client = AsyncCoinExClient()
+
+async def get_futures_balance():
+    core.balance_log.info("📤 Obteniendo balance en CoinEx")
+    try:
+        response = await client.get("/assets/futures/balance")
+    except requests.exceptions.RequestException as e:
+        core.balance_log.error("🚨 Error de conexión con CoinEx", extra=kv(error=str(e)))
+        raise
+    core.log_coinex_response(core.balance_log, response)
+    return response
+
+
+async def _post(request_path, data, step_log, message):
+    step_log.info(message, extra=kv(payload=data))
+    try:
+        response = await client.request("POST", request_path, data=json.dumps(data))
+    except requests.exceptions.RequestException as e:
+        step_log.error("🚨 Error de conexión con CoinEx", extra=kv(error=str(e)))
+        raise
+    core.log_coinex_response(step_log, response)
+    return response
+
+
+def close_position():
+    data = {"market": "BTCUSDT", "market_type": "FUTURES", "type": "market", "amount": None,
+            "client_id": "user1", "is_hide": True}
+    return _post("/futures/close-position", data, core.close_log,
+                 "📤 Cerrando posiciones en CoinEx")
+
+
+def cancel_all_orders(side):
+    data = {"market": "BTCUSDT", "market_type": "FUTURES", "side": side}
+    return _post("/futures/cancel-all-order", data, core.cancel_log,
+                 "📤 Cancelando todas las órdenes en CoinEx")
+
+
+def adjust_position_leverage(market="BTCUSDT", margin_mode=core.MARGIN_MODE, leverage=core.LEVERAGE):
+    data = {"market": market, "market_type": "FUTURES", "margin_mode": margin_mode, "leverage": leverage}
+    return _post("/futures/adjust-position-leverage", data, core.leverage_log,
+                 "📤 Ajustando apalancamiento en CoinEx")
+
+
+def set_position_stop_loss(sl_price):
+    data = {"market": "BTCUSDT", "market_type": "FUTURES", "stop_loss_type": "latest_price",
+            "stop_loss_price": sl_price}
+    return _post("/futures/set-position-stop-loss", data, core.stop_loss_log,
+                 "📤 Enviando stop loss")
+
+
+def set_position_take_profit(tp_price):
+    data = {"market": "BTCUSDT", "market_type": "FUTURES", "take_profit_type": "latest_price",
+            "take_profit_price": tp_price}
+    return _post("/futures/set-position-take-profit", data, core.take_profit_log,
+                 "📤 Enviando take profit")
+
+
+def send_order_to_coinex(market, side, amount):
+    data = {"market": market, "market_type": "FUTURES", "side": side, "type": "market", "amount": amount,
+            "client_id": "user1", "is_hide": True}
+    return _post("/futures/order", data, core.order_log, "📤 Enviando orden a CoinEx")
+
+
+class AsyncTransport(object):
+    """E/S del pipeline de app.py (`core.pipeline()`) sobre el loop
+
+    Las llamadas a CoinEx van por aiohttp; lo que bloquea fuera de la red
+    (risk_lock y su journal, el spool de telemetría) se ejecuta en el executor.
+    """
+
+    async def balance(self):
+        return await get_futures_balance()
+
+    async def pending_positions(self):
+        # Sin single-flight: una lectura ya en vuelo pudo empezar antes de la última orden
+        return await client.request("GET", "/futures/pending-position", {"market_type": "FUTURES"})
+
+    async def close_position(self):
+        return await close_position()
+
+    async def cancel_all_orders(self, side):
+        return await cancel_all_orders(side)
+
+    async def adjust_position_leverage(self, market, margin_mode, leverage):
+        return await adjust_position_leverage(market, margin_mode, leverage)
+
+    async def send_order_to_coinex(self, market, side, amount):
+        return await send_order_to_coinex(market, side, amount)
+
+    async def protect(self, sl_price, tp_price, fill_time, trace):
+        """🛡️ SL y TP a la vez como tareas del loop; mismas estadísticas que ProtectiveStage.run()"""
+        return await core.protective_stage.run_async(set_position_stop_loss, set_position_take_profit,
+                                                     sl_price, tp_price, fill_time, trace)
+
+    async def blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def stage(self, market, ticket, claim=False):
+        return core.preemption.async_stage(market, ticket, claim=claim)
+
+
+io = AsyncTransport()
+
+
+def execute_journaled(loop):
+    """Handler de AlertQueue: sus hilos ejecutan cada alerta del journal como tarea del loop"""
+    def execute(data, received_at, trace=None, stages=None):
+        asyncio.run_coroutine_threadsafe(core.pipeline(core.alert_context(data, trace, stages), io), loop).result()
+    return execute
+
+
+# === RUTAS ===
+
+async def webhook(request):
+    trace = core.tracer.start()
+    with trace.span("webhook_parse"):
+        data = await request.json()
+    body, status_code = await core.handle_webhook(data, trace, io)
+    return web.json_response(body, status=status_code)
+
+
+async def status(request):
+    return web.json_response(core.status_snapshot())
+
+
+async def ready_check(request):
+    ready = core.ready.is_set() and client.session is not None
+    return web.json_response({"ready": ready, "startup_ms": core.startup_timings}, status=200 if ready else 503)
+
+
+async def traces(request):
+    return web.json_response(core.tracer.query(
+        market=request.query.get("market"),
+        alert_id=request.query.get("alert_id"),
+        limit=int(request.query.get("limit", 50)),
+    ))
+
+
+async def metrics(request):
+    return web.Response(body=core.REGISTRY.render().encode("utf-8"),
+                        headers={"Content-Type": core.METRICS_CONTENT_TYPE})
+
+
+def create_app(streams=False):
+    application = web.Application()
+    application.router.add_post("/webhook", webhook)
+    application.router.add_get("/status", status)
+    application.router.add_get("/ready", ready_check)
+    application.router.add_get("/traces", traces)
+    application.router.add_get("/metrics", metrics)
+
+    async def on_startup(application):
+        await client.start()
+        # Calentamiento y journal de alertas (las recuperadas se ejecutan en este loop)
+        core.start(handler=execute_journaled(asyncio.get_running_loop()), warmup_mode="background")
+        try:
+            # Abre la primera conexión del pool antes de la primera alerta
+            await client.get("/futures/market", {"market": ",".join(core.FUTURES_MARKETS)})
+        except Exception as e:
+            log.warning("⚠️ No se pudo calentar el pool asyncio: %s", e)
+        application["streams"] = []
+        if streams:
+            import websocket_main
+            application["streams"].append(asyncio.ensure_future(websocket_main.main()))
+
+    async def on_cleanup(application):
+        for task in application["streams"]:
+            task.cancel()
+        await client.close()
+
+    application.on_startup.append(on_startup)
+    application.on_cleanup.append(on_cleanup)
+    return application
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Webhook en modo asyncio")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--streams", action="store_true", help="Arranca también los streams de websocket_main.py")
+    args = parser.parse_args(argv)
+    web.run_app(create_app(streams=args.streams), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
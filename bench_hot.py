@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmarks de las funciones calientes, con baselines guardados.
+
+    python bench_hot.py                 # compara con bench_baseline.json
+    python bench_hot.py --update        # regenera el baseline en esta máquina
+    python bench_hot.py --threshold 0.5 # tolera hasta +50% antes de fallar
+
+Sale con código 1 si alguna función empeora más que el umbral.
+"""
+import argparse
+import atexit
+import glob
+import gzip
+import itertools
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, "bench_baseline.json")
+
+# app.py exige credenciales al importarse; la API apunta a un puerto cerrado
+# para que la carga inicial de mercados falle rápido y sin tocar CoinEx
+os.environ.setdefault("ACCESS_ID", "ACCESS_ID")
+os.environ.setdefault("SECRET_KEY", "SECRET_KEY")
+os.environ.setdefault("AZURE_FUNCTION_URL", "http://127.0.0.1:9/azure")
+os.environ.setdefault("COINEX_API_URL", "http://127.0.0.1:9/v2")
+os.environ.setdefault("COINEX_GET_ATTEMPTS", "1")
+os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+# Estado de riesgo y límites propios: no tocar los de una app que esté corriendo en esta máquina
+for _variable, _prefix in (("RISK_STATE_PATH", "bench_risk"), ("RATE_LIMIT_PATH", "bench_rate_limits"),
+                           ("RISK_JOURNAL_PATH", "bench_risk_journal")):
+    if _variable not in os.environ:
+        _path = os.environ[_variable] = os.path.join(tempfile.gettempdir(), f"{_prefix}_{os.getpid()}")
+        # El estado mmap lleva el hash de su disposición en el nombre; el journal, su .snap
+        atexit.register(lambda path=_path: [os.remove(leftover) for leftover in glob.glob(path + "*")])
+sys.path.insert(0, HERE)
+
+
+def _depth_frame(levels=50):
+    bids = [[f"{60000 - i * 0.5:.1f}", "0.1234"] for i in range(levels)]
+    asks = [[f"{60000 + i * 0.5:.1f}", "0.4321"] for i in range(levels)]
+    message = {"method": "depth.update", "data": {"market": "BTCUSDT", "is_full": True,
+               "depth": {"bids": bids, "asks": asks, "checksum": 0}}, "id": None}
+    return gzip.compress(json.dumps(message).encode("utf-8")), bids, asks
+
+
+def benchmarks():
+    """Devuelve {nombre: función sin argumentos}"""
+    import app
+
+    client = app.request_client
+    body = json.dumps({"market": "BTCUSDT", "side": "buy", "amount": "10000"})
+    signature = client.gen_sign("POST", "/v2/futures/order", body, "1700000000000")
+    raw_alert = json.dumps({"market": "BTCUSDT", "side": "buy", "amount": 1, "price": 60000.5})
+    app.risk_state.update({"start_balance": 1000.0, "last_balance": 1000.0, "consecutive_losses": 0})
+    # Balance distinto en cada llamada: daily_loss cambia y se mide también su escritura compartida
+    balances = itertools.cycle([990.0 - i * 0.01 for i in range(1000)]).__next__
+    frame, bids, asks = _depth_frame()
+
+    def check_risk_limits():
+        with app.risk_lock:  # Como en run_code: la comprobación va bajo el lock entre workers
+            return app.check_risk_limits(balances())
+
+    suite = {
+        "gen_sign": lambda: client.gen_sign("POST", "/v2/futures/order", body, "1700000000000"),
+        "get_common_headers": lambda: client.get_common_headers(signature, "1700000000000"),
+        "webhook_parse": lambda: app.parse_alert(json.loads(raw_alert)),
+        "check_risk_limits": check_risk_limits,
+        "risk_pause_check": lambda: app.risk_state["paused"],  # Lectura sin lock antes de cada alerta
+        "ws_frame_decode": lambda: json.loads(gzip.decompress(frame)),
+    }
+
+    try:
+        from websocket_depth import websocketTest
+    except ImportError:
+        print("⚠️ websocket-client no instalado: se omiten depth_merge y depth_checksum")
+        return suite
+
+    book = websocketTest()
+    book.order_bids = dict(bids)
+    book.order_asks = dict(asks)
+    update = [[bids[i][0], "0.5"] for i in range(0, 50, 5)]
+    suite["depth_merge"] = lambda: book.depth_merge(book.order_bids, update)
+    suite["depth_checksum"] = book.depth_checksum
+    return suite
+
+
+def measure(func, repeat=5, min_time=0.2):
+    """Mejor tiempo por llamada (ns) entre `repeat` rondas de al menos `min_time` s"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks de las funciones calientes")
+    parser.add_argument("--update", action="store_true", help="Guarda los resultados como baseline")
+    parser.add_argument("--threshold", type=float, default=None, help="Regresión tolerada (0.25 = +25%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--only", nargs="*", help="Nombres de benchmarks a ejecutar")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    threshold = args.threshold if args.threshold is not None else baseline.get("threshold", 0.25)
+    reference = baseline.get("results_ns", {})
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<22}{'ns/llamada':>14}{'baseline':>14}{'cambio':>10}")
+    for name, func in benchmarks().items():
+        if args.only and name not in args.only:
+            continue
+        ns = measure(func)
+        results[name] = round(ns, 1)
+        base = reference.get(name)
+        change = f"{(ns / base - 1) * 100:+.1f}%" if base else "-"
+        flag = ""
+        if base and ns > base * (1 + threshold):
+            regressions.append(name)
+            flag = "  ❌"
+        print(f"{name:<22}{ns:>14.1f}{(base or 0):>14.1f}{change:>10}{flag}")
+
+    if args.update:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"threshold": threshold, "results_ns": dict(reference, **results)}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"💾 Baseline guardado en {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"❌ Regresión de más del {threshold:.0%} en: {', '.join(regressions)}")
+        return 1
+    print("✅ Sin regresiones")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Rendimiento del journal de alertas según la ventana de group commit.
+
+    python bench_journal.py                          # journal en el directorio temporal
+    python bench_journal.py --dir /var/lib/webhook   # en el disco real de producción
+    python bench_journal.py --intervals 0,1,2,5 --alerts 5000 --concurrency 64
+
+Para cada ventana (ALERT_COMMIT_MS) mide alertas/s aceptadas, la latencia hasta
+quedar en disco (lo que espera /webhook antes de responder) y cuántas alertas
+comparte cada fsync. En tmpfs el fsync es casi gratis: usar --dir en disco.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from alert_journal import AlertJournal
+from bench_webhook import make_alert, percentile
+
+
+def run(directory, interval_ms, alerts, concurrency, fsync=True):
+    path = os.path.join(directory, f"bench_alerts_{interval_ms}ms.bin")
+    journal = AlertJournal(path, commit_interval=interval_ms / 1000.0, fsync=fsync)
+    payloads = [json.dumps(make_alert(i)).encode("utf-8") for i in range(alerts)]
+    latencies = []
+    lock = threading.Lock()
+    cursor = iter(range(alerts))
+
+    def worker():
+        local = []
+        for i in cursor:  # next() de un iterador de range es atómico con el GIL
+            started = time.perf_counter()
+            journal.accept(payloads[i], time.time())
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    journal.close()
+
+    ordered = sorted(latencies)
+    return {
+        "interval_ms": interval_ms,
+        "alerts_per_s": round(alerts / wall, 1),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "fsyncs": journal.commits,
+        "alerts_per_fsync": round(alerts / journal.commits, 1) if journal.commits else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput del journal de alertas por ventana de fsync")
+    parser.add_argument("--dir", default=None, help="Directorio del journal (por defecto uno temporal)")
+    parser.add_argument("--intervals", default="0,1,2,5,10", help="Ventanas de group commit en ms")
+    parser.add_argument("--alerts", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32, help="Peticiones /webhook simultáneas")
+    parser.add_argument("--no-fsync", action="store_true", help="Solo write(), para ver el coste del fsync")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix="bench_journal_", dir=args.dir)
+    try:
+        results = [run(directory, float(interval), args.alerts, args.concurrency, fsync=not args.no_fsync)
+                   for interval in args.intervals.split(",")]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{'ventana_ms':>10}{'alertas/s':>12}{'p50_ms':>10}{'p99_ms':>10}{'fsyncs':>8}{'alertas/fsync':>15}")
+    for r in results:
+        print(f"{r['interval_ms']:>10}{r['alerts_per_s']:>12}{r['p50_ms']:>10}{r['p99_ms']:>10}"
+              f"{r['fsyncs']:>8}{r['alerts_per_fsync']:>15}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
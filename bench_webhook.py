@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Benchmark de extremo a extremo: alertas estilo TradingView contra /webhook.
+
+Con --spawn levanta el mock de CoinEx y la app apuntando a él:
+
+    python bench_webhook.py --spawn --alerts 200 --concurrency 4 --latency-ms 25 --jitter-ms 10
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+def make_alert(i, market="BTCUSDT", price=60000.0):
+    return {"market": market, "side": "buy" if i % 2 == 0 else "sell", "amount": 1, "price": price,
+            "alert_id": f"bench-{i}"}
+
+
+def wait_ready(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def spawn_mock(args):
+    """Arranca mock_coinex.py y espera a que responda"""
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "mock_coinex.py"), "--port", str(args.mock_port), "--ws-port", "0",
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms), "--error-rate", str(args.error_rate),
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_ready(f"http://127.0.0.1:{args.mock_port}/mock/stats"):
+        mock.terminate()
+        raise SystemExit("❌ El mock de CoinEx no arrancó a tiempo")
+    return mock
+
+
+_run_dir = None
+
+
+def run_dir():
+    """Directorio temporal de esta ejecución (se borra al salir)"""
+    global _run_dir
+    if _run_dir is None:
+        _run_dir = tempfile.mkdtemp(prefix="bench_webhook_")
+        atexit.register(shutil.rmtree, _run_dir, True)
+    return _run_dir
+
+
+def mock_env(args):
+    """Variables de entorno para que la app hable con el mock
+
+    Estado de riesgo, límites de tasa, journal y spool van a un directorio propio de la
+    ejecución: las órdenes del mock no tocan los de una app que corra en esta máquina.
+    """
+    directory = run_dir()
+    env = dict(os.environ, ACCESS_ID="ACCESS_ID", SECRET_KEY="SECRET_KEY",
+               COINEX_API_URL=f"http://127.0.0.1:{args.mock_port}/v2",
+               AZURE_FUNCTION_URL=f"http://127.0.0.1:{args.mock_port}/azure",
+               LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+               RISK_STATE_PATH=os.path.join(directory, "risk_state"),
+               RATE_LIMIT_PATH=os.path.join(directory, "rate_limits"),
+               RISK_JOURNAL_PATH=os.path.join(directory, "risk_journal.bin"),
+               TELEMETRY_SPOOL=os.path.join(directory, "telemetry_spool.ndjson"))
+    if env.get("ALERT_JOURNAL_PATH"):
+        env["ALERT_JOURNAL_PATH"] = os.path.join(directory, "alerts.bin")  # Sin recuperar alertas reales
+    return env
+
+
+def spawn(args):
+    """Arranca el mock y la app; devuelve los procesos para cerrarlos al final"""
+    mock = spawn_mock(args)
+    server = subprocess.Popen([
+        sys.executable, "-c",
+        f"import app; app.app.run(host='127.0.0.1', port={args.app_port}, threaded=True)",
+    ], cwd=HERE, env=mock_env(args), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_ready(f"http://127.0.0.1:{args.app_port}/status"):
+        for process in (server, mock):
+            process.terminate()
+        raise SystemExit("❌ La app no arrancó a tiempo")
+    return [server, mock]
+
+
+def run(url, alerts, concurrency, market="BTCUSDT"):
+    """Dispara `alerts` alertas con `concurrency` clientes y devuelve el resumen"""
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def fire(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            status = session.post(f"{url}/webhook", json=make_alert(i, market), timeout=60).status_code
+        except requests.exceptions.RequestException:
+            status = "error"
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(fire, range(alerts)))
+    wall = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "alerts": alerts,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_per_s": round(alerts / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p90_ms": round(percentile(ordered, 90) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        "statuses": {str(k): v for k, v in statuses.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de latencia alerta → posición protegida")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Base de la app (sin /webhook)")
+    parser.add_argument("--alerts", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--market", default="BTCUSDT")
+    parser.add_argument("--spawn", action="store_true", help="Arranca mock_coinex.py y la app localmente")
+    parser.add_argument("--app-port", type=int, default=5055)
+    parser.add_argument("--mock-port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    processes = []
+    url = args.url
+    if args.spawn:
+        processes = spawn(args)
+        url = f"http://127.0.0.1:{args.app_port}"
+    try:
+        summary = run(url, args.alerts, args.concurrency, args.market)
+    finally:
+        for process in processes:
+            process.terminate()
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# pytest desde la raíz: los módulos son de primer nivel y env/ es un virtualenv versionado
+collect_ignore = ["env"]
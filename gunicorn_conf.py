@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Configuración de gunicorn: workers gevent con la app precargada.
+
+    gunicorn -c gunicorn_conf.py app:app
+
+Con gevent cada alerta es un greenlet: un solo worker atiende muchas alertas a la
+vez mientras esperan a CoinEx. GUNICORN_WORKER_CLASS=sync vuelve al modo clásico.
+"""
+import os
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+
+if worker_class == "gevent":
+    # Parchear antes de importar la app: locks, sleeps, colas y sockets pasan a ser
+    # cooperativos, incluidos el limitador de tasa y los pools de hilos de la app
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_connections = int(os.getenv("GEVENT_CONNECTIONS", "1000"))  # Greenlets por worker
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+
+# Precarga: imports y cachés (reglas de mercado, apalancamiento, reloj) una sola vez en
+# el master, antes del fork; los workers heredan las cachés ya llenas
+preload_app = True
+
+
+def when_ready(server):
+    # El master solo llena las cachés (importar la app no arranca nada) y queda pasivo:
+    # los hilos de fondo, la cola del journal y el pool los arranca cada worker en post_fork
+    import app
+    app.preload()
+
+
+def pre_fork(server, worker):
+    import app
+    app.before_fork()
+
+
+def post_fork(server, worker):
+    import app
+    app.after_fork()
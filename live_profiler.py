@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Perfilado bajo demanda del proceso vivo: muestreo de pilas y diff de tracemalloc.
+
+No hay nada activo entre perfiles: el muestreo corre en el hilo de la petición
+que lo pide y tracemalloc solo se enciende durante la ventana solicitada.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+MAX_SECONDS = 60.0
+
+# Hojas que solo indican un hilo esperando (listener de logs, pools, telemetría, servidor)
+_IDLE_LEAVES = ("threading.py", "queue.py", "selectors.py", "socketserver.py", "handlers.py", "thread.py")
+
+
+class ProfilerBusy(RuntimeError):
+    """Ya hay un perfil en curso en este proceso"""
+
+
+class Profiler(object):
+    """Un perfil a la vez; cada uno dura como mucho MAX_SECONDS"""
+
+    def __init__(self, max_seconds=MAX_SECONDS):
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+
+    def _bounded(self, seconds):
+        return max(0.1, min(float(seconds), self.max_seconds))
+
+    def sample_stacks(self, seconds=5.0, interval_ms=5.0, include_idle=False):
+        """Muestrea las pilas de todos los hilos y devuelve {pila_colapsada: muestras}"""
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusy("Ya hay un perfil en curso")
+        try:
+            own = threading.get_ident()
+            interval = max(0.001, interval_ms / 1000.0)
+            deadline = time.monotonic() + self._bounded(seconds)
+            stacks = {}
+            samples = 0
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    if not include_idle and os.path.basename(frame.f_code.co_filename) in _IDLE_LEAVES:
+                        continue
+                    key = _collapse(names.get(ident, str(ident)), frame)
+                    stacks[key] = stacks.get(key, 0) + 1
+                samples += 1
+                time.sleep(interval)
+            return stacks, samples
+        finally:
+            self.lock.release()
+
+    def allocation_diff(self, seconds=5.0, top=25, frames=1):
+        """Diff de dos snapshots de tracemalloc separados `seconds`; top líneas por crecimiento"""
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusy("Ya hay un perfil en curso")
+        started_here = not tracemalloc.is_tracing()
+        try:
+            if started_here:
+                tracemalloc.start(max(1, frames))
+            before = tracemalloc.take_snapshot()
+            time.sleep(self._bounded(seconds))
+            after = tracemalloc.take_snapshot()
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+            current, peak = tracemalloc.get_traced_memory()
+            return {
+                "traced_current_bytes": current,
+                "traced_peak_bytes": peak,
+                "top": [
+                    {
+                        "location": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                        "size_diff_bytes": s.size_diff,
+                        "size_bytes": s.size,
+                        "count_diff": s.count_diff,
+                        "count": s.count,
+                    }
+                    for s in stats[:top]
+                ],
+            }
+        finally:
+            if started_here:
+                tracemalloc.stop()
+            self.lock.release()
+
+
+def _collapse(thread_name, frame):
+    """`hilo;archivo:función;...` de la raíz a la hoja (formato de flamegraph.pl)"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    parts.append(thread_name.replace(";", "_").replace(" ", "_"))
+    parts.reverse()
+    return ";".join(parts)
+
+
+def render_collapsed(stacks):
+    """Una línea `pila muestras` por pila, de mayor a menor"""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda s: -s[1]))
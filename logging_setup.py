@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Logging asíncrono y estructurado: QueueHandler en el camino de ejecución, E/S en otro hilo."""
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+
+def kv(sampled=False, **fields):
+    """Campos clave-valor para `extra=`; se formatean en el hilo del listener"""
+    return {"kv": fields, "sampled": sampled}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """`fecha nivel logger mensaje clave=valor ...`"""
+
+    def __init__(self):
+        super(KeyValueFormatter, self).__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record):
+        line = super(KeyValueFormatter, self).format(record)
+        fields = getattr(record, "kv", None)
+        if fields:
+            line += " " + " ".join(f"{key}={_value(value)}" for key, value in fields.items())
+        return line
+
+
+def _value(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return json.dumps(value, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar 1 de cada N registros marcados como `sampled` (volcados de payload)"""
+
+    def __init__(self, every):
+        super(SamplingFilter, self).__init__()
+        self.every = max(1, every)
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        return next(self.counter) % self.every == 0
+
+
+class LazyQueueHandler(QueueHandler):
+    """Formatea poco en el hilo que registra: fecha, nivel y campos kv se serializan en el listener
+
+    Lo que puede cambiar antes de que el listener lo lea (args y campos kv mutables,
+    como el dict de la alerta) se fija aquí: `msg % args` y una copia superficial.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        fields = getattr(record, "kv", None)
+        if fields:
+            record.kv = {key: value.copy() if isinstance(value, (dict, list)) else value
+                         for key, value in fields.items()}
+        return record
+
+
+def parse_levels(spec):
+    """'coinex.order=DEBUG,risk=WARNING' → {'coinex.order': 10, 'risk': 30}"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+_listener = None
+
+
+def setup_logging(level=None, stage_levels=None, payload_sample_every=None, stream=None):
+    """🔧 Instala el par QueueHandler/QueueListener sobre el logger raíz (idempotente)"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    stage_levels = stage_levels if stage_levels is not None else parse_levels(os.getenv("LOG_LEVELS", ""))
+    if payload_sample_every is None:
+        payload_sample_every = int(os.getenv("LOG_PAYLOAD_SAMPLE", "10"))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(KeyValueFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = LazyQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(payload_sample_every))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, stage_level in stage_levels.items():
+        logging.getLogger(name).setLevel(stage_level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Vacía y para el listener; el logger raíz pasa a escribir directamente, sin hilo
+
+    Para el master de gunicorn antes de cada fork: ningún hilo del listener llega al
+    hijo (con gevent sería un greenlet heredado) y el master, pasivo, apenas registra.
+    """
+    global _listener
+    old, _listener = _listener, None
+    if old is None:
+        return
+    old.stop()
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    for handler in old.handlers:
+        handler.flush()
+        root.addHandler(handler)
+
+
+atexit.register(stop_logging)  # Al salir vacía el listener vigente (los anteriores ya se pararon)
+
+
+def restart_logging():
+    """Vacía el listener actual y monta uno nuevo
+
+    Antes de un fork evita que el hijo herede registros sin escribir; después del
+    fork recrea el hilo del listener, que no sobrevive en el hijo.
+    """
+    global _listener
+    old, _listener = _listener, None
+    if old is not None:
+        old.stop()
+        for handler in old.handlers:
+            handler.flush()
+    return setup_logging()
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""Caché de metadatos de mercados de futuros (precisión, mínimo y tick)."""
+import logging
+import threading
+import time
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+
+log = logging.getLogger("market_cache")
+
+
+class MarketRules(object):
+    """Reglas de cuantización de un mercado, precalculadas para usarlas en O(1)"""
+
+    __slots__ = ("market", "amount_step", "price_step", "tick_size", "min_amount")
+
+    def __init__(self, market, amount_precision=6, price_precision=2, tick_size=None, min_amount="0"):
+        self.market = market
+        self.amount_step = Decimal(1).scaleb(-int(amount_precision))
+        self.price_step = Decimal(1).scaleb(-int(price_precision))
+        self.tick_size = Decimal(str(tick_size)) if tick_size else self.price_step
+        self.min_amount = Decimal(str(min_amount or "0"))
+
+    @classmethod
+    def from_coinex(cls, entry):
+        """Construye las reglas a partir de un elemento de /futures/market"""
+        return cls(
+            entry["market"],
+            amount_precision=entry.get("base_ccy_precision", 6),
+            price_precision=entry.get("quote_ccy_precision", 2),
+            tick_size=entry.get("tick_size"),
+            min_amount=entry.get("min_amount", "0"),
+        )
+
+    def quantize_amount(self, amount):
+        # Siempre hacia abajo para no exceder el balance disponible
+        return float(Decimal(str(amount)).quantize(self.amount_step, rounding=ROUND_DOWN))
+
+    def quantize_price(self, price):
+        ticks = (Decimal(str(price)) / self.tick_size).quantize(Decimal(1), rounding=ROUND_HALF_UP)
+        return float((ticks * self.tick_size).quantize(self.price_step, rounding=ROUND_HALF_UP))
+
+    def meets_minimum(self, amount):
+        return Decimal(str(amount)) >= self.min_amount
+
+
+class MarketMetadataCache(object):
+    """Mantiene las reglas de los mercados configurados y las refresca en segundo plano"""
+
+    def __init__(self, fetch, markets, refresh_interval=3600.0):
+        self.fetch = fetch  # fetch(markets) → respuesta de CoinEx /futures/market
+        self.markets = list(markets)
+        self.refresh_interval = refresh_interval
+        self.rules = {}
+        self.loaded_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """🔄 Descarga las reglas de todos los mercados configurados en una sola llamada"""
+        try:
+            response_data = self.fetch(self.markets).json()
+        except Exception as e:
+            log.error("❌ No se pudieron cargar los mercados %s: %s", self.markets, e)
+            return False
+
+        if response_data.get("code") != 0 or not isinstance(response_data.get("data"), list):
+            log.error("❌ Respuesta inesperada de /futures/market: %s", response_data.get('message'))
+            return False
+
+        rules = dict(self.rules)
+        for entry in response_data["data"]:
+            rules[entry["market"]] = MarketRules.from_coinex(entry)
+        self.rules = rules  # Sustitución atómica: los lectores nunca ven un dict a medias
+        self.loaded_at = time.time()
+        log.info("✅ Reglas de mercado cargadas: %s", sorted(rules))
+        return True
+
+    def get(self, market):
+        rules = self.rules.get(market)
+        if rules is None:
+            # Sin metadatos: mismos redondeos que antes (6 decimales de cantidad, 2 de precio)
+            rules = MarketRules(market)
+        return rules
+
+    def quantize_amount(self, market, amount):
+        return self.get(market).quantize_amount(amount)
+
+    def quantize_price(self, market, price):
+        return self.get(market).quantize_price(price)
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.load()
+
+    def start(self):
+        """Carga inicial y arranque del hilo de refresco"""
+        self.load()
+        if self._thread is None or not self._thread.is_alive():  # También tras un fork
+            self._thread = threading.Thread(target=self._refresh_loop, name="market-cache", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+class LeverageStateCache(object):
+    """Último apalancamiento y modo de margen conocidos por mercado"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = {}  # market → (margin_mode, leverage)
+        self.skipped = 0
+        self.sent = 0
+
+    def update(self, market, margin_mode, leverage):
+        with self.lock:
+            self.state[market] = (margin_mode, int(leverage))
+
+    def update_from_positions(self, positions):
+        """🔄 Actualiza el estado a partir de /futures/pending-position"""
+        for position in positions:
+            if position.get("market") and position.get("leverage") is not None:
+                self.update(position["market"], position.get("margin_mode"), position["leverage"])
+
+    def invalidate(self, market):
+        with self.lock:
+            self.state.pop(market, None)
+
+    def needs_adjust(self, market, margin_mode, leverage):
+        """✅ True si el ajuste debe enviarse; cuenta los ajustes evitados"""
+        with self.lock:
+            if self.state.get(market) == (margin_mode, int(leverage)):
+                self.skipped += 1
+                return False
+            return True
+
+    def adjusted(self, market, margin_mode, leverage, ok):
+        """Resultado de un ajuste enviado: el estado solo se da por bueno si CoinEx lo aceptó"""
+        with self.lock:
+            if ok:
+                self.state[market] = (margin_mode, int(leverage))
+                self.sent += 1
+            else:
+                self.state.pop(market, None)  # Estado incierto: el siguiente ajuste se envía
+
+    def stats(self):
+        return {"skipped": self.skipped, "sent": self.sent, "known_markets": len(self.state)}
+
+
+class PositionCache(object):
+    """Posición neta conocida por mercado: > 0 long, < 0 short, 0 sin posición
+
+    Se confirma con cada lectura de /futures/pending-position y con las respuestas
+    de nuestras órdenes y cierres. Un SL/TP que se dispara en CoinEx no se ve hasta
+    la siguiente lectura, por eso `get()` solo devuelve valores de menos de `max_age` s.
+    """
+
+    def __init__(self, max_age=0.0):
+        self.lock = threading.Lock()
+        self.max_age = max_age
+        self.positions = {}  # market → (cantidad con signo, time.monotonic() de la confirmación)
+        self.hits = 0
+        self.misses = 0
+
+    def update_from_positions(self, positions, markets=()):
+        """🔄 Foto completa de /futures/pending-position; devuelve {market: cantidad con signo}
+
+        Los mercados que no aparecen (los ya conocidos y `markets`) quedan sin posición.
+        """
+        now = time.monotonic()
+        snapshot = dict.fromkeys(markets, 0.0)
+        for position in positions:
+            if position.get("market"):
+                amount = float(position.get("open_interest") or 0)
+                snapshot[position["market"]] = amount if position.get("side") == "long" else -amount
+        with self.lock:
+            for market in self.positions:
+                snapshot.setdefault(market, 0.0)
+            self.positions.update((market, (amount, now)) for market, amount in snapshot.items())
+        return snapshot
+
+    def take(self, market):
+        """Retira la posición del mercado antes de una orden o cierre y la devuelve
+
+        Si la llamada falla o su respuesta no es clara, el mercado queda desconocido
+        y el siguiente flip vuelve a leerlo de CoinEx.
+        """
+        with self.lock:
+            entry = self.positions.pop(market, None)
+        return entry[0] if entry is not None else None
+
+    def record_fill(self, market, before, side, response):
+        """Posición resultante de una orden a mercado propia (respuesta de /futures/order)"""
+        if before is None or response.status_code != 200:
+            return
+        try:
+            response_data = response.json()
+        except ValueError:
+            return
+        data = response_data.get("data")
+        if isinstance(data, list):
+            data = data[0] if data else None
+        if response_data.get("code") != 0 or not isinstance(data, dict):
+            return
+        filled = float(data.get("filled_amount") or data.get("amount") or 0)
+        with self.lock:
+            self.positions[market] = (before + (filled if side == "buy" else -filled), time.monotonic())
+
+    def record_close(self, market, response):
+        """Sin posición tras un cierre confirmado (respuesta de /futures/close-position)"""
+        try:
+            closed = response.status_code == 200 and response.json().get("code") == 0
+        except ValueError:
+            closed = False
+        if closed:
+            with self.lock:
+                self.positions[market] = (0.0, time.monotonic())
+
+    def get(self, market):
+        """Cantidad con signo si se confirmó hace menos de `max_age`; None si hay que leerla"""
+        with self.lock:
+            entry = self.positions.get(market)
+        if entry is None or time.monotonic() - entry[1] > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def stats(self):
+        with self.lock:
+            positions = {market: amount for market, (amount, _) in self.positions.items()}
+        return {"hits": self.hits, "misses": self.misses, "positions": positions}
+
+
+def flip_fill(filled_amount, order_amount, alert_amount):
+    """🔁 (cerrado, abierto) de una orden de flip según lo que CoinEx ejecutó de verdad
+
+    La orden primero reduce la posición anterior (`order_amount - alert_amount`) y solo
+    lo que sobra abre la nueva: con un fill parcial la nueva es menor, o no existe.
+    """
+    closed = min(filled_amount, order_amount - alert_amount)
+    return closed, filled_amount - closed
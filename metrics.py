@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Métricas en formato de texto de Prometheus, baratas de registrar en el camino caliente.
+
+Los contadores e histogramas no usan locks: bajo el GIL una actualización
+cuesta unos pocos cientos de ns y, como mucho, se pierde algún incremento
+concurrente, algo aceptable para métricas.
+"""
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def log_buckets(start=50e-6, factor=2.0, count=21):
+    """Límites geométricos: 50µs, 100µs, 200µs ... ~52s"""
+    return tuple(start * factor ** i for i in range(count))
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def labels(self, *values):
+        """Hijo para esos valores de etiqueta; conviene guardarlo si las etiquetas son fijas"""
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _CounterChild(object):
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.children[()].value += amount
+
+    def render(self):
+        lines = self.header()
+        for values, child in list(self.children.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}")
+        return lines
+
+
+class _HistogramChild(object):
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # El último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Histograma con buckets logarítmicos (error relativo acotado, tipo HDR)"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=None):
+        self.bounds = tuple(buckets or log_buckets())
+        super(Histogram, self).__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def render(self):
+        lines = self.header()
+        for values, child in list(self.children.items()):
+            cumulative = 0
+            counts = list(child.counts)
+            for bound, bucket in zip(self.bounds, counts):
+                cumulative += bucket
+                le = ("le", f"{bound:.6g}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_number(child.sum)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Valor calculado al hacer scrape (coste cero en el camino caliente)
+
+    `callback()` devuelve un número, o un dict {tupla de etiquetas: número}.
+    """
+
+    def __init__(self, name, help_text, callback, labelnames=(), kind="gauge"):
+        self.callback = callback
+        self.kind = kind
+        super(CallbackMetric, self).__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def render(self):
+        lines = self.header()
+        value = self.callback()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for values, number in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(number)}")
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=None):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def callback(self, name, help_text, callback, labelnames=(), kind="gauge"):
+        return self.register(CallbackMetric(name, help_text, callback, labelnames, kind))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Registro del proceso (compartido por app.py y los clientes websocket)
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def serve(port, host="0.0.0.0", registry=REGISTRY):
+    """📈 GET /metrics en un hilo propio, para procesos sin Flask ni aiohttp (clientes websocket)"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Sin una línea por cada scrape
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""Servidor local que imita CoinEx v2 (REST de futuros + websocket /v2/futures).
+
+Verifica las firmas igual que CoinEx e inyecta latencia, jitter y errores
+configurables. Sirve también /azure para recibir la telemetría.
+
+    python mock_coinex.py --port 8081 --ws-port 8082 --latency-ms 30 --jitter-ms 10 --error-rate 0.01
+    COINEX_API_URL=http://127.0.0.1:8081/v2 AZURE_FUNCTION_URL=http://127.0.0.1:8081/azure python app.py
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import zlib
+
+from flask import Flask, request, jsonify
+
+
+class MockConfig(object):
+    def __init__(self, access_id="ACCESS_ID", secret_key="SECRET_KEY", latency_ms=0.0,
+                 jitter_ms=0.0, error_rate=0.0, error_code=4001):
+        self.access_id = access_id
+        self.secret_key = secret_key
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_code = error_code  # Código CoinEx de los errores inyectados
+
+
+class MockExchange(object):
+    """Estado simulado: un balance en USDT y una posición por mercado"""
+
+    def __init__(self, balance=1000.0, price=60000.0):
+        self.lock = threading.Lock()
+        self.balance = balance
+        self.price = price
+        self.positions = {}  # market → {"side", "amount", "avg_entry_price", "leverage", "margin_mode"}
+        self.leverage = {}   # market → (margin_mode, leverage)
+        self.order_id = 0
+        self.requests = 0
+        self.telemetry = 0
+
+    def tick(self):
+        # Paseo aleatorio del precio en cada orden
+        self.price *= 1 + random.uniform(-0.0005, 0.0005)
+        return round(self.price, 1)
+
+    def market(self, name):
+        return {
+            "market": name, "base_ccy": name[:-4], "quote_ccy": "USDT",
+            "base_ccy_precision": 4, "quote_ccy_precision": 1, "tick_size": "0.1",
+            "min_amount": "0.0001", "leverage": ["1", "2", "3", "5", "8", "10", "15", "20"],
+            "is_market_available": True,
+        }
+
+    def position(self, market):
+        position = self.positions.get(market)
+        if not position:
+            return None
+        margin_mode, leverage = self.leverage.get(market, ("isolated", 5))
+        return {
+            "market": market, "market_type": "FUTURES", "side": position["side"],
+            "margin_mode": margin_mode, "leverage": str(leverage),
+            "open_interest": str(position["amount"]), "close_avbl": str(position["amount"]),
+            "avg_entry_price": str(position["avg_entry_price"]),
+            "take_profit_price": position.get("tp", "0"), "stop_loss_price": position.get("sl", "0"),
+        }
+
+    def order(self, market, side, amount):
+        with self.lock:
+            self.order_id += 1
+            price = self.tick()
+            amount = float(amount)
+            position = self.positions.get(market)
+            if position and position["side"] != ("long" if side == "buy" else "short"):
+                # Orden contraria: reduce y, si sobra, abre en sentido opuesto
+                remaining = amount - position["amount"]
+                if remaining > 1e-12:
+                    self.positions[market] = {"side": "long" if side == "buy" else "short",
+                                              "amount": remaining, "avg_entry_price": price}
+                elif remaining < -1e-12:
+                    position["amount"] = -remaining
+                else:
+                    self.positions.pop(market, None)
+            elif position:
+                position["amount"] += amount
+            else:
+                self.positions[market] = {"side": "long" if side == "buy" else "short",
+                                          "amount": amount, "avg_entry_price": price}
+            return {
+                "order_id": self.order_id, "market": market, "market_type": "FUTURES", "side": side,
+                "type": "market", "amount": str(amount), "filled_amount": str(amount),
+                "last_filled_price": str(price), "filled_value": str(round(amount * price, 8)),
+                "created_at": int(time.time() * 1000),
+            }
+
+
+def create_app(config, exchange):
+    mock = Flask("mock_coinex")
+
+    def ok(data):
+        return jsonify({"code": 0, "data": data, "message": "OK"})
+
+    @mock.before_request
+    def check_and_delay():
+        if request.path.startswith(("/azure", "/mock/")):
+            return None
+        exchange.requests += 1
+
+        # Latencia + jitter configurables
+        delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+        # Verificación de la firma igual que CoinEx
+        timestamp = request.headers.get("X-COINEX-TIMESTAMP", "")
+        request_path = request.path
+        if request.query_string:
+            request_path += "?" + request.query_string.decode()
+        body = request.get_data(as_text=True) if request.method != "GET" else ""
+        prepared = f"{request.method}{request_path}{body}{timestamp}"
+        expected = hmac.new(bytes(config.secret_key, "latin-1"), msg=bytes(prepared, "latin-1"),
+                            digestmod=hashlib.sha256).hexdigest().lower()
+        if request.headers.get("X-COINEX-KEY") != config.access_id or \
+                not hmac.compare_digest(request.headers.get("X-COINEX-SIGN", ""), expected):
+            return jsonify({"code": 25, "data": {}, "message": "invalid signature"}), 200
+
+        # Errores inyectados: mitad HTTP 503, mitad código de CoinEx transitorio
+        if config.error_rate and random.random() < config.error_rate:
+            if random.random() < 0.5:
+                return "Service Unavailable", 503
+            return jsonify({"code": config.error_code, "data": {}, "message": "injected error"}), 200
+        return None
+
+    @mock.route("/v2/time", methods=["GET"])
+    def server_time():
+        return ok({"timestamp": int(time.time() * 1000)})
+
+    @mock.route("/v2/futures/market", methods=["GET"])
+    def futures_market():
+        markets = request.args.get("market", "BTCUSDT").split(",")
+        return ok([exchange.market(m) for m in markets])
+
+    @mock.route("/v2/futures/pending-position", methods=["GET"])
+    def pending_position():
+        market = request.args.get("market")
+        with exchange.lock:
+            markets = [market] if market else list(exchange.positions)
+            return ok([p for p in (exchange.position(m) for m in markets) if p])
+
+    @mock.route("/v2/assets/futures/balance", methods=["GET"])
+    def futures_balance():
+        return ok([{"ccy": "USDT", "available": str(exchange.balance), "frozen": "0", "margin": "0",
+                    "unrealized_pnl": "0", "transferrable": str(exchange.balance)}])
+
+    @mock.route("/v2/futures/order", methods=["POST"])
+    def futures_order():
+        data = request.get_json(force=True)
+        return ok(exchange.order(data["market"], data["side"], data["amount"]))
+
+    @mock.route("/v2/futures/close-position", methods=["POST"])
+    def close_position():
+        data = request.get_json(force=True)
+        with exchange.lock:
+            exchange.positions.pop(data["market"], None)
+        return ok({})
+
+    @mock.route("/v2/futures/cancel-all-order", methods=["POST"])
+    def cancel_all_order():
+        return ok({})
+
+    @mock.route("/v2/futures/adjust-position-leverage", methods=["POST"])
+    def adjust_leverage():
+        data = request.get_json(force=True)
+        with exchange.lock:
+            exchange.leverage[data["market"]] = (data["margin_mode"], int(data["leverage"]))
+        return ok({"margin_mode": data["margin_mode"], "leverage": int(data["leverage"])})
+
+    @mock.route("/v2/futures/set-position-stop-loss", methods=["POST"])
+    def set_stop_loss():
+        data = request.get_json(force=True)
+        with exchange.lock:
+            if data["market"] in exchange.positions:
+                exchange.positions[data["market"]]["sl"] = str(data["stop_loss_price"])
+        return ok({})
+
+    @mock.route("/v2/futures/set-position-take-profit", methods=["POST"])
+    def set_take_profit():
+        data = request.get_json(force=True)
+        with exchange.lock:
+            if data["market"] in exchange.positions:
+                exchange.positions[data["market"]]["tp"] = str(data["take_profit_price"])
+        return ok({})
+
+    @mock.route("/azure", methods=["POST"])
+    def azure():
+        body = request.get_data()
+        if request.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        exchange.telemetry += len([line for line in body.splitlines() if line.strip()])
+        return "", 204
+
+    @mock.route("/mock/stats", methods=["GET"])
+    def stats():
+        with exchange.lock:
+            return jsonify({"requests": exchange.requests, "orders": exchange.order_id,
+                            "telemetry_events": exchange.telemetry,
+                            "positions": {m: exchange.position(m) for m in exchange.positions}})
+
+    return mock
+
+
+# === WEBSOCKET /v2/futures ===
+
+def _depth_checksum(bids, asks):
+    # Mismo algoritmo que websocketTest.depth_checksum
+    parts = [f"{p}:{a}" for p, a in sorted(bids.items(), reverse=True)]
+    parts += [f"{p}:{a}" for p, a in sorted(asks.items())]
+    return zlib.crc32(":".join(parts).encode("utf-8"))
+
+
+def _depth(exchange, levels):
+    mid = exchange.price
+    bids = {f"{mid - i * 0.5:.1f}": f"{random.uniform(0.01, 2):.4f}" for i in range(1, levels + 1)}
+    asks = {f"{mid + i * 0.5:.1f}": f"{random.uniform(0.01, 2):.4f}" for i in range(1, levels + 1)}
+    return bids, asks
+
+
+async def _ws_handler(conn, config, exchange, interval):
+    def frame(payload):
+        return gzip.compress(json.dumps(payload).encode("utf-8"))
+
+    subscriptions = []
+    async def push_depth():
+        while True:
+            await asyncio.sleep(interval)
+            for market, levels in subscriptions:
+                bids, asks = _depth(exchange, levels)
+                await conn.send(frame({"method": "depth.update", "data": {
+                    "market": market, "is_full": True,
+                    "depth": {"bids": [list(b) for b in bids.items()], "asks": [list(a) for a in asks.items()],
+                              "checksum": _depth_checksum(bids, asks), "last": str(round(exchange.price, 1)),
+                              "updated_at": int(time.time() * 1000)}}, "id": None}))
+
+    pusher = asyncio.ensure_future(push_depth())
+    try:
+        async for raw in conn:
+            message = json.loads(raw)
+            method, params = message.get("method"), message.get("params", {})
+            if method == "server.sign":
+                expected = hmac.new(bytes(config.secret_key, "latin-1"), msg=bytes(str(params.get("timestamp")), "latin-1"),
+                                    digestmod=hashlib.sha256).hexdigest().lower()
+                valid = params.get("access_id") == config.access_id and params.get("signed_str") == expected
+                await conn.send(frame({"code": 0 if valid else 21002, "data": {}, "id": message.get("id"),
+                                       "message": "OK" if valid else "invalid signature"}))
+            elif method == "depth.subscribe":
+                for market, limit, _interval, _full in params.get("market_list", []):
+                    subscriptions.append((market, int(limit)))
+                await conn.send(frame({"code": 0, "data": {}, "id": message.get("id"), "message": "OK"}))
+            elif method == "balance.subscribe":
+                await conn.send(frame({"code": 0, "data": {}, "id": message.get("id"), "message": "OK"}))
+                await conn.send(frame({"method": "balance.update", "data": {"balance_list": [
+                    {"ccy": "USDT", "available": str(exchange.balance), "frozen": "0", "margin": "0"}]}, "id": None}))
+            elif method == "server.ping":
+                await conn.send(frame({"code": 0, "data": {"result": "pong"}, "id": message.get("id"), "message": "OK"}))
+            else:
+                await conn.send(frame({"code": 20001, "data": {}, "id": message.get("id"), "message": "unknown method"}))
+    finally:
+        pusher.cancel()
+
+
+def run_websocket(config, exchange, host, port, interval=0.5):
+    """Websocket /v2/futures en un hilo propio con su event loop"""
+    import websockets
+
+    async def handler(conn, path=None):
+        path = path or getattr(conn, "path", None) or conn.request.path
+        if path != "/v2/futures":
+            await conn.close(code=1008, reason="unknown path")
+            return
+        await _ws_handler(conn, config, exchange, interval)
+
+    async def serve():
+        async with websockets.serve(handler, host, port, compression=None):
+            await asyncio.Future()
+
+    thread = threading.Thread(target=lambda: asyncio.run(serve()), name="mock-ws", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor local que imita CoinEx v2")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--ws-port", type=int, default=8082, help="0 desactiva el websocket")
+    parser.add_argument("--access-id", default="ACCESS_ID")
+    parser.add_argument("--secret-key", default="SECRET_KEY")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--balance", type=float, default=1000.0)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(args.access_id, args.secret_key, args.latency_ms, args.jitter_ms, args.error_rate)
+    exchange = MockExchange(balance=args.balance)
+    if args.ws_port:
+        run_websocket(config, exchange, args.host, args.ws_port)
+    print(f"🧪 CoinEx mock en http://{args.host}:{args.port}/v2 (ws://{args.host}:{args.ws_port}/v2/futures)")
+    create_app(config, exchange).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
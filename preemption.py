@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Ejecuciones expropiables: una alerta más nueva de un mercado corta la anterior en curso.
+
+Cada ejecución toma un turno de llegada por mercado. Antes de su primera llamada
+que modifica algo en CoinEx (cerrar posición) la ejecución reclama el mercado; a
+partir de ahí, toda ejecución con un turno anterior se detiene en su siguiente
+punto de control con `Preempted`, sin enviar nada más.
+
+El reclamo se anota antes de esperar al lock de etapa del mercado, con el que se
+hacen las llamadas de cada etapa: la anterior ya no empieza otra etapa, y la nueva
+espera a que termine la llamada en vuelo antes de cerrar, así su cierre y
+cancelación recogen lo que la anterior ya hubiera enviado.
+Los turnos son por proceso (con varios workers de gunicorn, dentro de cada uno).
+"""
+import asyncio
+import itertools
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+
+class Preempted(Exception):
+    """La ejecución fue sustituida por una alerta más nueva del mismo mercado"""
+
+    def __init__(self, market, ticket, current):
+        super().__init__(f"Ejecución {ticket} de {market} sustituida por la {current}")
+        self.market = market
+        self.ticket = ticket
+        self.current = current
+
+
+class _MarketSlot(object):
+    __slots__ = ("claimed", "lock", "async_lock")
+
+    def __init__(self):
+        self.claimed = 0  # Turno de la ejecución vigente
+        self.lock = threading.Lock()  # Con gevent parcheado es un lock de greenlets
+        self.async_lock = None  # asyncio.Lock, creado dentro del loop del servidor asyncio
+
+
+class MarketPreemption(object):
+    """Turnos de llegada y ejecución vigente por mercado"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.tickets = itertools.count(1)
+        self.preempted = 0
+
+    def _slot(self, market):
+        slot = self.slots.get(market)
+        if slot is None:
+            with self.lock:
+                slot = self.slots.setdefault(market, _MarketSlot())
+        return slot
+
+    def arrive(self, market):
+        """Turno de una ejecución que empieza (crece con el orden de llegada)"""
+        self._slot(market)
+        return next(self.tickets)
+
+    def checkpoint(self, market, ticket):
+        """⛳ Punto de control: Preempted si ya hay una ejecución más nueva del mercado"""
+        current = self._slot(market).claimed
+        if current > ticket:
+            self.preempted += 1
+            raise Preempted(market, ticket, current)
+
+    def claim(self, market, ticket):
+        """Hace vigente a esta ejecución (Preempted si ya lo es una más nueva)"""
+        slot = self._slot(market)
+        with self.lock:
+            self.checkpoint(market, ticket)
+            slot.claimed = ticket
+
+    @contextmanager
+    def stage(self, market, ticket, claim=False):
+        """Etapa con llamadas a CoinEx; `claim=True` hace vigente a esta ejecución"""
+        if claim:
+            self.claim(market, ticket)
+        with self._slot(market).lock:
+            self.checkpoint(market, ticket)
+            yield
+
+    @asynccontextmanager
+    async def async_stage(self, market, ticket, claim=False):
+        """`stage()` para el servidor asyncio (espera con un asyncio.Lock)"""
+        if claim:
+            self.claim(market, ticket)
+        slot = self._slot(market)
+        if slot.async_lock is None:
+            slot.async_lock = asyncio.Lock()
+        async with slot.async_lock:
+            self.checkpoint(market, ticket)
+            yield
+
+    def stats(self):
+        return {"preempted": self.preempted, "current": {market: slot.claimed for market, slot in self.slots.items()}}
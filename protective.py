@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Etapa de protección posterior al fill: SL y TP en paralelo."""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from resilience import RetryPolicy
+
+log = logging.getLogger("protective")
+
+
+class ProtectiveStage(object):
+    """Envía stop loss y take profit a la vez, cada uno con sus propios reintentos
+
+    Mide el tiempo desde el fill hasta que la posición queda protegida por
+    ambas órdenes (`fill_to_protected`).
+    """
+
+    def __init__(self, set_stop_loss, set_take_profit, max_attempts=3, samples=500, latency_histogram=None,
+                 max_workers=2):
+        self.set_stop_loss = set_stop_loss
+        self.set_take_profit = set_take_profit
+        # Solo el TP pasa por el pool (el SL va en el hilo de la alerta): un hilo por alerta en curso
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="protective")
+        self.retry_policies = {"sl": RetryPolicy(max_attempts=max_attempts),
+                               "tp": RetryPolicy(max_attempts=max_attempts)}
+        self.fill_to_protected = deque(maxlen=samples)  # Segundos
+        self.latency_histogram = latency_histogram
+        self.lock = threading.Lock()
+        self.protected = 0
+        self.unprotected = 0
+
+    def _submit(self, func, price, trace, leg):
+        start_ns = time.perf_counter_ns()
+        try:
+            return self.retry_policies[leg].call(lambda: func(price)), time.perf_counter()
+        except Exception as e:
+            log.error("🚨 %s(%s) falló tras reintentos: %s", func.__name__, price, e)
+            return None, None
+        finally:
+            if trace is not None:
+                trace.add_span(leg, start_ns, time.perf_counter_ns())
+
+    async def _submit_async(self, func, price, trace, leg):
+        start_ns = time.perf_counter_ns()
+        try:
+            return await self.retry_policies[leg].call_async(lambda: func(price)), time.perf_counter()
+        except Exception as e:
+            log.error("🚨 %s(%s) falló tras reintentos: %s", func.__name__, price, e)
+            return None, None
+        finally:
+            if trace is not None:
+                trace.add_span(leg, start_ns, time.perf_counter_ns())
+
+    async def run_async(self, set_stop_loss, set_take_profit, sl_price, tp_price, fill_time, trace=None):
+        """`run()` con SL y TP como tareas del loop (las funciones devuelven corrutinas)"""
+        (sl_response, sl_done), (tp_response, tp_done) = await asyncio.gather(
+            self._submit_async(set_stop_loss, sl_price, trace, "sl"),
+            self._submit_async(set_take_profit, tp_price, trace, "tp"),
+        )
+        self.record(sl_response, sl_done, tp_response, tp_done, fill_time)
+        return sl_response, tp_response
+
+    def run(self, sl_price, tp_price, fill_time, trace=None):
+        """🛡️ Devuelve (respuesta_sl, respuesta_tp); None en la que haya fallado"""
+        tp_future = self.executor.submit(self._submit, self.set_take_profit, tp_price, trace, "tp")
+        sl_response, sl_done = self._submit(self.set_stop_loss, sl_price, trace, "sl")
+        tp_response, tp_done = tp_future.result()
+        self.record(sl_response, sl_done, tp_response, tp_done, fill_time)
+        return sl_response, tp_response
+
+    def record(self, sl_response, sl_done, tp_response, tp_done, fill_time):
+        """Contabiliza el resultado de un par SL/TP (también lo usa el modo asyncio)"""
+        if _accepted(sl_response) and _accepted(tp_response):
+            elapsed = max(sl_done, tp_done) - fill_time
+            with self.lock:
+                self.fill_to_protected.append(elapsed)
+                self.protected += 1
+            if self.latency_histogram is not None:
+                self.latency_histogram.observe(elapsed)
+            log.info("🛡️ Posición protegida %.1f ms después del fill", elapsed * 1000)
+        else:
+            with self.lock:
+                self.unprotected += 1
+            log.error("🚨 La posición NO quedó completamente protegida (SL/TP)")
+
+    def stats(self):
+        with self.lock:
+            samples = sorted(self.fill_to_protected)
+            protected, unprotected = self.protected, self.unprotected
+        result = {"protected": protected, "unprotected": unprotected}
+        for leg, policy in self.retry_policies.items():
+            result[f"{leg}_retries"] = policy.retries
+            result[f"{leg}_exhausted"] = policy.exhausted
+        if samples:
+            result.update({
+                "fill_to_protected_p50_ms": samples[len(samples) // 2] * 1000,
+                "fill_to_protected_p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+                "fill_to_protected_max_ms": samples[-1] * 1000,
+            })
+        return result
+
+
+def _accepted(response):
+    if response is None:
+        return False
+    try:
+        return response.json().get("code") == 0
+    except ValueError:
+        return False
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""Reproduce alertas grabadas (JSONL) contra /webhook respetando su ritmo.
+
+Cada línea es una alerta de TradingView, sola o envuelta con su hora de llegada:
+
+    {"market": "BTCUSDT", "side": "buy", "amount": 1, "price": 60000}
+    {"ts": 1700000000.25, "alert": {"market": "BTCUSDT", "side": "sell", "price": 60010}}
+
+Ejemplos:
+
+    python replay_alerts.py alerts.jsonl --url http://127.0.0.1:5000 --speed 10
+    python replay_alerts.py alerts.jsonl --inproc --spawn-mock --speed 0 --concurrency 8
+    python replay_alerts.py --synthetic 200 --interval-ms 5 --spawn --concurrency 4
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from bench_webhook import HERE, make_alert, mock_env, percentile, spawn, spawn_mock
+from staleness import ALERT_TIME_FIELDS
+
+TIME_FIELDS = ("ts", "time", "timestamp", "received_at")
+
+
+def parse_time(value):
+    """Epoch en segundos o milisegundos, o ISO 8601 → segundos (float)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value / 1000.0 if value > 1e12 else float(value)
+    try:
+        return parse_time(float(value))
+    except ValueError:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+def load_alerts(path):
+    """Lee el JSONL y devuelve ([(offset_s, alerta)], líneas_descartadas)"""
+    alerts = []
+    skipped = 0
+    first = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            alert = record.get("alert", record) if isinstance(record, dict) else None
+            if not isinstance(alert, dict) or "side" not in alert:
+                skipped += 1  # No es una alerta (p. ej. otro tipo de registro)
+                continue
+            stamp = next((parse_time(record.get(k)) for k in TIME_FIELDS if record.get(k) is not None), None)
+            if stamp is None:
+                stamp = next((parse_time(alert.get(k)) for k in TIME_FIELDS if alert.get(k) is not None), None)
+            if stamp is not None and first is None:
+                first = stamp
+            offset = stamp - first if stamp is not None else None
+            alerts.append((offset, alert))
+
+    # Las alertas sin hora van justo detrás de la anterior
+    previous = 0.0
+    timed = []
+    for offset, alert in alerts:
+        previous = max(previous, offset) if offset is not None else previous
+        timed.append((previous, alert))
+    return timed, skipped
+
+
+def synthetic_alerts(count, interval_ms, market="BTCUSDT"):
+    return [(i * interval_ms / 1000.0, make_alert(i, market)) for i in range(count)]
+
+
+class HttpTarget(object):
+    """Envía las alertas por HTTP a una app ya levantada"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.local = threading.local()
+
+    def post(self, alert):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        return session.post(f"{self.url}/webhook", json=alert, timeout=60).status_code
+
+    def status(self):
+        return requests.get(f"{self.url}/status", timeout=10).json()
+
+
+class InProcessTarget(object):
+    """Entra directo al pipeline de la app en este mismo proceso, sin socket de por medio"""
+
+    def __init__(self):
+        sys.path.insert(0, HERE)
+        import app
+        self.app = app.app
+        self.local = threading.local()
+
+    def client(self):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        return client
+
+    def post(self, alert):
+        return self.client().post("/webhook", json=alert).status_code
+
+    def status(self):
+        return self.client().get("/status").get_json()
+
+
+def restamp(alert):
+    """Copia de la alerta con sus campos de hora en el instante del envío
+
+    Con la hora grabada la app descartaría la alerta por vieja (filtro de antigüedad).
+    """
+    stamped = dict(alert)
+    for field in ALERT_TIME_FIELDS:
+        if field in stamped:
+            stamped[field] = int(time.time() * 1000)
+    return stamped
+
+
+def replay(target, alerts, speed=1.0, concurrency=4, keep_time=False):
+    """Programa cada alerta en su offset / speed (speed=0: sin esperas) y mide la latencia"""
+    latencies = []
+    lags = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def fire(alert, due):
+        started = time.perf_counter()
+        try:
+            status = target.post(alert if keep_time else restamp(alert))
+        except requests.exceptions.RequestException:
+            status = "error"
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            lags.append(max(0.0, started - due))
+            statuses[status] = statuses.get(status, 0) + 1
+
+    origin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, alert in alerts:
+            due = origin + (offset / speed if speed else 0.0)
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            pool.submit(fire, alert, due)
+    wall = time.perf_counter() - origin
+
+    ordered = sorted(latencies)
+    ordered_lag = sorted(lags)
+    return {
+        "alerts": len(alerts),
+        "wall_seconds": round(wall, 3),
+        "throughput_per_s": round(len(alerts) / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p90_ms": round(percentile(ordered, 90) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+        "queue_lag_p99_ms": round(percentile(ordered_lag, 99) * 1000, 2),
+        "statuses": {str(k): v for k, v in statuses.items()},
+    }
+
+
+def duplicate_alerts(alerts):
+    """Alertas repetidas en el fichero (mismo alert_id, o mismo mercado/lado/precio sin alert_id)"""
+    seen = set()
+    duplicates = 0
+    for _, alert in alerts:
+        key = alert.get("alert_id") or (alert.get("market"), alert.get("side"), alert.get("price"))
+        if key in seen:
+            duplicates += 1
+        seen.add(key)
+    return duplicates
+
+
+def coalesce_delta(before, after):
+    """Llamadas a CoinEx evitadas por single-flight/caché durante la reproducción"""
+    sf_before = (before or {}).get("single_flight", {})
+    sf_after = (after or {}).get("single_flight", {})
+    return {key: sf_after.get(key, 0) - sf_before.get(key, 0) for key in sf_after}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reproduce alertas JSONL contra /webhook")
+    parser.add_argument("path", nargs="?", help="Fichero JSONL con alertas")
+    parser.add_argument("--synthetic", type=int, default=0, help="Genera N alertas en lugar de leer un fichero")
+    parser.add_argument("--interval-ms", type=float, default=50.0, help="Separación de las alertas sintéticas")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = ritmo grabado, 10 = 10x, 0 = sin esperas")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--keep-time", action="store_true",
+                        help="Envía la hora grabada de cada alerta (prueba el filtro de antigüedad)")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Base de la app (sin /webhook)")
+    parser.add_argument("--inproc", action="store_true", help="Importa la app y entra directo al pipeline")
+    parser.add_argument("--spawn", action="store_true", help="Arranca el mock y la app (modo HTTP)")
+    parser.add_argument("--spawn-mock", action="store_true", help="Arranca solo el mock de CoinEx")
+    parser.add_argument("--app-port", type=int, default=5055)
+    parser.add_argument("--mock-port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        alerts, skipped = synthetic_alerts(args.synthetic, args.interval_ms), 0
+    elif args.path:
+        alerts, skipped = load_alerts(args.path)
+    else:
+        parser.error("Indica un fichero JSONL o --synthetic N")
+    if not alerts:
+        raise SystemExit(f"❌ {args.path} no contiene alertas ({skipped} líneas descartadas)")
+
+    processes = []
+    spawned_mock = args.spawn or args.spawn_mock
+    try:
+        if args.inproc:
+            if spawned_mock:
+                processes.append(spawn_mock(args))
+                os.environ.update(mock_env(args))
+            target = InProcessTarget()
+        else:
+            url = args.url
+            if args.spawn:
+                processes = spawn(args)
+                url = f"http://127.0.0.1:{args.app_port}"
+            elif args.spawn_mock:
+                processes.append(spawn_mock(args))
+            target = HttpTarget(url)
+
+        before = target.status()
+        summary = replay(target, alerts, args.speed, args.concurrency, args.keep_time)
+        after = target.status()
+        summary["skipped_lines"] = skipped
+        summary["duplicates_in_file"] = duplicate_alerts(alerts)
+        summary["coalesced"] = coalesce_delta(before, after)
+        summary["final_state"] = after
+        if spawned_mock:
+            summary["exchange"] = requests.get(f"http://127.0.0.1:{args.mock_port}/mock/stats", timeout=10).json()
+    finally:
+        for process in processes:
+            process.terminate()
+
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+"""Políticas de resiliencia para las llamadas REST a CoinEx.
+
+Cada política tiene su variante para corrutinas (`*_async`), usada por el cliente
+aiohttp de async_server.py con los mismos contadores y las mismas reglas.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+
+# Códigos de CoinEx v2 que indican un fallo transitorio del lado del exchange
+RETRYABLE_COINEX_CODES = {
+    3008,  # Service busy
+    4001,  # Service unavailable
+    4002,  # Service request timed out
+    4213,  # Request too frequent (rate limit)
+}
+
+
+class CoinExHTTPError(ValueError):
+    """Respuesta HTTP distinta de 200 (hereda de ValueError por compatibilidad)"""
+
+    def __init__(self, response):
+        super(CoinExHTTPError, self).__init__(response.text)
+        self.response = response
+        self.status_code = response.status_code
+
+
+def is_retryable_error(exc):
+    """✅ Clasifica una excepción como transitoria (reintentable) o definitiva"""
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exc, CoinExHTTPError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+def is_retryable_response(response):
+    """✅ Una respuesta 200 puede traer un código de CoinEx transitorio"""
+    try:
+        code = response.json().get("code")
+    except (ValueError, AttributeError):
+        return False
+    return code in RETRYABLE_COINEX_CODES
+
+
+class RetryPolicy(object):
+    """Backoff exponencial con jitter completo para lecturas idempotentes"""
+
+    def __init__(self, max_attempts=3, base_delay=0.1, max_delay=2.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()  # La misma política la usan a la vez varias alertas
+        self.retries = 0
+        self.exhausted = 0
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(0, delay)
+
+    def _again(self, attempt, error=None, response=None):
+        """¿Se reintenta tras este intento? Lleva la cuenta de reintentos y agotados"""
+        last_try = attempt == self.max_attempts - 1
+        if error is not None:
+            if last_try or not is_retryable_error(error):
+                if last_try:
+                    with self.lock:
+                        self.exhausted += 1
+                return False
+        elif last_try or not is_retryable_response(response):
+            return False
+        with self.lock:
+            self.retries += 1
+        return True
+
+    def call(self, func):
+        """Ejecuta func() reintentando los fallos transitorios"""
+        for attempt in range(self.max_attempts):
+            try:
+                response = func()
+            except Exception as e:
+                if not self._again(attempt, error=e):
+                    raise
+            else:
+                if not self._again(attempt, response=response):
+                    return response
+            time.sleep(self.backoff(attempt))
+
+    async def call_async(self, func):
+        """`call()` para una función que devuelve una corrutina"""
+        for attempt in range(self.max_attempts):
+            try:
+                response = await func()
+            except Exception as e:
+                if not self._again(attempt, error=e):
+                    raise
+            else:
+                if not self._again(attempt, response=response):
+                    return response
+            await asyncio.sleep(self.backoff(attempt))
+
+
+class LatencyWindow(object):
+    """Ventana deslizante de latencias para estimar el p95 de un endpoint"""
+
+    def __init__(self, size=200, min_samples=20, default=0.25):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.default = default
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def p95(self):
+        if len(self.samples) < self.min_samples:
+            return self.default
+        ordered = sorted(self.samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+
+class HedgedCaller(object):
+    """Envía una segunda petición si la primera supera el p95 y se queda con la primera respuesta"""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._pid = None
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def window(self, key):
+        with self.lock:
+            if key not in self.windows:
+                self.windows[key] = LatencyWindow()
+            return self.windows[key]
+
+    def _executor(self):
+        """Pool propio de cada proceso: los hilos del padre no existen tras un fork"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedge")
+        return self.executor
+
+    def _timed(self, key, func):
+        start = time.perf_counter()
+        result = func()
+        self.window(key).add(time.perf_counter() - start)
+        return result
+
+    def call(self, key, func, before_hedge=None):
+        """Ejecuta func(); si no responde antes del p95 de `key`, lanza una copia
+
+        `before_hedge()` se llama justo antes de la copia y fuera de la medición
+        (p. ej. para esperar turno en el limitador de tasa).
+        """
+        executor = self._executor()
+        primary = executor.submit(self._timed, key, func)
+        done, _ = wait([primary], timeout=self.window(key).p95())
+        if not done and before_hedge is not None:
+            before_hedge()
+        if primary.done():
+            return primary.result()
+
+        with self.lock:
+            self.hedges_sent += 1
+        hedge = executor.submit(self._timed, key, func)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self.lock:
+                            self.hedges_won += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _timed_async(self, key, func):
+        start = time.perf_counter()
+        result = await func()
+        self.window(key).add(time.perf_counter() - start)
+        return result
+
+    async def call_async(self, key, func, before_hedge=None):
+        """`call()` para una función que devuelve una corrutina (la copia es otra tarea del loop)"""
+        primary = asyncio.ensure_future(self._timed_async(key, func))
+        done, _ = await asyncio.wait([primary], timeout=self.window(key).p95())
+        if not done and before_hedge is not None:
+            await before_hedge()
+        if primary.done():
+            return primary.result()
+
+        with self.lock:
+            self.hedges_sent += 1
+        hedge = asyncio.ensure_future(self._timed_async(key, func))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is hedge:
+                            with self.lock:
+                                self.hedges_won += 1
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _is_ok(response):
+    # Solo se cachean respuestas correctas de CoinEx (code == 0)
+    try:
+        return response.json().get("code") == 0
+    except (ValueError, AttributeError):
+        return False
+
+
+class _Call(object):
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Agrupa peticiones idénticas concurrentes en una sola llamada al exchange"""
+
+    def __init__(self, ttl=0.0):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.async_in_flight = {}  # Tareas del loop de async_server.py
+        self.cache = {}
+        self.upstream_calls = 0
+        self.collapsed = 0
+        self.cache_hits = 0
+
+    def do(self, key, func):
+        """Ejecuta func() una sola vez por `key`; los demás llamantes esperan su resultado"""
+        with self.lock:
+            cached = self._cached(key)
+            if cached is not None:
+                return cached
+            call = self.in_flight.get(key)
+            if call is not None:
+                self.collapsed += 1
+                leader = False
+            else:
+                call = self.in_flight[key] = _Call()
+                self.upstream_calls += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+                if call.error is None:
+                    self._store(key, call.result)
+            call.event.set()
+        return call.result
+
+    async def do_async(self, key, func):
+        """`do()` para una función que devuelve una corrutina; comparte caché y contadores"""
+        with self.lock:
+            cached = self._cached(key)
+            if cached is not None:
+                return cached
+            task = self.async_in_flight.get(key)
+            if task is not None:
+                self.collapsed += 1
+            else:
+                task = self.async_in_flight[key] = asyncio.ensure_future(func())
+                task.add_done_callback(lambda done: self._finish_async(key, done))
+                self.upstream_calls += 1
+        # shield: si se cancela un llamante, la petición sigue para los demás
+        return await asyncio.shield(task)
+
+    def _finish_async(self, key, task):
+        with self.lock:
+            if self.async_in_flight.get(key) is task:
+                del self.async_in_flight[key]
+            if not task.cancelled() and task.exception() is None:
+                self._store(key, task.result())
+
+    def _cached(self, key):
+        # Con self.lock tomado
+        if self.ttl > 0:
+            cached = self.cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < self.ttl:
+                self.cache_hits += 1
+                return cached[1]
+        return None
+
+    def _store(self, key, result):
+        # Con self.lock tomado
+        if self.ttl > 0 and _is_ok(result):
+            self.cache[key] = (time.monotonic(), result)
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(key, None)
+
+    def stats(self):
+        return {
+            "upstream_calls": self.upstream_calls,
+            "collapsed": self.collapsed,
+            "cache_hits": self.cache_hits,
+        }
+
+
+class CircuitOpenError(RuntimeError):
+    """El circuito del grupo de endpoints está abierto: se falla sin llamar a CoinEx"""
+
+    def __init__(self, group, reason):
+        super(CircuitOpenError, self).__init__(f"Circuito '{group}' abierto: {reason}")
+        self.group = group
+        self.reason = reason
+
+
+class CircuitBreaker(object):
+    """Circuito cerrado / abierto / semiabierto según tasa de error y latencia recientes"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, window=30.0, min_calls=5, error_rate=0.5,
+                 slow_call=2.0, slow_rate=0.8, cooldown=15.0, half_open_calls=1):
+        self.name = name
+        self.window = window            # Segundos de historial considerados
+        self.min_calls = min_calls      # Llamadas mínimas antes de evaluar
+        self.error_rate = error_rate    # Fracción de errores que abre el circuito
+        self.slow_call = slow_call      # Segundos a partir de los cuales una llamada es lenta
+        self.slow_rate = slow_rate      # Fracción de llamadas lentas que abre el circuito
+        self.cooldown = cooldown        # Segundos en abierto antes de probar
+        self.half_open_calls = half_open_calls
+        self.lock = threading.Lock()
+        self.calls = deque()            # (instante, ok, latencia)
+        self.state = self.CLOSED
+        self.reason = ""
+        self.opened_at = 0.0
+        self.probes = 0
+        self.rejected = 0
+
+    def _trim(self, now):
+        while self.calls and now - self.calls[0][0] > self.window:
+            self.calls.popleft()
+
+    def _open(self, now, reason):
+        self.state = self.OPEN
+        self.reason = reason
+        self.opened_at = now
+        self.probes = 0
+
+    def before_call(self):
+        """Lanza CircuitOpenError si no se permite la llamada"""
+        now = time.monotonic()
+        with self.lock:
+            if self.state == self.OPEN:
+                if now - self.opened_at < self.cooldown:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.reason)
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self.probes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, "probando recuperación (semiabierto)")
+                self.probes += 1
+
+    def release(self):
+        """Llamada permitida que terminó sin resultado (cancelada): libera su hueco de prueba"""
+        with self.lock:
+            if self.state == self.HALF_OPEN and self.probes > 0:
+                self.probes -= 1
+
+    def record(self, ok, latency):
+        now = time.monotonic()
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                if ok and latency < self.slow_call:
+                    self.state = self.CLOSED
+                    self.reason = ""
+                    self.calls.clear()
+                else:
+                    self._open(now, "falló la llamada de prueba")
+                return
+
+            self.calls.append((now, ok, latency))
+            self._trim(now)
+            total = len(self.calls)
+            if self.state != self.CLOSED or total < self.min_calls:
+                return
+            errors = sum(1 for _, success, _ in self.calls if not success)
+            slow = sum(1 for _, _, elapsed in self.calls if elapsed >= self.slow_call)
+            if errors / total >= self.error_rate:
+                self._open(now, f"tasa de error {errors}/{total} en {self.window:.0f}s")
+            elif slow / total >= self.slow_rate:
+                self._open(now, f"{slow}/{total} llamadas superan {self.slow_call}s")
+
+    def status(self):
+        with self.lock:
+            self._trim(time.monotonic())
+            return {
+                "state": self.state,
+                "reason": self.reason,
+                "recent_calls": len(self.calls),
+                "recent_errors": sum(1 for _, ok, _ in self.calls if not ok),
+                "rejected": self.rejected,
+            }
+
+
+class BreakerRegistry(object):
+    """Un circuito por grupo de endpoints, resuelto a partir del path de la petición"""
+
+    def __init__(self, groups, default="other", **options):
+        self.groups = groups  # {prefijo del path: grupo}
+        self.default = default
+        self.options = options
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def group_for(self, request_path):
+        for prefix, group in self.groups.items():
+            if request_path.startswith(prefix):
+                return group
+        return self.default
+
+    def for_path(self, request_path):
+        group = self.group_for(request_path)
+        with self.lock:
+            if group not in self.breakers:
+                self.breakers[group] = CircuitBreaker(group, **self.options)
+            return self.breakers[group]
+
+    def status(self):
+        with self.lock:
+            breakers = list(self.breakers.values())
+        return {breaker.name: breaker.status() for breaker in breakers}
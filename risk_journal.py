@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Journal binario del estado de riesgo: log append-only + snapshot compactado.
+
+Cada cambio de un campo de risk_state se añade al log como un registro de valor
+absoluto (campo = bytes empaquetados), así que reaplicar registros ya incluidos
+en el snapshot no altera el resultado. Al arrancar se carga el snapshot, se
+reproduce la cola del log y se compacta: nuevo snapshot y log vacío.
+
+    log:      [magic "WHRL" | versión | layout] [crc32 | campo | valor]...
+    snapshot: [magic "WHRS" | versión | layout | crc32] [valores de todos los campos]
+
+El layout es un crc32 de los nombres y formatos de los campos: si cambian, los
+archivos anteriores se ignoran en lugar de interpretarse mal.
+
+El registro se escribe con write() bajo el lock del estado: sobrevive a la caída
+del proceso. El fsync (opcional, para sobrevivir a un corte de la máquina) lo hace
+un hilo aparte que agrupa las escrituras pendientes, fuera del camino de la orden.
+"""
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from logging_setup import kv
+
+_LOG_HEADER = struct.Struct("<4sII")  # magic, versión, layout
+_SNAPSHOT_HEADER = struct.Struct("<4sIII")  # magic, versión, layout, crc32 del cuerpo
+_RECORD = struct.Struct("<IB")  # crc32 (campo + valor), índice del campo
+
+_fsync = getattr(os, "fdatasync", os.fsync)
+
+journal_log = logging.getLogger("risk.journal")
+
+
+class RiskJournal(object):
+    """Log + snapshot de los campos de un MappedStruct (valores en bytes empaquetados)
+
+    Las escrituras las serializa el llamante con el lock del estado compartido,
+    que también excluye a los demás workers.
+    """
+
+    LOG_MAGIC = b"WHRL"
+    SNAPSHOT_MAGIC = b"WHRS"
+    VERSION = 1
+
+    def __init__(self, path, fields, compact_bytes=64 * 1024, fsync=False):
+        self.path = path
+        self.snapshot_path = path + ".snap"
+        self.names = [name for name, _ in fields]
+        self.sizes = {name: struct.calcsize("<" + fmt) for name, fmt in fields}
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.layout = zlib.crc32(",".join(f"{name}:{fmt}" for name, fmt in fields).encode())
+        self.compact_bytes = compact_bytes  # Tamaño del log (común a todos los workers) que dispara la compactación
+        self.fsync = fsync
+        self.compactions = 0
+        self.syncs = 0
+        self.restored = {}
+        self._fd = None
+        self._pid = None
+        self._dirty = threading.Event()
+        self._flusher = None
+        self._flusher_pid = None
+
+    def _descriptor(self):
+        # Un descriptor por proceso: tras un fork cada worker abre el suyo
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+            if os.fstat(self._fd).st_size == 0:
+                os.write(self._fd, _LOG_HEADER.pack(self.LOG_MAGIC, self.VERSION, self.layout))
+        return self._fd
+
+    def append(self, name, raw):
+        """Añade un registro; devuelve True si toca compactar"""
+        body = bytes((self.index[name],)) + raw
+        fd = self._descriptor()
+        os.write(fd, _RECORD.pack(zlib.crc32(body), body[0]) + raw)
+        if self.fsync:
+            self._request_sync()
+        return os.fstat(fd).st_size >= self.compact_bytes
+
+    def _request_sync(self):
+        if self._flusher_pid != os.getpid() or not self._flusher.is_alive():  # También tras un fork
+            self._flusher = threading.Thread(target=self._flush_loop, name="risk-journal-fsync", daemon=True)
+            self._flusher_pid = os.getpid()
+            self._flusher.start()
+        self._dirty.set()
+
+    def _flush_loop(self):
+        # Un fsync cubre todo lo escrito desde el anterior (group commit)
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            try:
+                _fsync(self._descriptor())
+                self.syncs += 1
+            except OSError as e:
+                journal_log.error("❌ fsync del log de riesgo falló", extra=kv(path=self.path, error=str(e)))
+
+    def load(self):
+        """Snapshot + cola del log → {campo: bytes}; un registro incompleto o corrupto corta la cola"""
+        started = time.perf_counter()
+        values = self._read_snapshot()
+        snapshot_fields = len(values)
+        records = 0
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+
+        offset = _LOG_HEADER.size
+        if data and (len(data) < _LOG_HEADER.size
+                     or _LOG_HEADER.unpack_from(data, 0) != (self.LOG_MAGIC, self.VERSION, self.layout)):
+            journal_log.warning("⚠️ Log de riesgo de otro formato, se ignora", extra=kv(path=self.path))
+            data = b""
+        while offset + _RECORD.size <= len(data):
+            crc, field = _RECORD.unpack_from(data, offset)
+            if field >= len(self.names):
+                break
+            name = self.names[field]
+            end = offset + _RECORD.size + self.sizes[name]
+            raw = data[offset + _RECORD.size:end]
+            if len(raw) < self.sizes[name] or zlib.crc32(bytes((field,)) + raw) != crc:
+                break  # Escritura cortada por una caída: lo que sigue no es fiable
+            values[name] = raw
+            records += 1
+            offset = end
+        if data and offset < len(data):
+            journal_log.warning("⚠️ Cola del log de riesgo truncada",
+                                extra=kv(path=self.path, discarded_bytes=len(data) - offset))
+
+        self.restored = {
+            "snapshot_fields": snapshot_fields,
+            "log_records": records,
+            "restore_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+        return values
+
+    def _read_snapshot(self):
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+        if len(data) < _SNAPSHOT_HEADER.size:
+            return {}
+        magic, version, layout, crc = _SNAPSHOT_HEADER.unpack_from(data, 0)
+        body = data[_SNAPSHOT_HEADER.size:]
+        if (magic, version, layout) != (self.SNAPSHOT_MAGIC, self.VERSION, self.layout) \
+                or len(body) != sum(self.sizes.values()) or zlib.crc32(body) != crc:
+            journal_log.warning("⚠️ Snapshot de riesgo inválido, se ignora", extra=kv(path=self.snapshot_path))
+            return {}
+        values = {}
+        offset = 0
+        for name in self.names:
+            values[name] = body[offset:offset + self.sizes[name]]
+            offset += self.sizes[name]
+        return values
+
+    def compact(self, values):
+        """Escribe el snapshot con `values` ({campo: bytes}) y vacía el log
+
+        El snapshot se reemplaza de forma atómica antes de truncar el log: si el
+        proceso cae en medio, el log sobrante se reaplica sin cambiar nada.
+        """
+        body = b"".join(values[name] for name in self.names)
+        temporary = self.snapshot_path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(_SNAPSHOT_HEADER.pack(self.SNAPSHOT_MAGIC, self.VERSION, self.layout, zlib.crc32(body)))
+            f.write(body)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(temporary, self.snapshot_path)
+
+        fd = self._descriptor()
+        os.ftruncate(fd, 0)
+        os.write(fd, _LOG_HEADER.pack(self.LOG_MAGIC, self.VERSION, self.layout))
+        if self.fsync:
+            _fsync(fd)
+        self.compactions += 1
+
+    def stats(self):
+        try:
+            log_bytes = os.path.getsize(self.path)
+        except OSError:
+            log_bytes = 0
+        return {"log_bytes": log_bytes, "compactions": self.compactions, "syncs": self.syncs,
+                "restored": self.restored}
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+"""Estado compartido entre procesos (workers de gunicorn) sobre archivos mmap: riesgo y límites de tasa.
+
+Lecturas sin lock con un seqlock: el escritor pone el contador de secuencia en
+impar, escribe y lo deja en par; el lector reintenta si lo ve cambiar. Las
+escrituras se serializan con flock (entre procesos) + RLock (entre hilos). Dentro
+de un `with lock:` la secuencia sigue impar desde la primera escritura hasta
+soltar el lock: una actualización compuesta se ve entera o no se ve.
+"""
+import math
+import mmap
+import operator
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock, el estado solo es coherente dentro de un proceso
+    fcntl = None
+
+_HEADER = struct.Struct("<4sIQ")  # magic, versión, secuencia
+_SEQ = struct.Struct("<Q")
+_SEQ_OFFSET = 8
+
+
+def default_path(name):
+    """Archivo en /dev/shm (memoria) si existe; si no, en el directorio temporal"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, name)
+
+
+class ProcessLock(object):
+    """Lock reentrante entre hilos y procesos (flock sobre un descriptor propio de cada proceso)
+
+    El descriptor se reabre tras un fork: un flock heredado comparte la descripción
+    de archivo con el padre y no excluiría a los demás workers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rlock = threading.RLock()
+        self.depth = 0
+        self.owner = None  # Hilo (o greenlet) que tiene el lock
+        self.on_release = None  # Se llama antes de soltar el flock (cierra la secuencia del seqlock)
+        self._fd = None
+        self._pid = None
+
+    def _descriptor(self):
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+        return self._fd
+
+    def __enter__(self):
+        self.rlock.acquire()
+        if self.depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._descriptor(), fcntl.LOCK_EX)
+            self.owner = threading.get_ident()
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.depth -= 1
+        if self.depth == 0:
+            self.owner = None
+            if self.on_release is not None:
+                self.on_release()
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.rlock.release()
+        return False
+
+    def try_acquire(self):
+        """Como `with`, pero sin esperar: False si lo tiene otro hilo o proceso (se suelta con release())"""
+        if not self.rlock.acquire(blocking=False):
+            return False
+        if self.depth == 0:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(self._descriptor(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.rlock.release()
+                    return False
+            self.owner = threading.get_ident()
+        self.depth += 1
+        return True
+
+    def release(self):
+        self.__exit__(None, None, None)
+
+
+class MappedStruct(object):
+    """Registro de campos fijos en un archivo mmap, creado o reutilizado de forma atómica
+
+    El nombre del archivo lleva un hash de la disposición de campos: un proceso con
+    otra disposición (despliegue escalonado, otros grupos de COINEX_RATE_LIMITS) usa
+    su propio archivo y nunca redimensiona ni reinicia uno que otros tienen mapeado.
+    """
+
+    MAGIC = b"WHST"
+    VERSION = 1
+
+    def __init__(self, path, fields, defaults):
+        layout = zlib.crc32(repr((self.VERSION, tuple(fields))).encode("utf-8"))
+        self.path = path = f"{path}.{layout:08x}"
+        self.fields = {}
+        offset = _HEADER.size
+        for name, fmt in fields:
+            codec = struct.Struct("<" + fmt)
+            self.fields[name] = (codec, offset)
+            offset += codec.size
+        self.size = offset
+        self.names = [name for name, _ in fields]
+        self.record = struct.Struct("<" + "".join(fmt for _, fmt in fields))  # Todos los campos de una vez
+        self.lock = ProcessLock(path)
+        self.lock.on_release = self._close_sequence
+        self._writing = False  # Secuencia impar abierta por este proceso
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            size = os.fstat(fd).st_size
+            if size == 0:
+                os.ftruncate(fd, self.size)  # Solo se dimensiona un archivo recién creado
+            elif size != self.size:
+                raise ValueError(f"{path}: {size} bytes y esta disposición ocupa {self.size}")
+            self.buffer = mmap.mmap(fd, self.size)
+            magic, version, _ = _HEADER.unpack_from(self.buffer, 0)
+            # Cabecera a cero: recién creado, o su creador murió antes de escribirla (con el flock tomado)
+            self.created = magic == bytes(4)
+            if not self.created and (magic != self.MAGIC or version != self.VERSION):
+                self.buffer.close()
+                raise ValueError(f"{path}: cabecera {magic!r} v{version}, se esperaba {self.MAGIC!r} v{self.VERSION}")
+            if self.created:
+                # Archivo nuevo: se inicializa con los valores por defecto
+                self.buffer[:] = bytes(self.size)
+                for name, value in defaults.items():
+                    codec, field_offset = self.fields[name]
+                    codec.pack_into(self.buffer, field_offset, value)
+                _HEADER.pack_into(self.buffer, 0, self.MAGIC, self.VERSION, 0)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _owns_sequence(self):
+        """True si este hilo está a mitad de una actualización compuesta (lee lo que él mismo escribe)"""
+        return self._writing and self.lock.owner == threading.get_ident()
+
+    def read(self, name):
+        """Lectura sin lock (seqlock)"""
+        unpack, offset = self.fields[name][0].unpack_from, self.fields[name][1]
+        buffer = self.buffer
+        if self._writing and self._owns_sequence():
+            return unpack(buffer, offset)[0]
+        sequence = _SEQ.unpack_from
+        for _ in range(10000):
+            before = sequence(buffer, _SEQ_OFFSET)
+            if before[0] & 1:
+                continue  # Escritura en curso
+            value = unpack(buffer, offset)[0]
+            if sequence(buffer, _SEQ_OFFSET) == before:
+                return value
+        # Secuencia impar durante demasiado tiempo: un escritor murió a mitad (su flock ya se liberó)
+        with self.lock:
+            seq = _SEQ.unpack_from(buffer, _SEQ_OFFSET)[0]
+            if seq & 1 and not self._writing:
+                _SEQ.pack_into(buffer, _SEQ_OFFSET, seq + 1)
+            return unpack(buffer, offset)[0]
+
+    def read_all(self):
+        """Todos los campos en una sola lectura sin lock (tupla en el orden de `fields`)"""
+        unpack, buffer = self.record.unpack_from, self.buffer
+        if self._writing and self._owns_sequence():
+            return unpack(buffer, _HEADER.size)
+        sequence = _SEQ.unpack_from
+        for _ in range(10000):
+            before = sequence(buffer, _SEQ_OFFSET)
+            if before[0] & 1:
+                continue
+            values = unpack(buffer, _HEADER.size)
+            if sequence(buffer, _SEQ_OFFSET) == before:
+                return values
+        with self.lock:
+            self.read(self.names[0])  # Repara la secuencia de un escritor muerto
+            return unpack(buffer, _HEADER.size)
+
+    def write(self, name, value):
+        """Escribe el campo; devuelve False (sin tocar la secuencia) si el valor no cambia"""
+        return self.write_raw(name, self.fields[name][0].pack(value))
+
+    def raw(self, name):
+        """Bytes empaquetados del campo (para el journal); llamar con el lock tomado"""
+        codec, offset = self.fields[name]
+        return self.buffer[offset:offset + codec.size]
+
+    def write_raw(self, name, raw):
+        codec, offset = self.fields[name]
+        if self.buffer[offset:offset + codec.size] == raw:
+            return False  # Sin cambios: ni lock ni secuencia
+        with self.lock:
+            if self.buffer[offset:offset + codec.size] == raw:
+                return False
+            if not self._writing:
+                seq = _SEQ.unpack_from(self.buffer, _SEQ_OFFSET)[0]
+                _SEQ.pack_into(self.buffer, _SEQ_OFFSET, seq + 1)
+                self._writing = True
+            self.buffer[offset:offset + codec.size] = raw
+            return True  # La secuencia vuelve a par al soltar el lock (_close_sequence)
+
+    def _close_sequence(self):
+        if self._writing:
+            seq = _SEQ.unpack_from(self.buffer, _SEQ_OFFSET)[0]
+            _SEQ.pack_into(self.buffer, _SEQ_OFFSET, seq + 1)
+            self._writing = False
+
+
+_NONE = float("nan")  # None en los campos float
+_REASON_BYTES = 200
+
+
+def _optional(value):
+    return None if value != value else value  # NaN → None
+
+
+class SharedRiskState(object):
+    """`risk_state` visible por todos los workers, con la misma interfaz de dict
+
+    `lock` serializa las actualizaciones compuestas (check_risk_limits, resultado
+    de la operación); cada campo suelto se lee sin lock.
+    """
+
+    FIELDS = (
+        ("consecutive_losses", "q"),
+        ("daily_loss", "d"),
+        ("start_balance", "d"),
+        ("last_balance", "d"),
+        ("paused", "?"),
+        ("pause_time", "d"),  # Epoch
+        ("pause_reason", f"{_REASON_BYTES}s"),
+    )
+    DEFAULTS = {"consecutive_losses": 0, "daily_loss": 0.0, "start_balance": _NONE, "last_balance": _NONE,
+                "paused": False, "pause_time": _NONE, "pause_reason": b""}
+    # Campos que van al journal: daily_loss se deriva de start_balance y del balance de cada
+    # alerta (check_risk_limits lo recalcula siempre), no hace falta persistirlo
+    JOURNALED = tuple(field for field in FIELDS if field[0] != "daily_loss")
+
+    def __init__(self, path, journal=None):
+        self.store = MappedStruct(path, self.FIELDS, self.DEFAULTS)
+        self.lock = self.store.lock
+        self.read = self.store.read
+        self.journal = journal
+        if journal is not None:
+            self.recover()
+        self.index = {name: i for i, (name, _) in enumerate(self.FIELDS)}
+        self.getters = {}  # Claves de values() → función que las extrae y decodifica
+        self.decoders = {
+            "start_balance": _optional,
+            "last_balance": _optional,
+            "pause_time": lambda value: None if math.isnan(value) else datetime.fromtimestamp(value),
+            "pause_reason": lambda value: value.rstrip(b"\0").decode("utf-8", "replace"),
+        }
+
+    def __getitem__(self, key):
+        decode = self.decoders.get(key)
+        return self.read(key) if decode is None else decode(self.read(key))
+
+    def __setitem__(self, key, value):
+        if key == "pause_reason":
+            value = value.encode("utf-8")[:_REASON_BYTES]
+        elif key == "pause_time":
+            value = _NONE if value is None else value.timestamp()
+        elif value is None:
+            value = _NONE
+        if self.journal is None or key not in self.journal.index:
+            self.store.write(key, value)
+            return
+        with self.lock:
+            # Solo los cambios reales van al journal
+            if self.store.write(key, value) and self.journal.append(key, self.store.raw(key)):
+                self.journal.compact(self.raw_values())
+
+    def raw_values(self):
+        """Bytes de los campos del journal (para el snapshot)"""
+        return {name: self.store.raw(name) for name, _ in self.JOURNALED}
+
+    def recover(self):
+        """♻️ Si el archivo mmap es nuevo (reinicio de la máquina o del contenedor), restaura
+        el estado desde el journal; después lo compacta"""
+        with self.lock:
+            if self.store.created:
+                for name, raw in self.journal.load().items():
+                    self.store.write_raw(name, raw)
+            self.journal.compact(self.raw_values())
+
+    def values(self, *keys):
+        """Varios campos leídos juntos (una sola pasada del seqlock, valores coherentes entre sí)"""
+        getter = self.getters.get(keys)
+        if getter is None:
+            getter = self.getters[keys] = self._getter(keys)
+        return getter(self.store.read_all())
+
+    def _getter(self, keys):
+        pick = operator.itemgetter(*(self.index[key] for key in keys))
+        decode = [(position, self.decoders[key]) for position, key in enumerate(keys) if key in self.decoders]
+
+        def getter(record):
+            values = list(pick(record)) if len(keys) > 1 else [pick(record)]
+            for position, decoder in decode:
+                values[position] = decoder(values[position])
+            return values
+        return getter
+
+    def get(self, key, default=None):
+        return self[key] if key in self.store.fields else default
+
+    def update(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self[key] = value
+
+    def snapshot(self):
+        """Copia serializable a JSON (para /status)"""
+        state = {name: self[name] for name, _ in self.FIELDS}
+        if state["pause_time"] is not None:
+            state["pause_time"] = state["pause_time"].isoformat()
+        return state
+
+
+# Presupuesto de CoinEx por grupo de endpoints (peticiones por segundo, ráfaga = 1 s)
+DEFAULT_RATE_LIMITS = {"account": 10, "market": 10, "order": 20, "position": 20, "other": 10, "websocket": 10}
+
+
+def parse_rate_limits(spec, defaults=DEFAULT_RATE_LIMITS):
+    """'order=20,account=10' → {'order': 20.0, 'account': 10.0, ...} sobre los valores por defecto"""
+    limits = {group: float(rate) for group, rate in defaults.items()}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            group, rate = item.split("=", 1)
+            limits[group.strip()] = float(rate)
+    return limits
+
+
+class SharedRateLimiter(object):
+    """Token buckets por grupo de endpoints en un archivo mmap: un solo presupuesto
+    para todos los workers, el servidor asyncio y el proceso de websockets
+
+    `reserve()` descuenta el token bajo el lock y devuelve cuánto esperar; la espera
+    la hace el llamante fuera del lock (time.sleep, gevent o asyncio.sleep).
+    """
+
+    def __init__(self, path, limits):
+        self.limits = dict(limits)
+        fields = []
+        defaults = {}
+        for group, rate in sorted(self.limits.items()):
+            fields += [(f"{group}.tokens", "d"), (f"{group}.updated", "d")]
+            defaults[f"{group}.tokens"] = float(rate)
+            defaults[f"{group}.updated"] = 0.0
+        self.store = MappedStruct(path, fields, defaults)
+        self.keys = {group: (f"{group}.tokens", f"{group}.updated") for group in self.limits}
+
+    def reserve(self, group):
+        """Toma un token del grupo; devuelve los segundos de espera (0.0 si había saldo)"""
+        rate = self.limits.get(group)
+        if not rate:
+            return 0.0
+        tokens_key, updated_key = self.keys[group]
+        store = self.store
+        with store.lock:
+            now = time.monotonic()  # Reloj del sistema, común a todos los procesos
+            updated = store.read(updated_key)
+            elapsed = now - updated if now >= updated else 1.0  # Reinicio de la máquina
+            tokens = min(rate, store.read(tokens_key) + elapsed * rate) - 1.0
+            store.write(tokens_key, tokens)
+            store.write(updated_key, now)
+        return 0.0 if tokens >= 0 else -tokens / rate
+
+    def acquire(self, group):
+        """reserve() + espera bloqueante (cooperativa con gevent)"""
+        wait_time = self.reserve(group)
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+    def status(self):
+        return {group: round(self.store.read(keys[0]), 2) for group, keys in self.keys.items()}
+
+
+def default_rate_limiter():
+    """Limitador compartido con la configuración del entorno (COINEX_RATE_LIMITS, RATE_LIMIT_PATH)"""
+    path = os.getenv("RATE_LIMIT_PATH") or default_path("webhook_rate_limits")
+    return SharedRateLimiter(path, parse_rate_limits(os.getenv("COINEX_RATE_LIMITS")))
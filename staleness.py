@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Antigüedad de las alertas: reloj corregido con la hora de CoinEx y máximos por estrategia."""
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+log = logging.getLogger("staleness")
+
+# Campos de hora aceptados en la alerta, por prioridad. En TradingView es {{timenow}} (hora
+# de disparo). "time" no se acepta: {{time}} es la apertura de la vela y con velas de más de
+# unos segundos toda alerta parecería vencida.
+ALERT_TIME_FIELDS = ("timenow", "alert_time", "timestamp")
+
+
+def parse_alert_time(value):
+    """Epoch en segundos o milisegundos, o ISO 8601 (con Z u offset) → epoch en segundos"""
+    if value is None or value == "" or isinstance(value, bool):
+        return None  # True/False no son horas (bool es subclase de int)
+    if isinstance(value, (int, float)):
+        try:
+            value = float(value)
+        except OverflowError:
+            return None
+        if not math.isfinite(value):
+            return None  # "nan"/"inf" no son horas: NaN pasaría cualquier máximo y rompería ALERT_AGE
+        return value / 1000.0 if value > 1e12 else value
+    try:
+        return parse_alert_time(float(value))
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)  # TradingView envía UTC
+    return moment.timestamp()
+
+
+def alert_time(data):
+    """Hora de la alerta según su primer campo de hora válido (None si no trae ninguno)"""
+    for field in ALERT_TIME_FIELDS:
+        if field in data:
+            stamp = parse_alert_time(data[field])
+            if stamp is not None:
+                return stamp
+    return None
+
+
+class ServerClock(object):
+    """Desfase del reloj local respecto al de CoinEx (GET /v2/time), refrescado en segundo plano
+
+    De varias muestras se queda con la de menor RTT: su punto medio es la mejor
+    estimación del instante en que el servidor leyó su reloj.
+    """
+
+    def __init__(self, fetch, refresh_interval=300.0, samples=3):
+        self.fetch = fetch  # fetch() → respuesta de CoinEx /time
+        self.refresh_interval = refresh_interval
+        self.samples = samples
+        self.offset = 0.0  # Segundos a sumar a time.time()
+        self.rtt = None
+        self.synced_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sync(self):
+        best = None
+        for _ in range(self.samples):
+            try:
+                sent = time.time()
+                response_data = self.fetch().json()
+                received = time.time()
+                server = response_data["data"]["timestamp"] / 1000.0
+            except Exception as e:
+                log.error("❌ No se pudo leer la hora de CoinEx: %s", e)
+                continue
+            rtt = received - sent
+            if best is None or rtt < best[0]:
+                best = (rtt, server - (sent + received) / 2)
+        if best is None:
+            return False
+        self.rtt, self.offset = best
+        self.synced_at = time.time()
+        log.info("🕒 Reloj sincronizado con CoinEx: desfase %.1f ms (RTT %.1f ms)", self.offset * 1000, self.rtt * 1000)
+        return True
+
+    def now(self):
+        return time.time() + self.offset
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.sync()
+
+    def start(self):
+        """Sincronización inicial y arranque del hilo de refresco"""
+        self.sync()
+        if self._thread is None or not self._thread.is_alive():  # También tras un fork
+            self._thread = threading.Thread(target=self._refresh_loop, name="server-clock", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {"offset_ms": round(self.offset * 1000, 3),
+                "rtt_ms": round(self.rtt * 1000, 3) if self.rtt is not None else None,
+                "synced_at": self.synced_at}
+
+
+def parse_max_ages(spec):
+    """'scalp=3,swing=120' → {'scalp': 3.0, 'swing': 120.0}"""
+    ages = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            strategy, seconds = item.split("=", 1)
+            ages[strategy.strip()] = float(seconds)
+    return ages
+
+
+class StalenessPolicy(object):
+    """Decide qué hacer con una alerta según su antigüedad
+
+    `judge()` devuelve (antigüedad en s o None, acción): "execute", "drop" o
+    "close_only" (solo cierra la posición y cancela órdenes, sin abrir otra a mercado).
+    """
+
+    ACTIONS = ("drop", "close_only")
+
+    def __init__(self, clock, max_age=10.0, per_strategy=None, action="drop"):
+        if action not in self.ACTIONS:
+            raise ValueError(f"Acción para alertas vencidas no válida: {action!r} (usa {', '.join(self.ACTIONS)})")
+        self.clock = clock
+        self.max_age = max_age  # 0 desactiva el filtro
+        self.per_strategy = dict(per_strategy or {})
+        self.action = action
+
+    def max_age_for(self, alert):
+        return self.per_strategy.get(alert.get("strategy"), self.max_age)
+
+    def judge(self, alert):
+        sent_at = alert.get("sent_at")
+        if sent_at is None:
+            return None, "execute"  # Alerta sin hora: no se puede juzgar
+        age = self.clock.now() - sent_at
+        max_age = self.max_age_for(alert)
+        if max_age and age > max_age:
+            return age, self.action
+        return age, "execute"
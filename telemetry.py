@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Envío no bloqueante de eventos a Azure: cola acotada, lotes gzip NDJSON y spool en disco.
+
+El spool es común a todos los workers de gunicorn: se escribe con un flock y solo
+un proceso a la vez lo reenvía. Los lotes que Azure rechaza de forma definitiva
+(4xx salvo 429) no vuelven al spool: van a `<spool>.dead` para revisarlos a mano.
+"""
+import gzip
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import requests
+
+from logging_setup import kv
+from shared_state import ProcessLock
+
+log = logging.getLogger("telemetry")
+
+# Resultado de un envío: entregado, reintentable (queda en el spool) o rechazado para siempre
+SENT, RETRY, REJECTED = "sent", "retry", "rejected"
+
+
+class TelemetrySink(object):
+    """Cola en memoria + hilo emisor que agrupa eventos y los envía comprimidos
+
+    Si Azure no responde, los lotes se guardan en un spool local (append-only)
+    y se reenvían en cuanto vuelve a aceptar peticiones.
+    """
+
+    def __init__(self, url, spool_path, max_queue=1000, batch_size=50,
+                 flush_interval=1.0, max_attempts=3, timeout=5.0, max_spool_bytes=64 << 20):
+        self.url = url
+        self.spool_path = spool_path
+        self.dead_path = spool_path + ".dead"
+        self.max_spool_bytes = max_spool_bytes  # Tope de cada archivo; lo que no cabe se descarta
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.spool_lock = ProcessLock(spool_path + ".lock")  # Escrituras y rotación del spool
+        self.replay_lock = ProcessLock(spool_path + ".replay.lock")  # Un solo reenvío a la vez
+        self.session = requests.Session()
+        self.sent = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.failed_batches = 0
+        self.rejected = 0
+        self.dropped = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():  # También tras un fork
+            self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+            self._thread.start()
+
+    def emit(self, event):
+        """📤 Encola un evento sin bloquear; si la cola está llena va directo al spool"""
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self._spool([_dumps(event)])
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        self._guarded(self._replay_spool)
+        while True:
+            self._guarded(self._flush_next)
+
+    def _guarded(self, step):
+        # Un fallo inesperado (disco lleno, spool ilegible...) no puede terminar el hilo
+        try:
+            step()
+        except Exception as e:
+            log.error("🔥 Error en el envío de telemetría", extra=kv(error=str(e)))
+            time.sleep(self.flush_interval)
+
+    def _flush_next(self):
+        batch = self._next_batch()
+        if not batch:
+            return
+        lines = [_dumps(event) for event in batch]
+        try:
+            result = self._post(lines)
+        except Exception:
+            self._spool(lines)  # El lote no se pierde: queda para el próximo reenvío
+            raise
+        if result == SENT:
+            self.sent += len(lines)
+            self._replay_spool()
+        elif result == REJECTED:
+            self._reject(lines)
+        else:
+            self._spool(lines)
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _post(self, lines):
+        body = gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+        headers = {"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+        for attempt in range(self.max_attempts):
+            try:
+                response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+                if response.status_code < 300:
+                    return SENT
+                if response.status_code < 500 and response.status_code != 429:
+                    # Error definitivo: reintentar no lo arregla, el lote no vuelve al spool
+                    log.error("❌ Azure rechazó el lote (%s): %s", response.status_code, response.text[:200])
+                    self.failed_batches += 1
+                    return REJECTED
+            except requests.exceptions.RequestException as e:
+                log.warning("⚠️ Azure no disponible: %s", e)
+            time.sleep(random.uniform(0, min(5.0, 0.5 * (2 ** attempt))))
+        self.failed_batches += 1
+        return RETRY
+
+    def _append(self, path, lines):
+        """Añade líneas a un archivo del spool sin pasar de `max_spool_bytes`; False si no caben"""
+        data = "\n".join(lines) + "\n"
+        with self.spool_lock:
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                size = 0
+            if size + len(data) > self.max_spool_bytes:
+                self.dropped += len(lines)
+                log.error("❌ Spool de telemetría lleno, se descartan eventos",
+                          extra=kv(path=path, events=len(lines), size_bytes=size))
+                return False
+            with open(path, "a", encoding="utf-8") as spool:
+                spool.write(data)
+        return True
+
+    def _spool(self, lines):
+        if self._append(self.spool_path, lines):
+            self.spooled += len(lines)
+
+    def _reject(self, lines):
+        """Lote rechazado por Azure: a `.dead`, fuera del reenvío (si no, lo bloquearía para siempre)"""
+        if self._append(self.dead_path, lines):
+            self.rejected += len(lines)
+
+    def _replay_spool(self):
+        """🔁 Reenvía lo acumulado en el spool; lo que vuelva a fallar se queda en él
+
+        Si otro proceso ya está reenviando, este no espera: lo intentará tras su próximo envío.
+        """
+        if not self.replay_lock.try_acquire():
+            return
+        try:
+            self._replay_locked()
+        finally:
+            self.replay_lock.release()
+
+    def _replay_locked(self):
+        replay_path = self.spool_path + ".replay"  # Sobrevive a una caída a mitad del reenvío
+        with self.spool_lock:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spool_path):
+                    return
+                os.replace(self.spool_path, replay_path)
+
+        try:
+            with open(replay_path, encoding="utf-8") as replay:
+                lines = [line.rstrip("\n") for line in replay if line.strip()]
+        except FileNotFoundError:
+            return
+
+        for i in range(0, len(lines), self.batch_size):
+            chunk = lines[i:i + self.batch_size]
+            result = self._post(chunk)
+            if result == RETRY:
+                self._spool(lines[i:])
+                break
+            if result == REJECTED:
+                self._reject(chunk)  # Los trozos siguientes se siguen enviando
+                continue
+            self.replayed += len(chunk)
+        try:
+            os.remove(replay_path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        return {
+            "queue_depth": self.depth(),
+            "sent": self.sent,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "failed_batches": self.failed_batches,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+        }
+
+
+def _dumps(event):
+    return json.dumps(event, default=str, separators=(",", ":"))
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import importlib
+import json
+import logging
+from contextlib import asynccontextmanager
+
+import pytest
+
+from logging_setup import stop_logging
+from market_cache import LeverageStateCache, PositionCache
+from preemption import MarketPreemption
+
+PRICE = 50000.0
+BALANCE = 1000.0  # Con 5x y el 2% de margen: 0.098 BTC por alerta a PRICE
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """app.py con credenciales de prueba, CoinEx inalcanzable y su estado compartido en un directorio temporal"""
+    state = tmp_path_factory.mktemp("app_state")
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    with pytest.MonkeyPatch.context() as env:
+        # Explícitas: load_dotenv() no pisa variables ya definidas, así un .env local no se cuela
+        for name, value in {
+            "ACCESS_ID": "test", "SECRET_KEY": "test",
+            "AZURE_FUNCTION_URL": "http://127.0.0.1:9/telemetry",
+            "COINEX_API_URL": "http://127.0.0.1:9/v2",
+            "RISK_STATE_PATH": str(state / "risk_state"),
+            "RATE_LIMIT_PATH": str(state / "rate_limits"),
+            "RISK_JOURNAL_PATH": str(state / "risk_journal.bin"),
+            "TELEMETRY_SPOOL": str(state / "telemetry_spool.ndjson"),
+            "ALERT_JOURNAL_PATH": "", "FLIP_MODE": "0",
+            "STALE_ALERT_MAX_AGE": "10", "STRATEGY_MAX_AGE": "", "STALE_ALERT_ACTION": "drop",
+        }.items():
+            env.setenv(name, value)
+        module = importlib.import_module("app")
+    module.ready.set()  # Sin warmup: las reglas de mercado por defecto bastan
+    yield module
+    # El logging de app escribe en la salida que captura pytest: se vacía antes de que la cierre
+    stop_logging()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+class FakeResponse(object):
+    def __init__(self, data=None, code=0, status_code=200):
+        self.status_code = status_code
+        self.body = {"code": code, "message": "OK" if code == 0 else "error", "data": data if data is not None else {}}
+        self.text = json.dumps(self.body)
+
+    def json(self):
+        return self.body
+
+
+class StubExchange(object):
+    """Transporte del pipeline con un CoinEx en memoria: anota cada llamada
+
+    `position` es la posición neta que devuelve /futures/pending-position (None: la
+    lectura falla); `filled` lo que ejecuta cada orden (None: toda). `hooks[nombre]`
+    corre antes de responder esa llamada (p. ej. para dejarla en vuelo).
+    """
+
+    def __init__(self, app_module, position=None, filled=None):
+        self.app = app_module
+        self.position = position
+        self.filled = filled
+        self.available = BALANCE
+        self.calls = []
+        self.trades = []  # Estado de cada evento final que el pipeline entrega a la telemetría
+        self.hooks = {}
+
+    def _call(self, name, *args):
+        self.calls.append((name, ) + args)
+        if name in self.hooks:
+            self.hooks[name](*args)
+
+    def names(self):
+        return [call[0] for call in self.calls]
+
+    def orders(self):
+        return [call[1:] for call in self.calls if call[0] == "send_order_to_coinex"]
+
+    async def balance(self):
+        self._call("balance")
+        return FakeResponse([{"available": self.available, "margin": 0}])
+
+    async def pending_positions(self):
+        self._call("pending_positions")
+        if self.position is None:
+            return FakeResponse(code=3008, status_code=200)
+        side = "long" if self.position > 0 else "short"
+        positions = [{"market": "BTCUSDT", "side": side, "open_interest": str(abs(self.position)),
+                      "margin_mode": self.app.MARGIN_MODE, "leverage": str(self.app.LEVERAGE)}] if self.position else []
+        return FakeResponse(positions)
+
+    async def close_position(self):
+        self._call("close_position")
+        return FakeResponse()
+
+    async def cancel_all_orders(self, side):
+        self._call("cancel_all_orders", side)
+        return FakeResponse()
+
+    async def adjust_position_leverage(self, market, margin_mode, leverage):
+        self._call("adjust_position_leverage", market)
+        return FakeResponse()
+
+    async def send_order_to_coinex(self, market, side, amount):
+        self._call("send_order_to_coinex", market, side, amount)
+        filled = amount if self.filled is None else self.filled
+        return FakeResponse({"market": market, "side": side, "order_id": len(self.calls), "amount": str(amount),
+                             "filled_amount": str(filled), "filled_value": str(filled * PRICE),
+                             "last_filled_price": str(PRICE)})
+
+    async def protect(self, sl_price, tp_price, fill_time, trace):
+        self._call("protect", sl_price, tp_price)
+        return FakeResponse(), FakeResponse()
+
+    async def blocking(self, func, *args):
+        return func(*args)
+
+    @asynccontextmanager
+    async def stage(self, market, ticket, claim=False):
+        with self.app.preemption.stage(market, ticket, claim=claim):
+            yield
+
+
+@pytest.fixture
+def exchange(app_module, monkeypatch):
+    """CoinEx en memoria con cachés y turnos nuevos; los eventos finales quedan en `exchange.trades`"""
+    stub = StubExchange(app_module)
+    monkeypatch.setattr(app_module, "leverage_cache", LeverageStateCache())
+    monkeypatch.setattr(app_module, "position_cache", PositionCache())
+    monkeypatch.setattr(app_module, "preemption", MarketPreemption())
+    monkeypatch.setattr(app_module, "emit_trade", lambda ctx, payload: stub.trades.append(payload["status"]))
+    return stub
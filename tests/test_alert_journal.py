@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+
+import pytest
+
+from alert_journal import CLAIM, AlertJournal, AlertQueue, _CLAIM, scan
+
+
+def make_journal(tmp_path, **options):
+    return AlertJournal(str(tmp_path / "alerts.bin"), fsync=False, **options)
+
+
+def accept(journal, n, received_at=None):
+    return journal.accept(json.dumps({"n": n}).encode("utf-8"), received_at or time.time())
+
+
+def claims(journal):
+    with open(journal.path, "rb") as f:
+        records, _ = scan(f.read())
+    return [_CLAIM.unpack(body) for kind, body in records if kind == CLAIM]
+
+
+def test_recovery_claims_dead_owner_alerts_with_their_stages(tmp_path):
+    dead = make_journal(tmp_path)
+    first, second = accept(dead, 1), accept(dead, 2)
+    dead.stage(first, "order", durable=True)
+    dead.stage(first, "filled", {"sl_price": 99.0, "tp_price": 103.0})
+    dead.done(second)
+    dead.close()  # Proceso muerto: suelta su flock
+
+    owner = make_journal(tmp_path)
+    [(alert_id, _, alert, stages)] = owner.recover()
+    assert (alert_id, alert) == (first, {"n": 1})
+    assert stages == {"order": {}, "filled": {"sl_price": 99.0, "tp_price": 103.0}}
+    assert claims(owner) == [(owner.token, first)]
+
+    # Mientras el nuevo dueño vive, nadie más la reclama
+    other = make_journal(tmp_path)
+    assert other.recover() == []
+
+    # Si también muere, la siguiente recuperación conserva las etapas
+    owner.close()
+    [(alert_id, _, _, stages)] = other.recover()
+    assert alert_id == first and "order" in stages
+    assert claims(other)[-1] == (other.token, first)
+    other.close()
+
+
+def test_compaction_keeps_stages_of_pending_alerts(tmp_path):
+    journal = make_journal(tmp_path, compact_bytes=2048)
+    pending = accept(journal, 0)
+    journal.stage(pending, "order", durable=True)
+    for n in range(1, 60):
+        journal.done(accept(journal, n))
+    assert journal.compactions > 0
+    journal.close()
+
+    [(alert_id, _, _, stages)] = make_journal(tmp_path).recover()
+    assert alert_id == pending
+    assert stages == {"order": {}}
+
+
+def test_commit_timeout_rejects_alert_and_cancels_late_accept(tmp_path):
+    journal = make_journal(tmp_path, commit_timeout=0.05)
+    disk = threading.Event()
+    write = journal._write
+    journal._write = lambda data: disk.wait() and write(data)
+    with pytest.raises(TimeoutError):
+        accept(journal, 1)
+    disk.set()
+    journal.close()  # El ACCEPT tardío llega al disco seguido de su DONE
+    assert make_journal(tmp_path).recover() == []
+
+
+def test_flusher_survives_unexpected_errors(tmp_path):
+    journal = make_journal(tmp_path)
+    write = journal._write
+    failures = [RuntimeError("fallo inesperado")]
+
+    def flaky(data):
+        if failures:
+            raise failures.pop()
+        write(data)
+    journal._write = flaky
+    with pytest.raises(OSError):
+        accept(journal, 1)
+    accept(journal, 2)
+    assert journal._flusher.is_alive()
+
+
+def test_queue_runs_stale_alert_that_already_sent_its_order(tmp_path):
+    dead = make_journal(tmp_path)
+    old = time.time() - 600
+    ordered, untouched = accept(dead, 1, old), accept(dead, 2, old)
+    dead.stage(ordered, "order", durable=True)
+    dead.close()
+
+    executed = []
+    alert_queue = AlertQueue(make_journal(tmp_path), lambda alert, received_at, context, stages:
+                             executed.append((alert, sorted(stages.recorded))), workers=1, max_age=60)
+    alert_queue.start()
+    alert_queue.stop()
+    # La vieja sin orden se descarta; la que ya envió su orden aún necesita su SL/TP
+    assert executed == [({"n": 1}, ["order"])]
+    assert (alert_queue.stale, alert_queue.executed) == (1, 1)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+import time
+
+import pytest
+
+
+ALERT = {"market": "BTCUSDT", "side": "buy", "price": 50000, "amount": 0.01}
+
+
+def alert_context(app_module, side="buy"):
+    return app_module.alert_context(dict(ALERT, side=side))
+
+
+def send_webhook(app_module, exchange, **fields):
+    """POST /webhook por el pipeline compartido; los enteros de hora son segundos de antigüedad"""
+    data = dict(ALERT)
+    data.update((field, time.time() - value if isinstance(value, int) else value) for field, value in fields.items())
+    return app_module.run_sync(app_module.handle_webhook(data, app_module.tracer.start(), exchange))
+
+
+@pytest.mark.parametrize("fields, status", [
+    ({"timenow": 1}, "success"),
+    ({"timenow": 60}, "ignored"),
+    ({"timenow": "nan", "timestamp": 60}, "ignored"),  # Una hora no finita no tapa a la siguiente
+    ({"timenow": "inf"}, "success"),  # Sin hora válida no se puede juzgar: se ejecuta
+    ({"alert_time": "-inf", "timestamp": "nan"}, "success"),
+])
+def test_webhook_drops_stale_alerts_and_never_judges_non_finite_times(app_module, exchange, fields, status):
+    body, code = send_webhook(app_module, exchange, **fields)
+    assert (code, body["status"]) == (200, status)
+    if status == "ignored":
+        assert exchange.calls == []  # Descartada antes de pedir el balance
+    else:
+        assert exchange.orders() == [("BTCUSDT", "buy", 0.098)]
+        assert exchange.trades == ["completed"]
+    assert math.isfinite(app_module.ALERT_AGE.children[()].sum)
+
+
+def test_stale_alert_is_downgraded_to_close_only(app_module, exchange, monkeypatch):
+    monkeypatch.setattr(app_module.staleness, "action", "close_only")
+    body, code = send_webhook(app_module, exchange, timenow="nan", alert_time=60)
+    assert (code, body["status"]) == (200, "success")
+    assert exchange.names() == ["balance", "close_position", "cancel_all_orders"]
+    assert exchange.trades == ["stale_closed"]
+
+
+@pytest.mark.parametrize("in_flight, orders, adjusted", [
+    ("send_order_to_coinex", 2, [True]),  # Su orden termina, pero ya no envía su SL/TP
+    ("cancel_all_orders", 1, [False, True]),  # Cortada al entrar al ajuste de apalancamiento
+])
+def test_newer_alert_stops_the_older_run_before_its_protection(app_module, exchange, monkeypatch,
+                                                                in_flight, orders, adjusted):
+    started, release = threading.Event(), threading.Event()
+
+    def hold(*args):
+        if not started.is_set():
+            started.set()
+            release.wait(2)
+    exchange.hooks[in_flight] = hold
+    results = []
+    adjust = app_module.leverage_cache.adjusted
+    monkeypatch.setattr(app_module.leverage_cache, "adjusted",
+                        lambda *args: (results.append(args[-1]), adjust(*args)))
+
+    def run(ctx):
+        app_module.run_sync(app_module.pipeline(ctx, exchange))
+
+    older = threading.Thread(target=run, args=(alert_context(app_module),))
+    older.start()
+    assert started.wait(2)
+    slot = app_module.preemption.slots["BTCUSDT"]
+    older_ticket = slot.claimed
+    newer = threading.Thread(target=run, args=(alert_context(app_module, "sell"),))
+    newer.start()
+    deadline = time.monotonic() + 2
+    while slot.claimed == older_ticket and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert slot.claimed > older_ticket
+    assert exchange.names().count("close_position") == 1  # El cierre nuevo espera a la llamada en vuelo
+    release.set()
+    older.join(2)
+    newer.join(2)
+
+    assert not older.is_alive() and not newer.is_alive()
+    assert sorted(exchange.trades) == ["completed", "preempted"]
+    assert [side for _, side, _ in exchange.orders()] == ["buy", "sell"][-orders:]
+    protected = [call[1] for call in exchange.calls if call[0] == "protect"]
+    assert len(protected) == 1 and protected[0] > ALERT["price"]  # Solo el SL de la nueva (sell)
+    assert sorted(results) == adjusted
+    assert not slot.lock.locked()
+
+
+@pytest.mark.parametrize("position, filled, order_amount, opened, status", [
+    (0.05, None, 0.148, 0.098, "completed"),  # long → short en una sola orden
+    (0.05, 0.1, 0.148, 0.05, "completed"),  # Fill parcial: la nueva posición es menor
+    (0.05, 0.03, 0.148, None, "partial_fill"),  # Ni terminó de cerrar la anterior: sin SL/TP
+    (None, None, 0.098, 0.098, "completed"),  # Posición desconocida: cierre y apertura
+    (-0.05, None, 0.098, 0.098, "completed"),  # Ya del lado de la alerta: cierre y apertura
+])
+def test_flip_sizes_the_order_and_its_protection_from_the_fill(app_module, exchange, monkeypatch,
+                                                                position, filled, order_amount, opened, status):
+    monkeypatch.setattr(app_module, "FLIP_MODE", True)
+    exchange.position, exchange.filled = position, filled
+    app_module.run_sync(app_module.pipeline(alert_context(app_module, "sell"), exchange))
+
+    flipped = order_amount != 0.098
+    names = exchange.names()
+    assert exchange.orders() == [("BTCUSDT", "sell", pytest.approx(order_amount))]
+    assert ("close_position" in names) is not flipped
+    assert exchange.trades == [status]
+    protected = [call[1] for call in exchange.calls if call[0] == "protect"]
+    if opened is None:
+        assert protected == []
+    else:
+        # SL de una pérdida del 2.5 % del balance sobre lo que abrió la orden, no sobre su total
+        rules = app_module.market_cache.get("BTCUSDT")
+        assert protected == [rules.quantize_price(ALERT["price"] + exchange.available * 0.025 / opened)]
+    before = position if flipped else 0.0
+    assert app_module.position_cache.get("BTCUSDT") is None  # max_age 0: el siguiente flip la vuelve a leer
+    assert app_module.position_cache.positions["BTCUSDT"][0] == pytest.approx(before - (filled or order_amount))
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import logging
+import queue
+
+from logging_setup import KeyValueFormatter, LazyQueueHandler, kv
+
+
+def test_queued_record_keeps_values_from_when_it_was_logged():
+    records = queue.SimpleQueue()
+    logger = logging.getLogger("test.lazy_queue")
+    logger.propagate = False
+    logger.addHandler(LazyQueueHandler(records))
+    try:
+        alert = {"side": "buy"}
+        logger.warning("🚀 Orden: %s", alert, extra=kv(alert=alert))
+        alert["side"] = "sell"  # El pipeline sigue modificando la alerta antes de que escriba el listener
+        line = KeyValueFormatter().format(records.get_nowait())
+    finally:
+        logger.handlers.clear()
+    assert "🚀 Orden: {'side': 'buy'}" in line
+    assert line.endswith('alert={"side": "buy"}')
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from market_cache import LeverageStateCache, PositionCache, flip_fill
+
+
+def test_leverage_adjust_counts_only_accepted_adjustments():
+    cache = LeverageStateCache()
+    assert cache.needs_adjust("BTCUSDT", "isolated", 5)
+    cache.adjusted("BTCUSDT", "isolated", 5, ok=False)
+    assert cache.stats()["sent"] == 0
+    assert cache.needs_adjust("BTCUSDT", "isolated", 5)
+    cache.adjusted("BTCUSDT", "isolated", 5, ok=True)
+    assert not cache.needs_adjust("BTCUSDT", "isolated", 5)
+    assert cache.stats() == {"skipped": 1, "sent": 1, "known_markets": 1}
+
+
+def test_failed_adjust_forgets_the_known_state():
+    cache = LeverageStateCache()
+    cache.update("BTCUSDT", "isolated", 3)
+    cache.adjusted("BTCUSDT", "isolated", 5, ok=False)
+    assert cache.stats()["known_markets"] == 0
+
+
+def test_position_reads_refresh_the_leverage_state():
+    cache = LeverageStateCache()
+    cache.update_from_positions([{"market": "BTCUSDT", "margin_mode": "isolated", "leverage": "5"}])
+    assert not cache.needs_adjust("BTCUSDT", "isolated", 5)
+    # Alguien cambió el apalancamiento desde la web de CoinEx
+    cache.update_from_positions([{"market": "BTCUSDT", "margin_mode": "cross", "leverage": "10"}])
+    assert cache.needs_adjust("BTCUSDT", "isolated", 5)
+
+
+class FakeResponse(object):
+    status_code = 200
+
+    def __init__(self, filled_amount):
+        self.filled_amount = filled_amount
+
+    def json(self):
+        return {"code": 0, "data": {"filled_amount": str(self.filled_amount), "amount": "1.5"}}
+
+
+@pytest.mark.parametrize("filled, expected", [
+    (1.5, (0.5, 1.0)),  # Fill completo: cierra el short de 0.5 y abre 1.0
+    (1.2, (0.5, 0.7)),  # Fill parcial: la nueva posición es menor que la de la alerta
+    (0.3, (0.3, 0.0)),  # Ni siquiera cerró la anterior: no hay posición nueva que proteger
+])
+def test_flip_sizing_uses_the_filled_amount(filled, expected):
+    closed, opened = flip_fill(filled, 1.5, 1.0)
+    assert (closed, opened) == pytest.approx(expected)
+    cache = PositionCache(max_age=60)
+    cache.update_from_positions([{"market": "BTCUSDT", "side": "short", "open_interest": "0.5"}])
+    cache.record_fill("BTCUSDT", cache.take("BTCUSDT"), "buy", FakeResponse(filled))
+    # La posición que queda coincide con lo que el pipeline protege (o con lo que sigue abierto)
+    assert cache.get("BTCUSDT") == pytest.approx(opened if opened else closed - 0.5)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import urllib.error
+import urllib.request
+
+import pytest
+
+from metrics import Registry, serve
+
+
+def test_serve_exposes_registry_over_http():
+    registry = Registry()
+    registry.counter("ws_messages_total", "Mensajes websocket recibidos", ("stream", "method")) \
+        .labels("futures", "depth.update").inc(3)
+    server = serve(0, host="127.0.0.1", registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(url + "/metrics", timeout=2) as response:
+            body = response.read().decode("utf-8")
+        assert 'ws_messages_total{stream="futures",method="depth.update"} 3' in body
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + "/otra", timeout=2)
+    finally:
+        server.shutdown()
+        server.server_close()
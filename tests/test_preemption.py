@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+
+import pytest
+
+from preemption import MarketPreemption, Preempted
+
+
+def test_newer_ticket_preempts_older_execution_of_the_same_market():
+    preemption = MarketPreemption()
+    older, newer = preemption.arrive("BTCUSDT"), preemption.arrive("BTCUSDT")
+    other = preemption.arrive("ETHUSDT")
+    assert older < newer < other
+
+    preemption.claim("BTCUSDT", older)
+    preemption.claim("BTCUSDT", newer)
+    with pytest.raises(Preempted) as raised:
+        preemption.checkpoint("BTCUSDT", older)
+    assert (raised.value.ticket, raised.value.current) == (older, newer)
+    # La más vieja ya no puede volver a reclamar el mercado
+    with pytest.raises(Preempted):
+        preemption.claim("BTCUSDT", older)
+    preemption.checkpoint("BTCUSDT", newer)
+    preemption.checkpoint("ETHUSDT", other)  # Otro mercado no se ve afectado
+    assert preemption.stats() == {"preempted": 2, "current": {"BTCUSDT": newer, "ETHUSDT": 0}}
+
+
+def test_claim_waits_for_the_call_in_flight_and_stops_the_older_stage():
+    preemption = MarketPreemption()
+    older, newer = preemption.arrive("BTCUSDT"), preemption.arrive("BTCUSDT")
+    order_sent, release = threading.Event(), threading.Event()
+    events = []
+
+    def older_execution():
+        with preemption.stage("BTCUSDT", older, claim=True):
+            order_sent.set()
+            release.wait(2)
+            events.append("orden anterior")  # La llamada en vuelo termina
+        try:
+            with preemption.stage("BTCUSDT", older):
+                events.append("SL/TP anterior")
+        except Preempted:
+            events.append("anterior detenida")
+
+    def newer_close():
+        with preemption.stage("BTCUSDT", newer, claim=True):
+            events.append("cierre nuevo")
+
+    first = threading.Thread(target=older_execution)
+    first.start()
+    order_sent.wait(2)
+    second = threading.Thread(target=newer_close)
+    second.start()
+    deadline = time.monotonic() + 2
+    while preemption.stats()["current"]["BTCUSDT"] != newer and time.monotonic() < deadline:
+        time.sleep(0.001)  # El reclamo se anota antes de esperar al lock de etapa
+    assert events == []  # El cierre nuevo espera a la orden en vuelo
+    release.set()
+    first.join(2)
+    second.join(2)
+    assert events[0] == "orden anterior"
+    assert sorted(events[1:]) == ["anterior detenida", "cierre nuevo"]
+
+
+def test_async_stage_keeps_the_same_ordering():
+    preemption = MarketPreemption()
+    older, newer = preemption.arrive("BTCUSDT"), preemption.arrive("BTCUSDT")
+    events = []
+
+    async def older_execution(order_sent, release):
+        async with preemption.async_stage("BTCUSDT", older, claim=True):
+            order_sent.set()
+            await release.wait()
+            events.append("orden anterior")
+        try:
+            async with preemption.async_stage("BTCUSDT", older):
+                events.append("SL/TP anterior")
+        except Preempted:
+            events.append("anterior detenida")
+
+    async def newer_close():
+        async with preemption.async_stage("BTCUSDT", newer, claim=True):
+            events.append("cierre nuevo")
+
+    async def main():
+        order_sent, release = asyncio.Event(), asyncio.Event()
+        first = asyncio.ensure_future(older_execution(order_sent, release))
+        await order_sent.wait()
+        second = asyncio.ensure_future(newer_close())
+        await asyncio.sleep(0)
+        assert preemption.stats()["current"]["BTCUSDT"] == newer
+        release.set()
+        await asyncio.gather(first, second)
+
+    asyncio.run(main())
+    # asyncio.Lock atiende por orden de espera: el cierre nuevo va antes que la etapa vieja
+    assert events == ["orden anterior", "cierre nuevo", "anterior detenida"]
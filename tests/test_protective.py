@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from protective import ProtectiveStage
+
+
+class FakeResponse(object):
+    def json(self):
+        return {"code": 0}
+
+
+def failing_once():
+    calls = []
+
+    def set_stop_loss(price):
+        calls.append(price)
+        if len(calls) == 1:
+            raise requests.exceptions.ConnectionError("caída")
+        return FakeResponse()
+    return set_stop_loss
+
+
+def as_coroutine(func):
+    async def call(price):
+        return func(price)
+    return call
+
+
+def make_stage(set_stop_loss, set_take_profit, **options):
+    stage = ProtectiveStage(set_stop_loss, set_take_profit, **options)
+    for policy in stage.retry_policies.values():
+        policy.base_delay = 0
+    return stage
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_each_leg_counts_its_own_retries(run_async):
+    stage = make_stage(failing_once(), lambda price: FakeResponse())
+    if run_async:
+        sl, tp = asyncio.run(stage.run_async(as_coroutine(stage.set_stop_loss), as_coroutine(stage.set_take_profit),
+                                             99.0, 103.0, time.perf_counter()))
+    else:
+        sl, tp = stage.run(99.0, 103.0, time.perf_counter())
+    assert sl is not None and tp is not None
+    stats = stage.stats()
+    assert (stats["sl_retries"], stats["tp_retries"], stats["protected"]) == (1, 0, 1)
+
+
+def test_concurrent_alerts_do_not_queue_behind_each_other():
+    # Cuatro alertas a la vez con un pool de 4: cada una solo ocupa un hilo (el del TP)
+    barrier = threading.Barrier(8, timeout=2)
+
+    def leg(price):
+        barrier.wait()  # Solo pasa si las 8 patas están en marcha a la vez
+        return FakeResponse()
+    stage = make_stage(leg, leg, max_workers=4)
+    with ThreadPoolExecutor(max_workers=4) as alerts:
+        results = list(alerts.map(lambda n: stage.run(100.0 - n, 100.0 + n, time.perf_counter()), range(4)))
+    assert all(sl is not None and tp is not None for sl, tp in results)
+    assert stage.stats()["protected"] == 4
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import signal
+import time
+
+import pytest
+import requests
+
+from resilience import CircuitBreaker, CircuitOpenError, HedgedCaller, RetryPolicy, SingleFlight
+
+
+class FakeResponse(object):
+    def __init__(self, code=0):
+        self.code = code
+
+    def json(self):
+        return {"code": self.code}
+
+
+def flaky(failures, result):
+    """Función que falla `failures` veces con un error transitorio y luego devuelve `result`"""
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise requests.exceptions.ConnectionError("caída")
+        return result
+    return func, calls
+
+
+def as_coroutine(func):
+    async def wrapper():
+        return func()
+    return wrapper
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_retry_policy_recovers_from_transient_errors(run_async):
+    policy = RetryPolicy(max_attempts=3, base_delay=0)
+    response = FakeResponse()
+    func, calls = flaky(2, response)
+    if run_async:
+        result = asyncio.run(policy.call_async(as_coroutine(func)))
+    else:
+        result = policy.call(func)
+    assert result is response
+    assert len(calls) == 3
+    assert (policy.retries, policy.exhausted) == (2, 0)
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_retry_policy_gives_up_after_max_attempts(run_async):
+    policy = RetryPolicy(max_attempts=2, base_delay=0)
+    func, calls = flaky(5, FakeResponse())
+    with pytest.raises(requests.exceptions.ConnectionError):
+        if run_async:
+            asyncio.run(policy.call_async(as_coroutine(func)))
+        else:
+            policy.call(func)
+    assert len(calls) == 2
+    assert (policy.retries, policy.exhausted) == (1, 1)
+
+
+def test_retry_policy_does_not_retry_definitive_errors():
+    policy = RetryPolicy(max_attempts=3, base_delay=0)
+
+    def func():
+        raise KeyError("no transitorio")
+    with pytest.raises(KeyError):
+        policy.call(func)
+    assert (policy.retries, policy.exhausted) == (0, 0)
+
+
+def test_retry_policy_retries_busy_coinex_codes():
+    policy = RetryPolicy(max_attempts=3, base_delay=0)
+    responses = iter([FakeResponse(3008), FakeResponse(0)])
+    assert policy.call(lambda: next(responses)).code == 0
+    assert policy.retries == 1
+
+
+def test_single_flight_async_collapses_and_shares_cache():
+    flight = SingleFlight(ttl=60)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return FakeResponse()
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async("balance", fetch) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    # La respuesta correcta queda en la caché común con do()
+    assert flight.do("balance", lambda: pytest.fail("debía salir de la caché")) is results[0]
+    assert flight.stats() == {"upstream_calls": 1, "collapsed": 4, "cache_hits": 1}
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("resilience.time.monotonic", clock)
+    return clock
+
+
+def open_breaker(**options):
+    breaker = CircuitBreaker("order", min_calls=2, error_rate=0.5, cooldown=10.0, **options)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record(False, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_breaker_opens_on_error_rate_and_rejects_during_cooldown(clock):
+    breaker = open_breaker()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.status()["rejected"] == 1
+
+
+def test_breaker_opens_on_slow_calls(clock):
+    breaker = CircuitBreaker("account", min_calls=2, slow_call=1.0, slow_rate=0.5)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record(True, 1.5)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_half_open_allows_one_probe_and_closes_on_success(clock):
+    breaker = open_breaker()
+    clock.now += 10.0
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # Solo una llamada de prueba
+    breaker.record(True, 0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_breaker_reopens_when_probe_fails(clock):
+    breaker = open_breaker()
+    clock.now += 10.0
+    breaker.before_call()
+    breaker.record(False, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_breaker_release_frees_the_probe(clock):
+    breaker = open_breaker()
+    clock.now += 10.0
+    breaker.before_call()
+    breaker.release()  # Prueba cancelada sin resultado: otra puede intentarlo
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_hedge_waits_outside_the_latency_window():
+    hedger = HedgedCaller(max_workers=2)
+    window = hedger.window("/v2/futures/market")
+    window.default = 0.01
+    waits = []
+
+    def slow():
+        time.sleep(0.05)
+        return "respuesta"
+    # El turno del limitador (before_hedge) llega cuando la primera ya respondió: no hay copia
+    result = hedger.call("/v2/futures/market", slow, before_hedge=lambda: waits.append(time.sleep(0.1)))
+    assert result == "respuesta"
+    assert len(waits) == 1
+    assert hedger.hedges_sent == 0
+    assert list(window.samples) == [pytest.approx(0.05, abs=0.03)]
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_hedge_fires_after_the_window_and_the_faster_copy_wins(run_async):
+    hedger = HedgedCaller(max_workers=2)
+    hedger.window("/v2/futures/market").default = 0.01
+    started = []
+
+    def answer():
+        if not started:
+            started.append(True)
+            return 0.2, "primera"  # Se queda más allá de la ventana: sale la copia
+        return 0.0, "copia"
+
+    def slow():
+        delay, result = answer()
+        time.sleep(delay)
+        return result
+
+    async def slow_async():
+        delay, result = answer()
+        await asyncio.sleep(delay)
+        return result
+    if run_async:
+        result = asyncio.run(hedger.call_async("/v2/futures/market", slow_async))
+    else:
+        result = hedger.call("/v2/futures/market", slow)
+    assert result == "copia"
+    assert (hedger.hedges_sent, hedger.hedges_won) == (1, 1)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="sin fork")
+def test_hedge_gets_its_own_pool_after_fork():
+    hedger = HedgedCaller(max_workers=1)
+    assert hedger.call("/time", lambda: "padre") == "padre"  # Hilo del pool creado en el padre
+    pid = os.fork()
+    if pid == 0:
+        signal.alarm(5)  # Con el pool heredado la llamada se quedaría esperando para siempre
+        os._exit(0 if hedger.call("/time", lambda: "hijo") == "hijo" else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
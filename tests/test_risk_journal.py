@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+from datetime import datetime
+
+from risk_journal import RiskJournal
+from shared_state import SharedRiskState
+
+
+def make_state(tmp_path, **journal_options):
+    journal = RiskJournal(str(tmp_path / "risk_journal.bin"), SharedRiskState.JOURNALED, **journal_options)
+    return SharedRiskState(str(tmp_path / "risk_state"), journal=journal)
+
+
+def test_restore_after_losing_the_mapped_file(tmp_path):
+    state = make_state(tmp_path, compact_bytes=4096)
+    state["start_balance"] = 1000.0
+    for i in range(300):
+        state["last_balance"] = 1000.0 - i
+        state["consecutive_losses"] = i % 4
+    state.update({"paused": True, "pause_reason": "❌ Stop diario", "pause_time": datetime(2026, 10, 19, 12)})
+    before = state.snapshot()
+    assert state.journal.compactions > 0
+
+    os.remove(state.store.path)  # Reinicio: /dev/shm perdido
+    restored = make_state(tmp_path, compact_bytes=4096)
+    assert restored.snapshot() == before
+
+
+def test_torn_tail_is_discarded(tmp_path):
+    state = make_state(tmp_path)
+    state["consecutive_losses"] = 2
+    state["last_balance"] = 950.0
+    with open(str(tmp_path / "risk_journal.bin"), "ab") as f:
+        f.write(b"\x01\x02\x03")  # Escritura cortada por una caída
+
+    os.remove(state.store.path)
+    restored = make_state(tmp_path)
+    assert restored["consecutive_losses"] == 2
+    assert restored["last_balance"] == 950.0
+
+
+def test_daily_loss_is_not_journaled(tmp_path):
+    state = make_state(tmp_path)
+    size = os.path.getsize(str(tmp_path / "risk_journal.bin"))
+    for i in range(100):
+        state["daily_loss"] = i / 1000.0
+    assert state["daily_loss"] == 0.099
+    assert os.path.getsize(str(tmp_path / "risk_journal.bin")) == size
+
+    os.remove(state.store.path)
+    assert make_state(tmp_path)["daily_loss"] == 0.0  # Se recalcula con la siguiente alerta
+
+
+def test_fsync_runs_off_the_writer(tmp_path):
+    state = make_state(tmp_path, fsync=True)
+    state["consecutive_losses"] = 1
+    deadline = time.monotonic() + 2
+    while state.journal.syncs == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert state.journal.syncs >= 1
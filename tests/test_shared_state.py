@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from shared_state import MappedStruct, SharedRateLimiter, SharedRiskState
+
+FIELDS = (("a", "q"), ("b", "q"), ("c", "d"))
+
+
+def _writer(path, offset, rounds):
+    store = MappedStruct(path, FIELDS, {"a": 0, "b": 0, "c": 0.0})
+    for i in range(rounds):
+        value = offset + i
+        with store.lock:  # Actualización compuesta: los tres campos cambian juntos
+            store.write("a", value)
+            store.write("b", -value)
+            store.write("c", value * 0.5)
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="necesita fork")
+def test_seqlock_reads_are_consistent_under_concurrent_writers(tmp_path):
+    path = str(tmp_path / "state")
+    store = MappedStruct(path, FIELDS, {"a": 0, "b": 0, "c": 0.0})
+    context = multiprocessing.get_context("fork")
+    writers = [context.Process(target=_writer, args=(path, n * 1000000, 20000)) for n in range(1, 4)]
+    for writer in writers:
+        writer.start()
+
+    reads = 0
+    while any(writer.is_alive() for writer in writers) or reads == 0:
+        a, b, c = store.read_all()
+        assert b == -a and c == a * 0.5  # Nunca una mezcla de dos escrituras
+        reads += 1
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+
+    a, b, c = store.read_all()
+    assert a % 1000000 == 19999 and b == -a
+
+
+def test_dead_writer_sequence_is_repaired(tmp_path):
+    store = MappedStruct(str(tmp_path / "state"), FIELDS, {"a": 7, "b": 0, "c": 0.0})
+    seq = int.from_bytes(store.buffer[8:16], "little")
+    store.buffer[8:16] = (seq + 1).to_bytes(8, "little")  # Escritor muerto a mitad
+    assert store.read("a") == 7
+    assert store.read_all()[0] == 7
+
+
+def test_risk_state_values_decode_and_skip_unchanged_writes(tmp_path):
+    state = SharedRiskState(str(tmp_path / "risk"))
+    assert state.values("start_balance", "consecutive_losses", "paused") == [None, 0, False]
+    state["start_balance"] = 1000.0
+    assert not state.store.write("start_balance", 1000.0)  # Mismo valor: sin escritura
+    assert state.values("start_balance") == [1000.0]
+
+
+def test_rate_limiter_is_shared_by_instances(tmp_path):
+    path = str(tmp_path / "limits")
+    first, second = SharedRateLimiter(path, {"order": 2}), SharedRateLimiter(path, {"order": 2})
+    assert first.reserve("order") == 0.0
+    assert second.reserve("order") == 0.0
+    assert first.reserve("order") == pytest.approx(0.5, abs=0.05)  # El tercero en el mismo segundo espera
+    time.sleep(1.1)  # Repone su deuda de medio segundo y un token más
+    assert second.reserve("order") == 0.0
+
+
+def test_writer_reads_its_own_compound_update(tmp_path):
+    store = MappedStruct(str(tmp_path / "state"), FIELDS, {"a": 0, "b": 0, "c": 0.0})
+    with store.lock:
+        store.write("a", 5)
+        assert store.read("a") == 5  # Sin esperar a que la secuencia vuelva a par
+        assert store.read_all()[0] == 5
+        store.write("b", -5)
+    seq = int.from_bytes(store.buffer[8:16], "little")
+    assert seq % 2 == 0 and store.read_all()[:2] == (5, -5)
+
+
+def test_other_layout_never_resizes_a_mapped_file(tmp_path):
+    path = str(tmp_path / "limits")
+    first = SharedRateLimiter(path, {"order": 2})
+    first.reserve("order")
+    size = os.path.getsize(first.store.path)
+    # Otro proceso con otros grupos (otra disposición): su propio archivo
+    other = SharedRateLimiter(path, {"order": 2, "account": 5})
+    assert other.store.path != first.store.path and other.store.created
+    assert os.path.getsize(first.store.path) == size
+    assert first.reserve("order") == 0.0  # El presupuesto ya gastado sigue ahí
+    assert first.reserve("order") == pytest.approx(0.5, abs=0.05)
+
+
+def test_existing_file_that_does_not_match_is_never_reset(tmp_path):
+    store = MappedStruct(str(tmp_path / "state"), FIELDS, {"a": 1, "b": 0, "c": 0.0})
+    with open(store.path, "r+b") as f:
+        f.write(b"XXXX")
+    with pytest.raises(ValueError):
+        MappedStruct(str(tmp_path / "state"), FIELDS, {"a": 0, "b": 0, "c": 0.0})
+    with open(store.path, "ab") as f:
+        f.write(b"\0")
+    with pytest.raises(ValueError):
+        MappedStruct(str(tmp_path / "state"), FIELDS, {"a": 0, "b": 0, "c": 0.0})
+    assert store.read("a") == 1
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timezone
+
+import pytest
+
+from staleness import ALERT_TIME_FIELDS, StalenessPolicy, alert_time, parse_alert_time, parse_max_ages
+
+STAMP = datetime(2024, 5, 1, 12, 0, 0, tzinfo=timezone.utc).timestamp()
+
+
+class FixedClock(object):
+    def __init__(self, now):
+        self._now = now
+
+    def now(self):
+        return self._now
+
+
+@pytest.mark.parametrize("value", [
+    STAMP, int(STAMP), STAMP * 1000, str(int(STAMP * 1000)), str(STAMP),
+    "2024-05-01T12:00:00Z", "2024-05-01T14:00:00+02:00", "2024-05-01T12:00:00",
+])
+def test_parse_alert_time_formats(value):
+    assert parse_alert_time(value) == pytest.approx(STAMP)
+
+
+@pytest.mark.parametrize("value", [None, "", "ayer", True, False, "nan", "inf", "-inf", float("nan"), float("inf"), 10 ** 400])
+def test_parse_alert_time_rejects(value):
+    assert parse_alert_time(value) is None
+
+
+@pytest.mark.parametrize("field", ALERT_TIME_FIELDS)
+def test_alert_time_accepts_each_field(field):
+    assert alert_time({field: "2024-05-01T12:00:00Z"}) == pytest.approx(STAMP)
+
+
+def test_alert_time_ignores_bar_time():
+    # {{time}} de TradingView es la apertura de la vela, no la hora de la alerta
+    assert alert_time({"time": "2024-05-01T12:00:00Z"}) is None
+
+
+def test_alert_time_priority_and_fallback():
+    assert alert_time({"timestamp": STAMP - 50, "timenow": STAMP}) == pytest.approx(STAMP)
+    assert alert_time({"timenow": "basura", "alert_time": STAMP}) == pytest.approx(STAMP)
+    assert alert_time({"timenow": "nan", "timestamp": STAMP}) == pytest.approx(STAMP)
+
+
+def test_policy_judges_by_strategy():
+    policy = StalenessPolicy(FixedClock(STAMP + 5), max_age=10, per_strategy=parse_max_ages("scalp=3"))
+    assert policy.judge({"sent_at": STAMP}) == (pytest.approx(5), "execute")
+    assert policy.judge({"sent_at": STAMP, "strategy": "scalp"}) == (pytest.approx(5), "drop")
+    assert policy.judge({}) == (None, "execute")
+
+
+def test_policy_close_only_and_disabled():
+    assert StalenessPolicy(FixedClock(STAMP + 60), 10, action="close_only").judge({"sent_at": STAMP})[1] == "close_only"
+    assert StalenessPolicy(FixedClock(STAMP + 60), 0).judge({"sent_at": STAMP})[1] == "execute"
+    with pytest.raises(ValueError):
+        StalenessPolicy(FixedClock(STAMP), action="ignore")
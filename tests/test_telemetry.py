@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import os
+import time
+
+from telemetry import RETRY, SENT, TelemetrySink
+
+
+def make_sink(tmp_path, **options):
+    return TelemetrySink("http://127.0.0.1:9/azure", str(tmp_path / "spool.ndjson"),
+                         flush_interval=0.05, **options)
+
+
+def test_replay_sends_spool_and_removes_it(tmp_path):
+    sink = make_sink(tmp_path)
+    sink._spool([json.dumps({"n": i}) for i in range(3)])
+    posted = []
+    sink._post = lambda lines: posted.extend(lines) or SENT
+    sink._replay_spool()
+    assert [json.loads(line)["n"] for line in posted] == [0, 1, 2]
+    assert sink.replayed == 3
+    assert not os.path.exists(sink.spool_path) and not os.path.exists(sink.spool_path + ".replay")
+
+
+def test_failed_replay_keeps_events_in_spool(tmp_path):
+    sink = make_sink(tmp_path)
+    sink._spool(["a", "b"])
+    sink._post = lambda lines: RETRY
+    sink._replay_spool()
+    with open(sink.spool_path) as spool:
+        assert spool.read().split() == ["a", "b"]
+
+
+def test_replay_skips_while_another_sink_replays(tmp_path):
+    # Otro worker con el mismo spool: mientras reenvía, este no toca el archivo
+    first, second = make_sink(tmp_path), make_sink(tmp_path)
+    second._spool(["x"])
+    second._post = lambda lines: SENT
+    assert first.replay_lock.try_acquire()
+    try:
+        second._replay_spool()
+        assert second.replayed == 0
+    finally:
+        first.replay_lock.release()
+    second._replay_spool()
+    assert second.replayed == 1
+
+
+def test_replay_tolerates_missing_replay_file(tmp_path, monkeypatch):
+    sink = make_sink(tmp_path)
+    sink._spool(["x"])
+    real_remove = os.remove
+
+    def remove_twice(path):
+        real_remove(path)
+        raise FileNotFoundError(path)
+    sink._post = lambda lines: SENT
+    monkeypatch.setattr(os, "remove", remove_twice)
+    sink._replay_spool()  # No lanza
+    assert sink.replayed == 1
+
+
+def test_sender_thread_survives_unexpected_errors(tmp_path):
+    sink = make_sink(tmp_path)
+    calls = []
+
+    def post(lines):
+        calls.append(lines)
+        if len(calls) == 1:
+            raise RuntimeError("fallo inesperado")
+        return SENT
+    sink._post = post
+    sink.start()
+    sink.emit({"n": 1})
+    deadline = time.monotonic() + 2
+    while len(calls) < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sink.emit({"n": 2})
+    while sink.sent < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sink._thread.is_alive()
+    assert sink.sent >= 1
+    assert sink.spooled == 1  # El lote que falló quedó en el spool
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = "rechazado" if status_code >= 400 else ""
+
+
+def answers(*statuses):
+    """session.post que responde con `statuses` en orden y luego siempre 200"""
+    bodies = []
+    pending = list(statuses)
+
+    def post(url, data=None, headers=None, timeout=None):
+        bodies.append(gzip.decompress(data).decode("utf-8").split())
+        return FakeResponse(pending.pop(0) if pending else 200)
+    return post, bodies
+
+
+def test_rejected_batch_goes_to_dead_file_and_later_batches_are_delivered(tmp_path):
+    sink = make_sink(tmp_path, batch_size=2)
+    sink.session.post, bodies = answers(400)
+    sink._spool(["a", "b", "c", "d", "e"])
+    sink._replay_spool()
+    # El primer trozo (rechazado) no bloquea los siguientes ni vuelve al spool
+    assert bodies == [["a", "b"], ["c", "d"], ["e"]]
+    assert sink.replayed == 3 and sink.rejected == 2
+    assert not os.path.exists(sink.spool_path)
+    with open(sink.dead_path) as dead:
+        assert dead.read().split() == ["a", "b"]
+
+    sink.session.post, bodies = answers(413)
+    sink.emit({"n": 1})
+    sink._flush_next()  # Rechazado: al .dead, no al spool
+    sink.emit({"n": 2})
+    sink._flush_next()
+    assert [json.loads(line)["n"] for line in bodies[1]] == [2]
+    assert (sink.sent, sink.rejected, sink.spooled) == (1, 3, 5)
+    assert not os.path.exists(sink.spool_path)
+
+
+def test_spool_is_capped(tmp_path):
+    sink = make_sink(tmp_path, max_spool_bytes=10)
+    sink._spool(["0123"])
+    sink._spool(["456789"])  # No cabe: se descarta
+    with open(sink.spool_path) as spool:
+        assert spool.read().split() == ["0123"]
+    assert (sink.spooled, sink.dropped) == (1, 1)
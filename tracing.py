@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Trazas por alerta: spans con perf_counter_ns en un ring buffer en memoria."""
+import threading
+import time
+from collections import deque
+
+
+class _Span(object):
+    __slots__ = ("trace", "name", "tags", "start_ns")
+
+    def __init__(self, trace, name, tags):
+        self.trace = trace
+        self.name = name
+        self.tags = tags
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        tags = self.tags
+        if exc_type is not None:
+            tags = dict(tags or {}, error=exc_type.__name__)
+        self.trace.add_span(self.name, self.start_ns, time.perf_counter_ns(), tags)
+        return False
+
+    # También con `async with`, junto a una etapa del pipeline (`io.stage()`)
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class Trace(object):
+    """Spans de una alerta, desde que llega al webhook hasta que la posición queda protegida"""
+
+    __slots__ = ("alert_id", "market", "start_ns", "end_ns", "status", "spans")
+
+    def __init__(self, alert_id=None, market=None):
+        self.alert_id = alert_id
+        self.market = market
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.status = "in_progress"
+        self.spans = []  # (nombre, inicio_ns, fin_ns, tags)
+
+    def span(self, name, **tags):
+        """Context manager que mide un tramo del pipeline"""
+        return _Span(self, name, tags or None)
+
+    def add_span(self, name, start_ns, end_ns, tags=None):
+        # list.append es atómico: los spans de SL y TP llegan desde hilos distintos
+        self.spans.append((name, start_ns, end_ns, tags))
+
+    def to_dict(self):
+        end_ns = self.end_ns or time.perf_counter_ns()
+        return {
+            "alert_id": self.alert_id,
+            "market": self.market,
+            "status": self.status,
+            "total_us": (end_ns - self.start_ns) // 1000,
+            "spans": [
+                {
+                    "name": name,
+                    "offset_us": (start - self.start_ns) // 1000,
+                    "duration_us": (end - start) // 1000,
+                    "tags": tags or {},
+                }
+                for name, start, end, tags in sorted(self.spans, key=lambda s: s[1])
+            ],
+        }
+
+
+class Tracer(object):
+    """Guarda las últimas `capacity` trazas terminadas"""
+
+    def __init__(self, capacity=256, stage_histogram=None):
+        self.finished = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+        self.stage_histogram = stage_histogram  # Histograma con etiqueta `stage`
+
+    def start(self, alert_id=None, market=None):
+        return Trace(alert_id, market)
+
+    def finish(self, trace, status):
+        trace.end_ns = time.perf_counter_ns()
+        trace.status = status
+        if self.stage_histogram is not None:
+            for name, start_ns, end_ns, _ in trace.spans:
+                self.stage_histogram.labels(name).observe((end_ns - start_ns) / 1e9)
+        with self.lock:
+            self.finished.append(trace)
+
+    def query(self, market=None, alert_id=None, limit=50):
+        """Trazas más recientes primero, filtradas por mercado y/o alert_id"""
+        with self.lock:
+            traces = list(self.finished)
+        result = []
+        for trace in reversed(traces):
+            if market and trace.market != market:
+                continue
+            if alert_id and trace.alert_id != alert_id:
+                continue
+            result.append(trace.to_dict())
+            if len(result) >= limit:
+                break
+        return result
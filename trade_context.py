@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Contexto por alerta: eventos de una sola operación, con capacidad fija."""
+import time
+import uuid
+from datetime import datetime, timedelta
+
+
+class TradeContext(object):
+    """Eventos de una alerta desde que se encola hasta que la operación termina"""
+
+    __slots__ = ("alert_id", "market", "alert", "started", "started_wall", "status", "trace",
+                 "stages", "_buffer", "_count", "dropped")
+
+    CAPACITY = 32  # Máximo de eventos por operación; el resto se cuenta en `dropped`
+
+    def __init__(self, market, alert_id=None, capacity=CAPACITY, alert=None):
+        self.alert_id = alert_id or uuid.uuid4().hex[:12]
+        self.market = market
+        self.alert = alert  # Alerta propia: nada del pipeline se lee de globales
+        self.started = time.monotonic()
+        self.started_wall = datetime.utcnow()
+        self.status = "pending"
+        self.trace = None
+        self.stages = None  # AlertStages del journal (solo con ALERT_JOURNAL_PATH)
+        self._buffer = [None] * capacity
+        self._count = 0
+        self.dropped = 0
+
+    def log_event(self, step, data):
+        if self._count < len(self._buffer):
+            self._buffer[self._count] = (step, time.monotonic(), data)
+            self._count += 1
+        else:
+            self.dropped += 1
+
+    def __len__(self):
+        return self._count
+
+    def events(self):
+        """Eventos en el formato que espera Azure (timestamp ISO + ms desde la alerta)"""
+        result = []
+        for step, at, data in self._buffer[:self._count]:
+            offset = at - self.started
+            result.append({
+                "step": step,
+                "timestamp": (self.started_wall + timedelta(seconds=offset)).isoformat(),
+                "elapsed_ms": round(offset * 1000, 3),
+                "data": data,
+            })
+        return result
+
+    def finish(self, status):
+        self.status = status
+        return self
@@ -4,12 +4,19 @@ import websocket
 from websocket import WebSocketApp
 import json
 import gzip
+import os
 import zlib
+from metrics import REGISTRY, serve as serve_metrics
 
 
 # URL = "wss://socket.coinex.com/v2/spot"
 URL = "wss://socket.coinex.com/v2/futures"
 
+# /metrics propio: este cliente corre en su propio proceso, fuera de Flask; 0 lo desactiva
+METRICS_PORT = int(os.getenv("WS_DEPTH_METRICS_PORT", "9109"))
+WS_MESSAGES = REGISTRY.counter("ws_messages_total", "Mensajes websocket recibidos", ("stream", "method"))
+ORDERBOOK_RESYNCS = REGISTRY.counter("orderbook_resyncs_total", "Resincronizaciones del libro por checksum", ("market",))
+
 
 class websocketTest(object):
     def __init__(self):
@@ -74,10 +81,14 @@ class websocketTest(object):
             print("checksum success")
         else:
             print("checksum failed !!!!!!!")
+            # Libro corrupto: se vuelve a suscribir para recibir un snapshot completo
+            ORDERBOOK_RESYNCS.labels(message['data'].get('market', '')).inc()
+            self.depth_subscribe()
 
     def on_message(self, ws, message):
         message = gzip.decompress(message)
         message_json = json.loads(message)
+        WS_MESSAGES.labels("depth", message_json.get("method", "response")).inc()
         
         if "method" in message_json:
             if message_json["method"] == "depth.update":
@@ -123,4 +134,6 @@ class websocketTest(object):
 
 
 if __name__ == '__main__':
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
     websocketTest().start()
\ No newline at end of file
@@ -7,17 +7,34 @@ import time
 import hashlib
 import gzip
 import hmac
+import os
 import env
+from metrics import REGISTRY, serve as serve_metrics
+from shared_state import default_rate_limiter
 
-WS_URL = "wss://socket.coinex.com/v2/futures"  # Change "spot" to "futures" when interacting with WS ports
+WS_URL = os.getenv("COINEX_WS_URL", "wss://socket.coinex.com/v2/futures")  # Change "spot" to "futures" when interacting with WS ports
 access_id = "ACCESS_ID"  # Replace with your access id
 secret_key = "SECRET_KEY"  # Replace with your secret key
 
+# /metrics propio al ejecutarse suelto (dentro de async_server.py ya lo expone el servidor); 0 lo desactiva
+METRICS_PORT = int(os.getenv("WS_MAIN_METRICS_PORT", "9108"))
+WS_MESSAGES = REGISTRY.counter("ws_messages_total", "Mensajes websocket recibidos", ("stream", "method"))
+
+# Mismo archivo de límites que los workers REST: los envíos gastan del grupo "websocket"
+rate_limits = default_rate_limiter()
+
+
+async def send(conn, param):
+    wait_time = rate_limits.reserve("websocket")
+    if wait_time > 0:
+        await asyncio.sleep(wait_time)
+    await conn.send(json.dumps(param))
+
 
 async def ping(conn):
     param = {"method": "server.ping", "params": {}, "id": 1}
     while True:
-        await conn.send(json.dumps(param))
+        await send(conn, param)
         await asyncio.sleep(3)
 
 
@@ -45,7 +62,7 @@ async def auth(conn):
         },
         "id": 1,
     }
-    await conn.send(json.dumps(param))
+    await send(conn, param)
     res = await conn.recv()
     res = gzip.decompress(res)
     print("Authentication Result: ", json.loads(res))
@@ -57,7 +74,7 @@ async def subscribe_depth(conn):
         "params": {"market_list": [["BTCUSDT", 5, "0", True]]},
         "id": 1,
     }
-    await conn.send(json.dumps(param))
+    await send(conn, param)
     res = await conn.recv()
     res = gzip.decompress(res)
     print(json.loads(res))
@@ -65,7 +82,7 @@ async def subscribe_depth(conn):
 
 async def subscribe_asset(conn):
     param = {"method": "balance.subscribe", "params": {"ccy_list": ["USDT"]}, "id": 1}
-    await conn.send(json.dumps(param))
+    await send(conn, param)
     res = await conn.recv()
     res = gzip.decompress(res)
     print(json.loads(res))
@@ -87,10 +104,13 @@ async def main():
                 res = await conn.recv()
                 res = gzip.decompress(res)
                 res = json.loads(res)
+                WS_MESSAGES.labels("futures", res.get("method", "response")).inc()
                 print(res)
     except Exception as e:
         print(f"An error occurred: {e}")
 
 
 if __name__ == "__main__":
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
     asyncio.run(main())
\ No newline at end of file